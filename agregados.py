@@ -0,0 +1,233 @@
+# Agregados materializados para la pestaña Resumen (y los gráficos que los reutilizan).
+# Cada parte depende de una hoja lógica y guarda la firma de la versión con la que
+# se calculó. Al cargar solo se recalculan las partes cuya hoja cambió, y los
+# guardados de Ventas / Detalle_Venta se aplican como deltas sobre los grupos
+# afectados, sin recorrer el historial completo.
+import json
+import os
+import threading
+
+import pandas as pd
+
+from diario import calcular_cambios
+
+RUTA_AGREGADOS = 'data/agregados.json'
+
+# Parte materializada -> hoja lógica de la que depende
+PARTES = {
+    'ventas': 'Ventas',
+    'productos': 'Detalle_Venta',
+    'alertas': 'Alertas',
+    'stock': 'Inventario_Dispensario',
+}
+
+_CLAVES_VENTAS = ['fecha', 'dispensario_id']
+
+# Columnas que necesita cada parte en su hoja
+COLUMNAS_PARTES = {
+    'ventas': ['fecha_venta', 'total'],
+    'productos': ['producto_id', 'cantidad'],
+    'alertas': ['estado'],
+    'stock': ['cantidad', 'stock_minimo'],
+}
+
+
+# Ventas agrupadas por día y dispensario: total, cantidad de ventas y
+# cantidad de ventas con total válido
+def _contribucion_ventas(df):
+    if df is None or 'total' not in df.columns or 'fecha_venta' not in df.columns:
+        return pd.DataFrame(columns=_CLAVES_VENTAS + ['total', 'ventas', 'ventas_con_total'])
+    grupos = pd.DataFrame({
+        'fecha': df['fecha_venta'].dt.normalize(),
+        'dispensario_id': df['dispensario_id'] if 'dispensario_id' in df.columns else pd.NA,
+        'total': df['total'],
+        'ventas': 1,
+        'ventas_con_total': df['total'].notna().astype('int64'),
+    })
+    return (grupos.groupby(_CLAVES_VENTAS, dropna=False)
+            .agg(total=('total', 'sum'), ventas=('ventas', 'sum'),
+                 ventas_con_total=('ventas_con_total', 'sum'))
+            .reset_index())
+
+
+def _contribucion_productos(df):
+    if df is None or 'producto_id' not in df.columns or 'cantidad' not in df.columns:
+        return pd.Series(dtype='float64')
+    validas = df.dropna(subset=['producto_id', 'cantidad'])
+    return validas.groupby('producto_id')['cantidad'].sum().astype('float64')
+
+
+def _resumen_alertas(df):
+    if df is None or 'estado' not in df.columns:
+        return None
+    resumen = {'por_estado': {str(k): int(v) for k, v in df.groupby('estado').size().items()}}
+    if 'prioridad' in df.columns:
+        activas = df[df['estado'] == 'Activa']
+        resumen['activas_por_prioridad'] = {
+            str(k): int(v) for k, v in activas.groupby('prioridad').size().items() if v
+        }
+    return resumen
+
+
+def _resumen_stock(df):
+    if df is None or 'cantidad' not in df.columns or 'stock_minimo' not in df.columns:
+        return None
+    return int((df['cantidad'] <= df['stock_minimo']).sum())
+
+
+def _firma_json(firma):
+    # Las firmas se comparan después de pasar por JSON (las tuplas pasan a listas)
+    return json.loads(json.dumps(firma, default=str))
+
+
+class AgregadosResumen:
+    def __init__(self, ruta=RUTA_AGREGADOS):
+        self.ruta = ruta
+        self.firmas = {}
+        self.ventas = _contribucion_ventas(None)
+        self.productos = _contribucion_productos(None)
+        self.alertas = None
+        self.stock = None
+        # parte -> si su hoja tenía las columnas que usa (al último recálculo)
+        self.disponibles = {}
+        self._lock = threading.RLock()
+        self._cargar()
+
+    # Recalcula las partes cuya hoja cambió. `firmas` es {parte: firma} y
+    # `leer(parte)` devuelve el DataFrame de la hoja de esa parte.
+    def sincronizar(self, firmas, leer):
+        with self._lock:
+            cambios = False
+            for parte, firma in firmas.items():
+                firma = _firma_json(firma)
+                if firma is not None and self.firmas.get(parte) == firma:
+                    continue
+                self._recalcular(parte, leer(parte))
+                self.firmas[parte] = firma
+                cambios = True
+            if cambios:
+                self._guardar()
+
+    # Se llama después de guardar `hoja_logica`. Las partes de otras hojas solo
+    # actualizan su firma (su contenido no cambió); la parte de la hoja guardada
+    # se actualiza con el delta entre `original` y `editado` cuando es posible.
+    def registrar_guardado(self, hoja_logica, firmas_antes, firmas_despues, original=None, editado=None):
+        with self._lock:
+            for parte, hoja in PARTES.items():
+                antes = _firma_json(firmas_antes.get(parte))
+                if parte not in firmas_despues or self.firmas.get(parte) != antes:
+                    continue
+                if hoja != hoja_logica:
+                    self.firmas[parte] = _firma_json(firmas_despues[parte])
+                elif parte in ('ventas', 'productos') and original is not None and editado is not None:
+                    if self._aplicar_delta(parte, original, editado):
+                        self.firmas[parte] = _firma_json(firmas_despues[parte])
+                    else:
+                        self.firmas.pop(parte, None)
+                else:
+                    self.firmas.pop(parte, None)
+            self._guardar()
+
+    # Consultas
+    def disponible(self, parte):
+        return self.disponibles.get(parte, False)
+
+    def total_ventas(self):
+        return float(self.ventas['total'].sum())
+
+    def ventas_en_fecha(self, fecha):
+        dia = pd.Timestamp(fecha).normalize()
+        return int(self.ventas.loc[self.ventas['fecha'] == dia, 'ventas'].sum())
+
+    def ventas_por_dia(self):
+        validas = self.ventas[self.ventas['fecha'].notna() & (self.ventas['ventas_con_total'] > 0)]
+        por_dia = validas.groupby('fecha')['total'].sum()
+        por_dia.index = por_dia.index.date
+        return por_dia.rename_axis('fecha_venta').reset_index()
+
+    def ventas_por_dispensario(self):
+        return self.ventas.groupby('dispensario_id')['total'].sum()
+
+    def cantidad_por_producto(self):
+        return self.productos.rename('cantidad')
+
+    def _recalcular(self, parte, df):
+        self.disponibles[parte] = df is not None and all(c in df.columns for c in COLUMNAS_PARTES[parte])
+        if parte == 'ventas':
+            self.ventas = _contribucion_ventas(df)
+        elif parte == 'productos':
+            self.productos = _contribucion_productos(df)
+        elif parte == 'alertas':
+            self.alertas = _resumen_alertas(df)
+        elif parte == 'stock':
+            self.stock = _resumen_stock(df)
+
+    def _aplicar_delta(self, parte, original, editado):
+        cambios = calcular_cambios(original, editado)
+        if cambios is None:
+            return False
+        actualizados = cambios['actualizados'].index
+        anteriores = original.loc[list(cambios['eliminados']) + list(actualizados)]
+        nuevas = pd.concat([editado.loc[actualizados], cambios['insertados']])
+
+        if parte == 'ventas':
+            restar = _contribucion_ventas(anteriores)
+            restar[['total', 'ventas', 'ventas_con_total']] *= -1
+            combinado = pd.concat([self.ventas, _contribucion_ventas(nuevas), restar])
+            combinado = (combinado.groupby(_CLAVES_VENTAS, dropna=False)
+                         [['total', 'ventas', 'ventas_con_total']].sum().reset_index())
+            self.ventas = combinado[combinado['ventas'] != 0].reset_index(drop=True)
+        else:
+            combinado = pd.concat([self.productos, _contribucion_productos(nuevas),
+                                   -_contribucion_productos(anteriores)])
+            self.productos = combinado.groupby(level=0).sum()
+        return True
+
+    def _cargar(self):
+        if not self.ruta or not os.path.exists(self.ruta):
+            return
+        try:
+            with open(self.ruta, encoding='utf-8') as f:
+                datos = json.load(f)
+            ventas = pd.DataFrame(datos['ventas'], columns=_CLAVES_VENTAS + ['total', 'ventas', 'ventas_con_total'])
+            ventas['fecha'] = pd.to_datetime(ventas['fecha'])
+            ventas['dispensario_id'] = ventas['dispensario_id'].astype('Int64')
+            productos = pd.Series(datos['productos']['cantidad'], index=datos['productos']['producto_id'],
+                                  dtype='float64')
+            productos.index.name = 'producto_id'
+        except (OSError, ValueError, KeyError):
+            # Un archivo dañado solo obliga a recalcular
+            return
+        self.ventas = ventas
+        self.productos = productos
+        self.alertas = datos.get('alertas')
+        self.stock = datos.get('stock')
+        self.disponibles = datos.get('disponibles', {})
+        # Archivos anteriores sin disponibilidad: esas partes se recalculan
+        self.firmas = {parte: firma for parte, firma in datos.get('firmas', {}).items()
+                       if parte in self.disponibles}
+
+    def _guardar(self):
+        if not self.ruta:
+            return
+        ventas = self.ventas.copy()
+        # Con la parte de ventas todavía sin calcular, la columna está vacía y sin tipo
+        ventas['fecha'] = pd.to_datetime(ventas['fecha']).dt.strftime('%Y-%m-%d')
+        datos = {
+            'firmas': self.firmas,
+            'ventas': json.loads(ventas.to_json(orient='values')),
+            'productos': {
+                'producto_id': [int(i) for i in self.productos.index],
+                'cantidad': [float(v) for v in self.productos.values],
+            },
+            'alertas': self.alertas,
+            'stock': self.stock,
+            'disponibles': self.disponibles,
+        }
+        directorio = os.path.dirname(self.ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        temporal = self.ruta + '.tmp'
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump(datos, f, ensure_ascii=False)
+        os.replace(temporal, self.ruta)
@@ -0,0 +1,482 @@
+# Backends de almacenamiento para los datos del sistema.
+# AlmacenExcel mantiene el formato histórico (data/db.xlsx); AlmacenParquet guarda
+# un archivo Parquet por hoja con columnas tipadas, mucho más rápido de leer y
+# escribir, y permite leer solo las columnas y las filas necesarias.
+import argparse
+import hashlib
+import json
+import os
+import re
+
+import pandas as pd
+
+from bloqueos import BloqueoArchivo, reemplazo_atomico
+from cache_libros import CacheLibros, clave_archivo, hojas_libro, identificar_origen, leer_libro
+from diario import AlmacenConDiario
+from esquemas import Tipado, a_valores_excel
+from filtros import dividir_predicados, filtrar
+
+# pyarrow es opcional (sin él solo está disponible el backend Excel) y es de las
+# importaciones más pesadas: se importa recién cuando se usa Parquet
+pa = None
+pq = None
+
+
+# Importa pyarrow la primera vez que se llama. Devuelve pyarrow.parquet, o
+# None si pyarrow no está instalado.
+def importar_pyarrow():
+    global pa, pq
+    if pq is None:
+        try:
+            import pyarrow as _pa
+            import pyarrow.parquet as _pq
+        except ImportError:
+            return None
+        pa, pq = _pa, _pq
+    return pq
+
+RUTA_DB = 'data/db.xlsx'
+DIRECTORIO_PARQUET = 'data/parquet'
+
+# Filas por row group al escribir Parquet: grupos más chicos permiten descartar
+# más datos al leer con filtros (cada grupo guarda el mínimo y máximo de cada columna)
+FILAS_POR_GRUPO = 64 * 1024
+
+# Nombres de hoja que se usan tal cual como nombre de archivo
+_NOMBRE_ARCHIVO_SEGURO = re.compile(r'[A-Za-z0-9_](?:[A-Za-z0-9_ \-]*[A-Za-z0-9_\-])?')
+# Nombres reservados de Windows (también con extensión, como CON.parquet)
+_RESERVADOS_WINDOWS = {'CON', 'PRN', 'AUX', 'NUL'} | {f'{p}{i}' for p in ('COM', 'LPT') for i in range(1, 10)}
+# Caracteres que Excel no admite en el nombre de una hoja
+_PROHIBIDOS_EXCEL = set('[]:*?/\\')
+LARGO_MAXIMO_HOJA = 31
+
+
+# Nombre de archivo (sin extensión) de una hoja en el almacén Parquet. Los
+# nombres con separadores, '..' o caracteres que algún sistema no admite se
+# reemplazan por una versión segura más un hash del nombre real; el nombre real
+# queda en el manifiesto.
+def nombre_archivo_hoja(hoja):
+    if _NOMBRE_ARCHIVO_SEGURO.fullmatch(hoja) and hoja.upper() not in _RESERVADOS_WINDOWS:
+        return hoja
+    legible = re.sub(r'[^A-Za-z0-9_-]+', '_', hoja).strip('_')[:40] or 'hoja'
+    return f"{legible}-{hashlib.sha1(hoja.encode('utf-8')).hexdigest()[:12]}"
+
+
+# Valida el nombre de una hoja nueva con las reglas de Excel, que valen para
+# los dos backends. Lanza ValueError con el motivo.
+def validar_nombre_hoja(nombre):
+    if not nombre or not nombre.strip():
+        raise ValueError("El nombre de la hoja no puede estar vacío")
+    if len(nombre) > LARGO_MAXIMO_HOJA:
+        raise ValueError(f"El nombre de la hoja no puede tener más de {LARGO_MAXIMO_HOJA} caracteres")
+    prohibidos = sorted(set(nombre) & _PROHIBIDOS_EXCEL)
+    if prohibidos:
+        raise ValueError(f"El nombre de la hoja no puede contener {' '.join(prohibidos)}")
+    if nombre.startswith("'") or nombre.endswith("'"):
+        raise ValueError("El nombre de la hoja no puede empezar ni terminar con un apóstrofo")
+
+
+class AlmacenExcel:
+    tipo = 'xlsx'
+
+    def __init__(self, ruta=RUTA_DB, cache=None, preparar=None):
+        self.ruta = ruta
+        self.cache = cache if cache is not None else CacheLibros.desde_entorno()
+        self.preparar = preparar
+        self.bloqueo = BloqueoArchivo(ruta + '.lock')
+
+    def existe(self):
+        return os.path.exists(self.ruta)
+
+    # Firma que cambia cada vez que se reescribe el archivo base (o, con el
+    # vigilante activo, cada vez que se publica una versión nueva)
+    def firma(self, hoja=None):
+        if not self.existe():
+            return None
+        return self.cache.clave_vigente(self.ruta, self.preparar)
+
+    def hojas(self):
+        if not self.existe():
+            return []
+        return hojas_libro(self.cache, self.ruta, self.preparar)
+
+    # Todas las hojas están en el mismo archivo
+    def ruta_hoja(self, hoja):
+        return self.ruta
+
+    # Las hojas de Excel no se pueden consultar sin parsearlas
+    def ruta_parquet(self, hoja):
+        return None
+
+    def leer_todas(self):
+        if not self.existe():
+            return {}
+        return leer_libro(self.cache, self.ruta, self.preparar)
+
+    # Solo se parsea la hoja pedida (si no está ya en la caché). Excel no permite
+    # leer por rangos de filas: los `filtros` se aplican sobre la hoja cacheada.
+    def leer(self, hoja, columnas=None, filtros=None):
+        if not self.existe():
+            return None
+        df = leer_libro(self.cache, self.ruta, self.preparar, hojas=[hoja]).get(hoja)
+        if df is None:
+            return None
+        df = filtrar(df, filtros)
+        if columnas is not None:
+            df = df[[c for c in columnas if c in df.columns]]
+        return df
+
+    # Cantidad de filas y filas [inicio, fin) de una hoja, para mostrarla por
+    # páginas. Excel no permite leer por rangos: salen de la hoja cacheada.
+    def contar_filas(self, hoja):
+        df = self.leer(hoja)
+        return None if df is None else len(df)
+
+    def leer_filas(self, hoja, inicio, fin):
+        df = self.leer(hoja)
+        return None if df is None else df.iloc[inicio:fin]
+
+    # Si otro proceso reemplazó el archivo y esa versión todavía no se publicó,
+    # las escrituras no pueden partir de la versión publicada: se descarta
+    def actualizar_version(self):
+        if self.existe() and self.cache.clave_vigente(self.ruta, self.preparar) != identificar_origen(self.ruta, self.preparar)[0]:
+            self.cache.invalidar(self.ruta)
+
+    def escribir(self, hoja, df):
+        from openpyxl import load_workbook
+        from openpyxl.utils.dataframe import dataframe_to_rows
+
+        with self.bloqueo:
+            if os.path.exists(self.ruta):
+                # Versión de las demás hojas que tienen ya parseadas las sesiones
+                self.actualizar_version()
+                anterior = self.cache.clave_vigente(self.ruta, self.preparar)
+                # Cargar el libro existente y reemplazar la hoja (en la misma posición)
+                book = load_workbook(self.ruta)
+                posicion = None
+                if hoja in book.sheetnames:
+                    posicion = book.sheetnames.index(hoja)
+                    book.remove(book[hoja])
+                new_sheet = book.create_sheet(hoja, posicion)
+                for r in dataframe_to_rows(a_valores_excel(df), index=False, header=True):
+                    new_sheet.append(r)
+                # Se guarda en un temporal que reemplaza al archivo: nunca queda a medias
+                reemplazo_atomico(self.ruta, book.save)
+                nombres = book.sheetnames
+            else:
+                # Crear un nuevo archivo Excel
+                def crear(temporal):
+                    with pd.ExcelWriter(temporal, engine='openpyxl') as writer:
+                        a_valores_excel(df).to_excel(writer, sheet_name=hoja, index=False)
+                reemplazo_atomico(self.ruta, crear)
+                anterior, nombres = None, [hoja]
+
+            # Nueva versión del libro: solo la hoja guardada se vuelve a parsear al
+            # leerla; las demás no cambiaron y pasan a la versión nueva ya parseadas
+            clave, _ = identificar_origen(self.ruta, self.preparar)
+            self.cache.nueva_version(self.ruta, self.preparar, anterior, clave, nombres,
+                                     conservar=[h for h in nombres if h != hoja])
+
+
+class AlmacenParquet:
+    tipo = 'parquet'
+
+    def __init__(self, directorio=DIRECTORIO_PARQUET, cache=None, preparar=None):
+        if importar_pyarrow() is None:
+            raise RuntimeError("El backend Parquet requiere el paquete 'pyarrow'")
+        self.directorio = directorio
+        self.cache = cache if cache is not None else CacheLibros.desde_entorno()
+        self.preparar = preparar
+        self.bloqueo = BloqueoArchivo(os.path.join(directorio, '_escritura.lock'))
+
+    # El manifiesto conserva el orden original de las hojas
+    @property
+    def ruta_manifiesto(self):
+        return os.path.join(self.directorio, '_hojas.json')
+
+    def ruta_hoja(self, hoja):
+        return os.path.join(self.directorio, f"{nombre_archivo_hoja(hoja)}.parquet")
+
+    def existe(self):
+        return bool(self.hojas())
+
+    def firma(self, hoja):
+        ruta = self.ruta_hoja(hoja)
+        if not os.path.exists(ruta):
+            return None
+        return clave_archivo(ruta)
+
+    # Archivo de la hoja, para consultarlo directamente (por ejemplo con DuckDB)
+    def ruta_parquet(self, hoja):
+        ruta = self.ruta_hoja(hoja)
+        return ruta if os.path.exists(ruta) else None
+
+    def hojas(self):
+        if not os.path.isdir(self.directorio):
+            return []
+        presentes = {
+            nombre[:-len('.parquet')]
+            for nombre in os.listdir(self.directorio)
+            if nombre.endswith('.parquet')
+        }
+        orden = []
+        if os.path.exists(self.ruta_manifiesto):
+            with open(self.ruta_manifiesto, encoding='utf-8') as f:
+                orden = [h for h in json.load(f) if nombre_archivo_hoja(h) in presentes]
+        # Archivos sin entrada en el manifiesto: su nombre es el de la hoja
+        registrados = {nombre_archivo_hoja(h) for h in orden}
+        return orden + sorted(presentes - registrados)
+
+    def leer_todas(self):
+        return {hoja: self.leer(hoja) for hoja in self.hojas()}
+
+    # `filtros` son predicados de pyarrow ([(columna, operador, valor), ...]): se
+    # leen solo los row groups que pueden cumplirlos y solo las filas que los
+    # cumplen. Los 'in' con muchos valores se aplican sobre las filas leídas.
+    def leer(self, hoja, columnas=None, filtros=None):
+        ruta = self.ruta_hoja(hoja)
+        if not os.path.exists(ruta):
+            return None
+        if columnas is not None or filtros:
+            disponibles = set(pq.read_schema(ruta).names)
+            if columnas is not None:
+                columnas = [c for c in columnas if c in disponibles]
+            # Como en filtrar(), los predicados sobre columnas que no existen se ignoran
+            filtros = [f for f in filtros or [] if f[0] in disponibles] or None
+        clave = clave_archivo(ruta) + (
+            tuple(columnas) if columnas is not None else None,
+            getattr(self.preparar, 'clave', None),
+        )
+        if filtros:
+            clave = clave + (tuple(filtros),)
+        hojas = self.cache.obtener(clave)
+        if hojas is None:
+            al_leer, despues = dividir_predicados(filtros)
+            leidas = columnas
+            if columnas is not None and despues:
+                leidas = columnas + [p[0] for p in despues if p[0] not in columnas]
+            # Las columnas ya se guardaron tipadas; el esquema solo completa lo que falte
+            df = pq.read_table(ruta, columns=leidas, filters=al_leer).to_pandas()
+            if despues:
+                df = filtrar(df, despues).reset_index(drop=True)
+                if columnas is not None:
+                    df = df[columnas]
+            if self.preparar is not None:
+                df = self.preparar(hoja, df)
+            hojas = {hoja: df}
+            self.cache.guardar(clave, hojas)
+        df = hojas[hoja].copy(deep=False)
+        df.attrs['version'] = clave
+        return df
+
+    # La cantidad de filas está en los metadatos del archivo: no se leen datos
+    def contar_filas(self, hoja):
+        ruta = self.ruta_hoja(hoja)
+        if not os.path.exists(ruta):
+            return None
+        return pq.ParquetFile(ruta).metadata.num_rows
+
+    # Filas [inicio, fin) de la hoja: solo se leen los row groups que las
+    # contienen. Las etiquetas son las posiciones, como al leer la hoja completa.
+    def leer_filas(self, hoja, inicio, fin):
+        ruta = self.ruta_hoja(hoja)
+        if not os.path.exists(ruta):
+            return None
+        clave = clave_archivo(ruta) + ('filas', inicio, fin, getattr(self.preparar, 'clave', None))
+        hojas = self.cache.obtener(clave)
+        if hojas is None:
+            archivo = pq.ParquetFile(ruta)
+            grupos, primera, desde = [], None, 0
+            for grupo in range(archivo.metadata.num_row_groups):
+                filas = archivo.metadata.row_group(grupo).num_rows
+                if desde < fin and desde + filas > inicio:
+                    primera = desde if primera is None else primera
+                    grupos.append(grupo)
+                desde += filas
+            if grupos:
+                tabla = archivo.read_row_groups(grupos).slice(inicio - primera, fin - inicio)
+            else:
+                tabla = archivo.schema_arrow.empty_table()
+            df = tabla.to_pandas()
+            df.index = pd.RangeIndex(inicio, inicio + len(df))
+            if self.preparar is not None:
+                df = self.preparar(hoja, df)
+            hojas = {hoja: df}
+            self.cache.guardar(clave, hojas)
+        df = hojas[hoja].copy(deep=False)
+        df.attrs['version'] = clave
+        return df
+
+    # Cada hoja es un archivo propio: la versión vigente es la de su firma
+    def actualizar_version(self):
+        pass
+
+    def escribir(self, hoja, df):
+        ruta = self.ruta_hoja(hoja)
+        tabla = pa.Table.from_pandas(_preparar_para_arrow(df), preserve_index=False)
+        with self.bloqueo:
+            # Escribir en un archivo temporal y reemplazar, para no dejar hojas a medias
+            temporal = ruta + '.tmp'
+            pq.write_table(tabla, temporal, row_group_size=FILAS_POR_GRUPO)
+            # El manifiesto primero: un archivo sin entrada se listaría con el nombre del archivo
+            self._registrar_hoja(hoja)
+            os.replace(temporal, ruta)
+            self.cache.invalidar(ruta)
+
+    # Escribe una hoja a partir de bloques de filas (DataFrames) sin tenerla
+    # entera en memoria: cada bloque se agrega como un row group del archivo.
+    # Con enteros_como_decimales, las columnas enteras se guardan como float64
+    # (ver escribir_parquet_bloques).
+    def escribir_bloques(self, hoja, bloques, columnas=None, enteros_como_decimales=False):
+        ruta = self.ruta_hoja(hoja)
+        temporal = ruta + '.tmp'
+        with self.bloqueo:
+            escribir_parquet_bloques(temporal, bloques, columnas, enteros_como_decimales)
+            self._registrar_hoja(hoja)
+            os.replace(temporal, ruta)
+            self.cache.invalidar(ruta)
+
+    def importar_xlsx(self, ruta_xlsx=RUTA_DB):
+        with self.bloqueo:
+            for hoja, df in pd.read_excel(ruta_xlsx, sheet_name=None).items():
+                if self.preparar is not None:
+                    df = self.preparar(hoja, df)
+                self.escribir(hoja, df)
+
+    def exportar_xlsx(self, ruta_xlsx=RUTA_DB):
+        def exportar(temporal):
+            with pd.ExcelWriter(temporal, engine='openpyxl') as writer:
+                for hoja in self.hojas():
+                    a_valores_excel(self.leer(hoja)).to_excel(writer, sheet_name=hoja, index=False)
+        reemplazo_atomico(ruta_xlsx, exportar)
+        self.cache.invalidar(ruta_xlsx)
+
+    def _registrar_hoja(self, hoja):
+        orden = []
+        if os.path.exists(self.ruta_manifiesto):
+            with open(self.ruta_manifiesto, encoding='utf-8') as f:
+                orden = json.load(f)
+        if hoja not in orden:
+            orden.append(hoja)
+        temporal = self.ruta_manifiesto + '.tmp'
+        with open(temporal, 'w', encoding='utf-8') as f:
+            json.dump(orden, f, ensure_ascii=False)
+        os.replace(temporal, self.ruta_manifiesto)
+
+
+# Escribe un archivo Parquet a partir de bloques de filas (DataFrames), un row
+# group por bloque, sin juntar los bloques en memoria. `columnas` son los
+# encabezados de la hoja si no llega ningún bloque. El esquema del archivo sale
+# del primer bloque; si los bloques siguientes pueden traer decimales en una
+# columna que empezó entera (como al leer un Excel, donde todos los números son
+# float y openpyxl devuelve int cuando el valor no tiene decimales), con
+# enteros_como_decimales esas columnas se guardan como float64.
+def escribir_parquet_bloques(destino, bloques, columnas=None, enteros_como_decimales=False):
+    if importar_pyarrow() is None:
+        raise RuntimeError("Escribir Parquet requiere el paquete 'pyarrow'")
+    escritor = None
+    try:
+        for bloque in bloques:
+            if escritor is None:
+                esquema = _esquema_arrow_estable(_preparar_para_arrow(_sin_categorias(bloque)),
+                                                 enteros_como_decimales)
+                escritor = pq.ParquetWriter(destino, esquema)
+            escritor.write_table(_tabla_con_esquema(bloque, esquema))
+        if escritor is None:
+            # Hoja vacía: solo encabezados
+            vacia = pd.DataFrame(columns=[str(c) for c in (columnas or [])], dtype=object)
+            pq.write_table(pa.Table.from_pandas(vacia, preserve_index=False), destino)
+    finally:
+        if escritor is not None:
+            escritor.close()
+
+
+# Las columnas de Excel con tipos mezclados (números y textos) no tienen un
+# tipo Arrow único; se guardan como texto conservando los vacíos.
+def _preparar_para_arrow(df):
+    df = df.copy(deep=False)
+    for columna in df.columns:
+        if df[columna].dtype == object:
+            try:
+                pa.array(df[columna], from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                df[columna] = df[columna].map(lambda v: v if pd.isna(v) else str(v))
+    df.columns = [str(c) for c in df.columns]
+    return df
+
+
+# Las categorías de cada bloque pueden diferir; en disco se guardan como texto
+# (Parquet las codifica con diccionario igual) y el esquema las restaura al leer
+def _sin_categorias(df):
+    categoricas = [c for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)]
+    if not categoricas:
+        return df
+    df = df.copy(deep=False)
+    for columna in categoricas:
+        df[columna] = df[columna].astype(object)
+    return df
+
+
+# Esquema común para todos los bloques: enteros de 64 bits (o float64) y texto
+# para las columnas que en el primer bloque estaban vacías
+def _esquema_arrow_estable(df, enteros_como_decimales=False):
+    campos = []
+    for campo in pa.Schema.from_pandas(df, preserve_index=False):
+        if pa.types.is_integer(campo.type):
+            campo = campo.with_type(pa.float64() if enteros_como_decimales else pa.int64())
+        elif pa.types.is_null(campo.type):
+            campo = campo.with_type(pa.string())
+        campos.append(campo)
+    return pa.schema(campos)
+
+
+def _tabla_con_esquema(df, esquema):
+    df = _preparar_para_arrow(_sin_categorias(df))
+    try:
+        return pa.Table.from_pandas(df, schema=esquema, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Valores que no encajan en el tipo del primer bloque: en columnas de texto
+        # se guardan como texto; en fechas y números se descartan (quedan vacíos)
+        df = df.copy(deep=False)
+        for campo in esquema:
+            try:
+                pa.array(df[campo.name], type=campo.type, from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                if pa.types.is_string(campo.type) or pa.types.is_large_string(campo.type):
+                    df[campo.name] = df[campo.name].map(lambda v: v if pd.isna(v) else str(v))
+                elif pa.types.is_timestamp(campo.type):
+                    df[campo.name] = pd.to_datetime(df[campo.name], errors='coerce')
+                else:
+                    df[campo.name] = pd.to_numeric(df[campo.name], errors='coerce')
+        return pa.Table.from_pandas(df, schema=esquema, preserve_index=False)
+
+
+# Función para crear el almacén configurado (CANNABIS_BACKEND=xlsx|parquet).
+# El backend Parquet se inicializa desde data/db.xlsx la primera vez. Ambos
+# backends guardan las ediciones por filas en un diario que se compacta después.
+def crear_almacen(cache=None, backend=None, preparar=None):
+    backend = (backend or os.environ.get('CANNABIS_BACKEND', 'xlsx')).lower()
+    if backend == 'parquet':
+        almacen = AlmacenParquet(cache=cache, preparar=preparar)
+        if not almacen.existe() and os.path.exists(RUTA_DB):
+            almacen.importar_xlsx(RUTA_DB)
+        return AlmacenConDiario(almacen, os.path.join(almacen.directorio, '_diario.jsonl'))
+    if backend == 'xlsx':
+        almacen = AlmacenExcel(cache=cache, preparar=preparar)
+        return AlmacenConDiario(almacen, almacen.ruta + '.diario.jsonl')
+    raise ValueError(f"Backend de almacenamiento desconocido: {backend}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convierte entre data/db.xlsx y el almacén Parquet")
+    parser.add_argument('accion', choices=['importar', 'exportar'])
+    parser.add_argument('--xlsx', default=RUTA_DB)
+    parser.add_argument('--directorio', default=DIRECTORIO_PARQUET)
+    args = parser.parse_args()
+
+    almacen = AlmacenParquet(args.directorio, preparar=Tipado())
+    if args.accion == 'importar':
+        almacen.importar_xlsx(args.xlsx)
+    else:
+        almacen.exportar_xlsx(args.xlsx)
+    print(f"{args.accion.capitalize()}: {len(almacen.hojas())} hojas")
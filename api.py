@@ -0,0 +1,266 @@
+# API HTTP local, de solo lectura, con los reportes del tablero en JSON (para las
+# terminales de venta y los procesos nocturnos, sin pasar por Streamlit).
+# Usa el mismo almacén y los mismos cálculos que app.py (ver reportes.py) y deja
+# los datos en memoria entre pedidos: las hojas quedan en la caché de libros y
+# los agregados se recalculan solo cuando cambia la firma de su hoja, igual que
+# en el tablero. Cada respuesta lleva un ETag armado con las firmas de las hojas
+# de las que depende, que se obtienen sin leer las hojas. Si el cliente manda
+# If-None-Match con ese ETag se responde 304 sin calcular nada, y mientras las
+# hojas no cambien el JSON se sirve ya armado desde memoria.
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from agregados import PARTES, AgregadosResumen
+from almacenamiento import crear_almacen
+from cache_libros import CacheLibros, activar_copy_on_write
+from consultas import MotorConsultas
+from esquemas import Tipado
+from indices import IndiceDimension
+import reportes
+
+logger = logging.getLogger('cannabis.api')
+
+PUERTO_POR_DEFECTO = 8502
+MAXIMO_TOP = 100
+
+
+def puerto_api():
+    try:
+        return int(os.environ.get('CANNABIS_API_PUERTO', PUERTO_POR_DEFECTO))
+    except ValueError:
+        return PUERTO_POR_DEFECTO
+
+
+# Pedido que no se puede responder: se devuelve `estado` con el mensaje en JSON
+class ErrorPedido(Exception):
+    def __init__(self, estado, mensaje):
+        super().__init__(mensaje)
+        self.estado = estado
+
+
+def _registros(df):
+    return json.loads(df.to_json(orient='records', date_format='iso', force_ascii=False))
+
+
+def _cantidad(parametros):
+    valor = parametros.get('n', '5')
+    try:
+        cantidad = int(valor)
+    except ValueError:
+        raise ErrorPedido(400, f"'n' debe ser un entero: {valor}")
+    if not 1 <= cantidad <= MAXIMO_TOP:
+        raise ErrorPedido(400, f"'n' debe estar entre 1 y {MAXIMO_TOP}")
+    return cantidad
+
+
+class ServicioReportes:
+    # ruta -> (hojas de las que depende, método que calcula la respuesta, parámetros admitidos)
+    RUTAS = {
+        '/salud': ([], '_salud', ()),
+        '/ventas/total': (['Ventas'], '_ventas_total', ()),
+        '/ventas/por_dia': (['Ventas'], '_ventas_por_dia', ()),
+        '/ventas/por_dispensario': (['Ventas', 'Dispensarios'], '_ventas_por_dispensario', ()),
+        '/clientes/top': (reportes.HOJAS_TOP_CLIENTES, '_top_clientes', ('n',)),
+        '/inventario/stock_critico': (reportes.HOJAS_STOCK_CRITICO, '_stock_critico', ()),
+        '/alertas/resumen': (['Alertas', 'Inventario_Dispensario'], '_alertas_resumen', ()),
+    }
+
+    def __init__(self, almacen):
+        self.almacen = almacen
+        # Los agregados del tablero se guardan en data/agregados.json; la API
+        # mantiene los suyos solo en memoria para no competir por ese archivo
+        self.agregados = AgregadosResumen(None)
+        self._respuestas = {}
+        self._indices = {}
+        # Los cálculos se hacen de a uno (una conexión DuckDB no admite consultas
+        # concurrentes); las respuestas ya armadas se sirven sin esperar
+        self._lock = threading.Lock()
+
+    def firmas(self, hojas):
+        return {hoja: self.almacen.firma(hoja) for hoja in hojas}
+
+    # Devuelve (etag, cuerpo JSON), o (etag, None) si el cliente ya tiene esa versión
+    def responder(self, ruta, consulta='', si_no_coincide=None):
+        if ruta not in self.RUTAS:
+            raise ErrorPedido(404, f"Ruta desconocida: {ruta}")
+        hojas, metodo, admitidos = self.RUTAS[ruta]
+        pedidos = parse_qs(consulta)
+        parametros = tuple(sorted((nombre, pedidos[nombre][-1]) for nombre in admitidos if nombre in pedidos))
+        firmas = self.firmas(hojas)
+        etag = '"' + hashlib.sha1(repr((ruta, parametros, sorted(firmas.items()))).encode()).hexdigest() + '"'
+        if si_no_coincide is not None and (
+                si_no_coincide.strip() == '*' or etag in (e.strip() for e in si_no_coincide.split(','))):
+            return etag, None
+        clave = (ruta, parametros)
+        guardada = self._respuestas.get(clave)
+        if guardada is not None and guardada[0] == etag:
+            return guardada
+        with self._lock:
+            # Otro hilo pudo haberla calculado mientras se esperaba
+            guardada = self._respuestas.get(clave)
+            if guardada is not None and guardada[0] == etag:
+                return guardada
+            datos = getattr(self, metodo)(dict(parametros), firmas)
+            cuerpo = json.dumps(datos, ensure_ascii=False, default=str).encode('utf-8')
+            self._respuestas[clave] = (etag, cuerpo)
+        return etag, cuerpo
+
+    # Calcula de antemano las respuestas con sus parámetros por defecto
+    def precalentar(self):
+        for ruta in self.RUTAS:
+            try:
+                self.responder(ruta)
+            except ErrorPedido as e:
+                logger.info("%s no disponible: %s", ruta, e)
+
+    def _leer(self, hoja):
+        return self.almacen.leer(hoja)
+
+    def _sincronizar(self, firmas):
+        partes = {parte: firmas[hoja] for parte, hoja in PARTES.items() if hoja in firmas}
+        self.agregados.sincronizar(partes, lambda parte: self._leer(PARTES[parte]))
+
+    def _indice(self, hoja, firma):
+        guardado = self._indices.get(hoja)
+        if guardado is None or guardado[0] != firma:
+            df = self._leer(hoja)
+            if df is None or 'id' not in df.columns:
+                raise ErrorPedido(404, f"No hay datos de {hoja}")
+            guardado = self._indices[hoja] = (firma, IndiceDimension(df))
+        return guardado[1]
+
+    # Motor con las hojas registradas (las Parquet al día se consultan desde el archivo)
+    def _consultar(self, hojas, consulta):
+        motor = MotorConsultas()
+        try:
+            for hoja in hojas:
+                ruta = self.almacen.ruta_parquet(hoja) if motor.lee_parquet else None
+                if ruta is not None:
+                    motor.registrar_parquet(hoja, ruta)
+                else:
+                    df = self._leer(hoja)
+                    if df is not None:
+                        motor.registrar(hoja, df)
+            return consulta(motor)
+        finally:
+            motor.cerrar()
+
+    def _salud(self, parametros, firmas):
+        return {'estado': 'ok'}
+
+    def _ventas_total(self, parametros, firmas):
+        self._sincronizar(firmas)
+        return {'total_ventas': self.agregados.total_ventas()}
+
+    def _ventas_por_dia(self, parametros, firmas):
+        self._sincronizar(firmas)
+        return _registros(self.agregados.ventas_por_dia())
+
+    def _ventas_por_dispensario(self, parametros, firmas):
+        self._sincronizar(firmas)
+        indice = self._indice('Dispensarios', firmas['Dispensarios'])
+        return _registros(reportes.ventas_por_dispensario(self.agregados, indice))
+
+    def _top_clientes(self, parametros, firmas):
+        cantidad = _cantidad(parametros)
+
+        def consulta(motor):
+            if not reportes.puede_top_clientes(motor):
+                raise ErrorPedido(404, "No hay datos de clientes disponibles")
+            return reportes.top_clientes(motor, cantidad)
+        return _registros(self._consultar(reportes.HOJAS_TOP_CLIENTES, consulta))
+
+    def _stock_critico(self, parametros, firmas):
+        def consulta(motor):
+            if not reportes.puede_stock_critico(motor):
+                raise ErrorPedido(404, "No hay datos de inventario por dispensario disponibles")
+            return reportes.stock_critico(motor)
+        return _registros(self._consultar(reportes.HOJAS_STOCK_CRITICO, consulta))
+
+    def _alertas_resumen(self, parametros, firmas):
+        self._sincronizar(firmas)
+        return {'alertas': self.agregados.alertas, 'productos_stock_bajo': self.agregados.stock}
+
+
+class ManejadorAPI(BaseHTTPRequestHandler):
+    # Conexiones persistentes: los clientes que consultan seguido no reconectan
+    protocol_version = 'HTTP/1.1'
+    # Los encabezados y el cuerpo salen en escrituras separadas: sin TCP_NODELAY
+    # el cuerpo espera el ACK retrasado del cliente (~40 ms por respuesta)
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._responder(con_cuerpo=True)
+
+    def do_HEAD(self):
+        self._responder(con_cuerpo=False)
+
+    def _responder(self, con_cuerpo):
+        partes = urlsplit(self.path)
+        ruta = partes.path.rstrip('/') or '/'
+        try:
+            etag, cuerpo = self.server.servicio.responder(ruta, partes.query, self.headers.get('If-None-Match'))
+        except ErrorPedido as e:
+            self._enviar(e.estado, {'error': str(e)}, con_cuerpo=con_cuerpo)
+            return
+        except Exception as e:
+            logger.exception("Error respondiendo %s", self.path)
+            self._enviar(500, {'error': str(e)}, con_cuerpo=con_cuerpo)
+            return
+        if cuerpo is None:
+            self._enviar(304, None, etag, con_cuerpo)
+        else:
+            self._enviar(200, cuerpo, etag, con_cuerpo)
+
+    def _enviar(self, estado, cuerpo, etag=None, con_cuerpo=True):
+        if isinstance(cuerpo, dict):
+            cuerpo = json.dumps(cuerpo, ensure_ascii=False).encode('utf-8')
+        self.send_response(estado)
+        if etag is not None:
+            self.send_header('ETag', etag)
+            # El cliente puede guardar la respuesta, pero la revalida en cada pedido
+            self.send_header('Cache-Control', 'no-cache')
+        if cuerpo is not None:
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        if cuerpo is not None and con_cuerpo:
+            self.wfile.write(cuerpo)
+
+    def log_message(self, formato, *args):
+        logger.debug("%s - %s", self.address_string(), formato % args)
+
+
+def crear_servidor(servicio, host='127.0.0.1', puerto=PUERTO_POR_DEFECTO):
+    servidor = ThreadingHTTPServer((host, puerto), ManejadorAPI)
+    servidor.daemon_threads = True
+    servidor.servicio = servicio
+    return servidor
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="API HTTP local con los reportes del tablero en JSON")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--puerto', type=int, default=puerto_api())
+    parser.add_argument('--backend', choices=['xlsx', 'parquet'])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    activar_copy_on_write()
+    almacen = crear_almacen(CacheLibros.desde_entorno(), args.backend, preparar=Tipado())
+    servicio = ServicioReportes(almacen)
+    servicio.precalentar()
+    servidor = crear_servidor(servicio, args.host, args.puerto)
+    print(f"API de reportes en http://{args.host}:{servidor.server_address[1]}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
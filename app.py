@@ -1,11 +1,30 @@
+import time
+# Inicio del rerun, antes de las importaciones (en el arranque en frío son buena parte del tiempo)
+inicio_rerun = time.perf_counter()
 import streamlit as st
 import pandas as pd
-import plotly.express as px
 from datetime import datetime
-import io
-import os
-from openpyxl import load_workbook, Workbook
-from openpyxl.utils.dataframe import dataframe_to_rows
+# Solo se importa de entrada lo que usa cualquier rerun. El motor SQL, la
+# exportación, el libro de movimientos, la carga en paralelo, el vigilante y
+# pyarrow se importan recién en las funciones o pestañas que los usan.
+from agregados import PARTES, RUTA_AGREGADOS, AgregadosResumen
+from almacenamiento import RUTA_DB, AlmacenExcel, crear_almacen, importar_pyarrow, validar_nombre_hoja
+from bloqueos import BloqueoOcupado, VersionObsoleta
+from cache_libros import CacheLibros, activar_copy_on_write, hojas_libro, huella_archivo, identificar_origen, identificar_subida, leer_libro
+from catalogo import CatalogoHojas, columnas_ficha, prioridad, vista_previa
+from cola_escritura import ERROR, GUARDADA, ColaEscritura
+from esquemas import Tipado
+from filtros import FILTROS_POR_REFERENCIA, FiltroDatos, filtrar
+from graficos import grafico_barras, grafico_dispersion, grafico_lineas, grafico_pastel
+from indices import IndiceDimension
+from ingesta import ingerir_archivo_subido, umbral_streaming_bytes
+from metricas import MetricasAcumuladas, iniciar_perfil, memoria_pico_bytes, tramo
+from motor_alertas import MotorAlertas, alertas_automaticas
+from registro import RegistroDatos
+import reportes
+from tablas import FILAS_POR_PAGINA, buscar, cantidad_paginas, combinar_pagina, ordenar, pagina
+
+activar_copy_on_write()
 
 # Configuración de la página
 st.set_page_config(
@@ -14,6 +33,9 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Perfil de rendimiento de este rerun (ver el panel "Rendimiento" del sidebar)
+perfil = iniciar_perfil(inicio_rerun)
+
 # Título principal
 st.title("🌿 Sistema de Gestión de Cannabis Medicinal")
 st.markdown("---")
@@ -48,107 +70,509 @@ st.sidebar.subheader("Configuración de colores")
 color_principal = st.sidebar.color_picker('Color principal', '#00CC96')
 color_secundario = st.sidebar.color_picker('Color secundario', '#636EFA')
 
-# Función para cargar datos
+# Caché de libros parseados compartida por todas las sesiones y reruns
+@st.cache_resource
+def obtener_cache_libros():
+    return CacheLibros.desde_entorno()
+
+# Métricas de rendimiento acumuladas de todas las sesiones
+@st.cache_resource
+def obtener_metricas():
+    return MetricasAcumuladas.desde_entorno()
+
+# El rerun anterior de la sesión pudo cortarse con st.rerun() (por ejemplo, después
+# de guardar) antes de registrar su perfil
+perfil_anterior = st.session_state.get('perfil_rendimiento')
+if perfil_anterior is not None and not perfil_anterior.terminado():
+    obtener_metricas().registrar(perfil_anterior.terminar(interrumpido=True))
+st.session_state['perfil_rendimiento'] = perfil
+
+# Tipado de columnas según la hoja lógica que representa cada hoja configurada
+tipado = Tipado({hoja: logica for logica, hoja in nombres_hojas.items()})
+
+# Almacén de datos por defecto (data/db.xlsx o Parquet, según CANNABIS_BACKEND)
+@st.cache_resource
+def obtener_almacen(_tipado, clave_tipado):
+    try:
+        return crear_almacen(obtener_cache_libros(), preparar=_tipado)
+    except (RuntimeError, ValueError) as e:
+        st.sidebar.error(f"Error iniciando el almacenamiento, se usará {RUTA_DB}: {e}")
+        return AlmacenExcel(RUTA_DB, obtener_cache_libros(), preparar=_tipado)
+
+almacen = obtener_almacen(tipado, tipado.clave)
+
+# Pool de procesos para parsear libros y hojas en paralelo
+@st.cache_resource
+def obtener_ejecutor():
+    from carga_paralela import crear_ejecutor
+    return crear_ejecutor()
+
+# Vigilante que publica en segundo plano las versiones nuevas de data/db.xlsx
+# que dejan otros procesos (ver vigilante.py)
+@st.cache_resource
+def obtener_vigilante(_almacen, clave_tipado):
+    from vigilante import iniciar_vigilante
+    return iniciar_vigilante(_almacen, obtener_ejecutor())
+
+obtener_vigilante(almacen, tipado.clave)
+
+# Ingesta por bloques de un archivo grande, mostrando el avance en el sidebar
+def ingerir_con_progreso(archivo, huella):
+    barra = st.sidebar.progress(0.0, text=f"Procesando {archivo.name}...")
+    try:
+        return ingerir_archivo_subido(
+            archivo, preparar=tipado, cache=obtener_cache_libros(), huella=huella,
+            progreso=lambda fraccion, texto: barra.progress(fraccion, text=f"{archivo.name} · {texto}")
+        )
+    finally:
+        barra.empty()
+
+# Parsear en paralelo las hojas de Excel que una pestaña pide y que todavía no
+# están en la caché
+def precargar_fuentes(fuentes):
+    from carga_paralela import precargar_libros
+
+    pedidos = {}
+    for fuente in fuentes:
+        if fuente.origen is not None:
+            pedidos.setdefault(id(fuente.origen), (fuente.origen, set()))[1].add(fuente.hoja)
+    try:
+        precargar_libros(obtener_cache_libros(), list(pedidos.values()), tipado, obtener_ejecutor())
+    except Exception as e:
+        st.sidebar.warning(f"Carga en paralelo no disponible, se carga secuencialmente: {e}")
+
+# Función para quedarse con algunas columnas de un DataFrame ya cargado
+def seleccionar_columnas(df, columnas=None):
+    if df is None or columnas is None:
+        return df
+    return df[[c for c in columnas if c in df.columns]]
+
+# Función para registrar los datos disponibles. Solo se leen los nombres de las
+# hojas: cada hoja se carga recién cuando una pestaña la pide. Si una hoja está
+# en varias fuentes, cuál se usa depende de CANNABIS_PRECEDENCIA (ver catalogo.py).
 def load_data(archivos=None):
-    datos = {}
+    registro = RegistroDatos(precargar_fuentes)
+    cache = obtener_cache_libros()
     
-    # Siempre cargar el archivo por defecto si existe
+    # Siempre registrar los datos por defecto si existen
     try:
-        if os.path.exists('data/db.xlsx'):
-            excel_por_defecto = pd.read_excel('data/db.xlsx', sheet_name=None)
-            for hoja, df in excel_por_defecto.items():
-                datos[f"PorDefecto_{hoja}"] = df
+        if almacen.existe():
+            origen = almacen.ruta if almacen.tipo == 'xlsx' else None
+            for hoja in almacen.hojas():
+                registro.registrar(
+                    f"PorDefecto_{hoja}", hoja,
+                    lambda columnas, filtros, hoja=hoja: almacen.leer(hoja, columnas, filtros),
+                    firma=lambda hoja=hoja: ('almacen', almacen.firma(hoja)),
+                    origen=origen,
+                    ruta_parquet=lambda hoja=hoja: almacen.ruta_parquet(hoja),
+                    prioridad=prioridad()
+                )
     except Exception as e:
         st.sidebar.error(f"Error cargando archivo por defecto: {e}")
     
-    # Si se cargaron archivos, usarlos
-    if archivos:
-        for archivo in archivos:
-            try:
-                excel_data = pd.read_excel(archivo, sheet_name=None)
-                # Agregar prefijo al nombre de las hojas para identificar el archivo
-                for hoja, df in excel_data.items():
-                    nombre_archivo = archivo.name.replace('.xlsx', '')
-                    datos[f"{nombre_archivo}_{hoja}"] = df
-            except Exception as e:
-                st.error(f"Error cargando {archivo.name}: {e}")
-    return datos
+    # Si se cargaron archivos, registrar también sus hojas
+    volcados = {}
+    for posicion, archivo in enumerate(archivos or []):
+        try:
+            if archivo.size >= umbral_streaming_bytes() and importar_pyarrow() is not None:
+                # Archivos grandes: ingesta por bloques a un volcado Parquet al primer
+                # acceso. El contenido se identifica leyéndolo por partes, sin copiarlo.
+                huella = huella_archivo(archivo)
+                clave_libro, fuente = identificar_subida(archivo, huella, tipado)
+                def cargar(columnas, filtros, archivo=archivo, huella=huella, hoja=None):
+                    if archivo.name not in volcados:
+                        volcados[archivo.name] = ingerir_con_progreso(archivo, huella)
+                    return volcados[archivo.name].leer(hoja, columnas, filtros)
+                origen = None
+            else:
+                clave_libro, fuente = identificar_origen(archivo, tipado)
+                def cargar(columnas, filtros, archivo=archivo, hoja=None):
+                    df = leer_libro(cache, archivo, tipado, hojas=[hoja]).get(hoja)
+                    return seleccionar_columnas(filtrar(df, filtros), columnas)
+                origen = archivo
+            # Agregar prefijo al nombre de las hojas para identificar el archivo
+            nombre_archivo = archivo.name.replace('.xlsx', '')
+            for hoja in cache.nombres_hojas(clave_libro, fuente):
+                registro.registrar(
+                    f"{nombre_archivo}_{hoja}", hoja,
+                    lambda columnas, filtros, cargar=cargar, hoja=hoja: cargar(columnas, filtros, hoja=hoja),
+                    firma=lambda hoja=hoja, clave_libro=clave_libro: ('version', clave_libro + (hoja,)),
+                    origen=origen,
+                    prioridad=prioridad(posicion)
+                )
+        except Exception as e:
+            st.error(f"Error cargando {archivo.name}: {e}")
+    return registro
 
-# Función para guardar datos en el archivo Excel
-def save_to_excel(df, sheet_name, filename='data/db.xlsx'):
+# Catálogo de las hojas con sus fichas (filas, columnas, vista previa), compartido
+# por todas las sesiones
+@st.cache_resource
+def obtener_catalogo():
+    return CatalogoHojas()
+
+# Agregados materializados del Resumen, compartidos por todas las sesiones
+@st.cache_resource
+def obtener_agregados():
+    return AgregadosResumen(RUTA_AGREGADOS)
+
+# Firma de la versión actual de la hoja de cada parte de los agregados
+# (se obtiene sin cargar las hojas)
+def firmas_agregados(partes=PARTES):
+    return {parte: registro.firma(nombres_hojas[PARTES[parte]]) for parte in partes}
+
+# Agregados calculados sobre las hojas filtradas, uno por filtro y versión de los datos
+@st.cache_resource(max_entries=16)
+def obtener_agregados_filtrados(clave_filtro, firmas, _leer):
+    agregados = AgregadosResumen(None)
+    agregados.sincronizar({parte: None for parte, _ in firmas}, _leer)
+    return agregados
+
+# Agregados del Resumen con las partes pedidas al día. Sin filtros se usan los
+# materializados (solo se recalculan, y solo entonces se cargan, las hojas que
+# cambiaron); con filtros se calculan sobre las hojas ya filtradas al leer.
+def actualizar_agregados(*partes):
     try:
-        # Verificar si el directorio existe, si no, crearlo
-        os.makedirs(os.path.dirname(filename), exist_ok=True)
-        
-        # Verificar si el archivo existe
-        if os.path.exists(filename):
-            # Cargar el libro existente
-            book = load_workbook(filename)
-            # Verificar si la hoja existe
-            if sheet_name in book.sheetnames:
-                # Eliminar la hoja existente
-                std = book[sheet_name]
-                book.remove(std)
-            
-            # Crear una nueva hoja con el DataFrame
-            new_sheet = book.create_sheet(sheet_name)
-            for r in dataframe_to_rows(df, index=False, header=True):
-                new_sheet.append(r)
-            
-            # Guardar el libro
-            book.save(filename)
+        with tramo("agregados"):
+            if not filtro.vacio():
+                return obtener_agregados_filtrados(
+                    filtro.clave, tuple(firmas_agregados(partes).items()),
+                    lambda parte: leer_filtrado(PARTES[parte])
+                )
+            agregados = obtener_agregados()
+            agregados.sincronizar(
+                firmas_agregados(partes),
+                lambda parte: obtener_datos(nombres_hojas[PARTES[parte]])
+            )
+            return agregados
+    except Exception as e:
+        st.sidebar.error(f"Error actualizando los agregados del resumen: {e}")
+        return obtener_agregados()
+
+# Función para guardar datos en el archivo Excel (o en el almacén por defecto).
+# Si se pasa `original`, en el almacén por defecto solo se guardan las filas modificadas.
+# Se ejecuta en el hilo escritor de la cola (ver save_to_excel), que no tiene
+# contexto de Streamlit: no usa la interfaz y recibe los recursos compartidos.
+def guardar_hoja(df, sheet_name, filename, original, agregados, cache, motor_alertas):
+    if filename == RUTA_DB:
+        firmas_antes = firmas_agregados()
+        firma_antes = almacen.firma(sheet_name)
+        # El delta solo es válido si nadie modificó la hoja desde que se leyó `original`
+        original_vigente = original is not None and original.attrs.get('firma') == firma_antes
+        if original is not None:
+            almacen.guardar_cambios(sheet_name, original, df)
         else:
-            # Crear un nuevo archivo Excel
-            with pd.ExcelWriter(filename, engine='openpyxl') as writer:
-                df.to_excel(writer, sheet_name=sheet_name, index=False)
-        
-        st.success(f"Datos guardados correctamente en {sheet_name}")
-        return True
+            almacen.escribir(sheet_name, df)
+        agregados.registrar_guardado(
+            tipado.hoja_logica(sheet_name), firmas_antes, firmas_agregados(),
+            original if original_vigente else None, df if original_vigente else None
+        )
+        # Las alertas de las filas guardadas se actualizan al terminar el lote (ver aplicar_alertas)
+        if alertas_automaticas():
+            motor_alertas.registrar_cambios(tipado.hoja_logica(sheet_name), original, df,
+                                            firma_antes, almacen.firma(sheet_name))
+    else:
+        AlmacenExcel(filename, cache, preparar=tipado).escribir(sheet_name, df)
+
+# Motor de alertas automáticas, compartido por todas las sesiones
+@st.cache_resource
+def obtener_motor_alertas():
+    return MotorAlertas()
+
+# Concilia la hoja de alertas del almacén con las filas marcadas en el motor; las
+# hojas que cambiaron sin pasar por la cola (otro proceso, una importación, el
+# primer inicio) se marcan completas. Se ejecuta solo en el hilo escritor, al
+# terminar cada lote de guardados o cuando una sesión avisa que hay hojas
+# nuevas; como guardar_hoja, no usa la interfaz.
+def aplicar_alertas(motor_alertas, nombres):
+    motor_alertas.sincronizar({hoja: almacen.firma(nombres[hoja]) for hoja in motor_alertas.hojas()})
+    if not motor_alertas.pendiente():
+        return
+    with almacen.bloqueo:
+        hoja_alertas = nombres['Alertas']
+        alertas = almacen.leer(hoja_alertas)
+
+        # Las filas marcadas se desmarcan recién cuando las alertas quedaron guardadas
+        def guardar(nuevas):
+            if alertas is None:
+                almacen.escribir(hoja_alertas, nuevas)
+            else:
+                almacen.guardar_cambios(hoja_alertas, alertas, nuevas)
+
+        motor_alertas.aplicar(alertas, lambda hoja: almacen.leer(nombres[hoja]), guardar=guardar)
+
+# Libro de movimientos de inventario, compartido por todas las sesiones
+@st.cache_resource
+def obtener_libro_movimientos():
+    from movimientos import LibroInventario
+    return LibroInventario()
+
+# Escritor en segundo plano de cada archivo, compartido por todas las sesiones
+@st.cache_resource
+def obtener_cola_escritura(filename):
+    if filename != RUTA_DB:
+        return ColaEscritura()
+    if not alertas_automaticas():
+        return ColaEscritura(almacen.bloqueo)
+    motor_alertas, nombres = obtener_motor_alertas(), dict(nombres_hojas)
+    return ColaEscritura(almacen.bloqueo, lambda escrituras: aplicar_alertas(motor_alertas, nombres))
+
+# Función para guardar datos sin esperar la escritura: el guardado se encola
+# (combinado con los anteriores de la misma hoja que aún no empezaron) y su
+# resultado se muestra en el indicador de guardados del sidebar
+def save_to_excel(df, sheet_name, filename=RUTA_DB, original=None):
+    agregados, cache, motor_alertas = obtener_agregados(), obtener_cache_libros(), obtener_motor_alertas()
+    with tramo(f"guardado/encolar/{sheet_name}") as medicion:
+        medicion.agregar_filas(len(df))
+        escritura = obtener_cola_escritura(filename).enviar(
+            sheet_name, df, original,
+            lambda original, df: guardar_hoja(df, sheet_name, filename, original, agregados, cache, motor_alertas)
+        )
+    escrituras = st.session_state.setdefault('escrituras', [])
+    if escritura not in escrituras:
+        escrituras.append(escritura)
+    return True
+
+# Mensaje del resultado de un guardado
+def mensaje_escritura(escritura):
+    if escritura.estado == GUARDADA:
+        return f"✅ {escritura.hoja} guardada a las {datetime.fromtimestamp(escritura.terminada):%H:%M:%S}"
+    if escritura.estado == ERROR:
+        if isinstance(escritura.excepcion, VersionObsoleta):
+            return (f"❌ Otro usuario guardó cambios en {escritura.hoja} después de que se abrió el editor. "
+                    "Sus cambios no se guardaron: recargue la hoja y vuelva a aplicarlos.")
+        if isinstance(escritura.excepcion, BloqueoOcupado):
+            return f"❌ {escritura.hoja}: otro usuario estaba guardando. Intente de nuevo en unos segundos."
+        return f"❌ Error guardando {escritura.hoja}: {escritura.excepcion}"
+    combinados = f" ({escritura.combinadas} cambios combinados)" if escritura.combinadas > 1 else ""
+    return f"⏳ Guardando {escritura.hoja}{combinados}..."
+
+# Indicador de los últimos guardados de la sesión. Mientras haya alguno en curso
+# se actualiza solo cada segundo; cuando terminan, la app se vuelve a ejecutar
+# para mostrar los datos guardados.
+escrituras_sesion = st.session_state.get('escrituras', [])[-3:]
+if escrituras_sesion:
+    en_curso = any(e.estado not in (GUARDADA, ERROR) for e in escrituras_sesion)
+
+    @st.fragment(run_every=1 if en_curso else None)
+    def indicador_guardados():
+        for escritura in escrituras_sesion:
+            st.caption(mensaje_escritura(escritura))
+        if en_curso and all(e.estado in (GUARDADA, ERROR) for e in escrituras_sesion):
+            st.rerun()
+
+    with st.sidebar:
+        st.subheader("Guardados")
+        indicador_guardados()
+
+# Alertas automáticas: si alguna hoja de inventario o calidad cambió sin pasar
+# por la cola de guardados, se avisa al hilo escritor, que la evalúa. La
+# ejecución de la app solo compara firmas: no evalúa reglas ni escribe.
+if alertas_automaticas() and almacen.existe():
+    try:
+        motor_alertas = obtener_motor_alertas()
+        if not motor_alertas.al_dia({hoja: almacen.firma(nombres_hojas[hoja]) for hoja in motor_alertas.hojas()}):
+            obtener_cola_escritura(RUTA_DB).avisar()
     except Exception as e:
-        st.error(f"Error guardando datos: {e}")
-        return False
-
-# Cargar todos los datos
-excel_data = load_data(archivos_cargados)
-
-# Función para obtener datos por nombre de hoja
-def obtener_datos(nombre_hoja):
-    for clave, df in excel_data.items():
-        # Buscar por el nombre de la hoja sin el prefijo del archivo
-        if clave.endswith(f"_{nombre_hoja}") or clave == nombre_hoja:
-            return df
-    return None
-
-# Obtener dataframes individuales
-dispensarios_df = obtener_datos(nombres_hojas['Dispensarios'])
-alertas_df = obtener_datos(nombres_hojas['Alertas'])
-control_calidad_df = obtener_datos(nombres_hojas['Control_Calidad'])
-inventario_deposito_df = obtener_datos(nombres_hojas['Inventario_Deposito'])
-inventario_dispensario_df = obtener_datos(nombres_hojas['Inventario_Dispensario'])
-ventas_df = obtener_datos(nombres_hojas['Ventas'])
-detalle_venta_df = obtener_datos(nombres_hojas['Detalle_Venta'])
-productos_df = obtener_datos(nombres_hojas['Productos'])
-clientes_df = obtener_datos(nombres_hojas['Clientes'])
+        st.sidebar.warning(f"No se pudieron actualizar las alertas automáticas: {e}")
+
+# Registrar los datos disponibles (sin cargarlos)
+with tramo("load_data"):
+    registro = load_data(archivos_cargados)
+
+# Función para obtener datos por nombre de hoja; se cargan en el primer acceso.
+# Con `columnas`, las hojas del almacén por defecto se leen solo con esas columnas,
+# y con `filtros` (ver filtros.py) solo con las filas que los cumplen.
+def obtener_datos(nombre_hoja, columnas=None, filtros=None):
+    return registro.obtener(nombre_hoja, columnas, filtros)
+
+# Predicados de las hojas que se filtran por referencia (Detalle_Venta por los ids
+# de las ventas filtradas), compartidos por todas las sesiones: uno por hoja,
+# filtro y versión de la hoja de referencia
+@st.cache_resource(max_entries=16)
+def obtener_predicados_referencia(hoja_logica, clave_filtro, version, _calcular):
+    return _calcular()
+
+# Predicados del filtro de la barra lateral para una hoja lógica
+def predicados_filtro(hoja_logica):
+    def calcular():
+        return filtro.predicados_con_referencias(
+            hoja_logica,
+            lambda hoja, columnas, predicados: obtener_datos(nombres_hojas[hoja], columnas, predicados)
+        )
+    if hoja_logica not in FILTROS_POR_REFERENCIA or filtro.vacio():
+        return calcular()
+    hoja_referencia = nombres_hojas[FILTROS_POR_REFERENCIA[hoja_logica][1]]
+    version = registro.firma(hoja_referencia)
+    if version is None:
+        return calcular()
+    return obtener_predicados_referencia(hoja_logica, filtro.clave, (hoja_referencia, version), calcular)
+
+# Función para leer una hoja lógica con el filtro de la barra lateral aplicado al leer
+def leer_filtrado(hoja_logica, columnas=None):
+    return obtener_datos(nombres_hojas[hoja_logica], columnas, predicados_filtro(hoja_logica))
+
+# Función para cargar juntas las hojas que usa una pestaña, ya filtradas.
+# `hojas` es {hoja lógica: columnas} (None para todas las columnas).
+def datos_pestana(hojas):
+    datos = registro.requerir(
+        {nombres_hojas[logica]: columnas for logica, columnas in hojas.items()},
+        al_fallar=lambda hoja, e: st.error(f"Error cargando {hoja}: {e}"),
+        filtros={nombres_hojas[logica]: predicados_filtro(logica) for logica in hojas}
+    )
+    return {logica: datos[nombres_hojas[logica]] for logica in hojas}
+
+# Motor SQL con las hojas lógicas de una pestaña registradas como tablas (con el
+# nombre lógico y ya filtradas). Las hojas Parquet al día se consultan desde el
+# archivo, sin cargarlas; el resto se carga con el registro. Se usa con `with`,
+# que cierra la conexión al terminar la pestaña.
+def motor_pestana(hojas):
+    from consultas import MotorConsultas
+
+    motor = MotorConsultas()
+    try:
+        registrar_hojas(motor, hojas)
+    except BaseException:
+        motor.cerrar()
+        raise
+    return motor
+
+def registrar_hojas(motor, hojas):
+    a_cargar = {}
+    for logica in hojas:
+        clave = registro.resolver(nombres_hojas[logica])
+        if clave is None:
+            continue
+        fuente = registro.fuente(clave)
+        try:
+            ruta = fuente.ruta_parquet() if fuente.ruta_parquet is not None and motor.lee_parquet else None
+            if ruta is not None:
+                motor.registrar_parquet(logica, ruta, predicados_filtro(logica))
+            else:
+                a_cargar[logica] = None
+        except Exception as e:
+            st.error(f"Error cargando {nombres_hojas[logica]}: {e}")
+    for logica, df in datos_pestana(a_cargar).items():
+        if df is not None:
+            motor.registrar(logica, df)
+
+# Selector de página; si la cantidad de páginas bajó (por ejemplo, al buscar),
+# vuelve a la última página disponible
+def selector_pagina(total_filas, clave, deshabilitado=False):
+    total_paginas = cantidad_paginas(total_filas)
+    if st.session_state.get(clave, 1) > total_paginas:
+        st.session_state[clave] = total_paginas
+    numero = st.number_input(f"Página (de {total_paginas})", min_value=1, max_value=total_paginas,
+                             step=1, key=clave, disabled=deshabilitado)
+    inicio = (numero - 1) * FILAS_POR_PAGINA
+    st.caption(f"Filas {inicio + 1}-{min(inicio + FILAS_POR_PAGINA, total_filas)} de {total_filas}")
+    return numero
+
+# Muestra un gráfico midiendo su serialización y envío al navegador
+def mostrar_grafico(fig):
+    with tramo(f"grafico/enviar/{fig.layout.title.text or 'sin título'}"):
+        st.plotly_chart(fig, width='stretch')
+
+# Figuras compartidas por todas las sesiones, una por gráfico, versión de sus
+# datos y colores elegidos: mientras no cambien las hojas, los filtros ni los
+# colores, no se vuelven a consultar los datos ni a armar la figura
+@st.cache_resource(max_entries=64)
+def obtener_figura(clave, version, colores, _construir):
+    return _construir()
+
+def figura(clave, version, construir):
+    if version is None:
+        return construir()
+    return obtener_figura(clave, version, (color_principal, color_secundario), construir)
+
+# Versión de los datos de un gráfico: la hoja y la firma de cada hoja lógica que
+# usa, más los filtros de la barra lateral (None si alguna no tiene firma)
+def version_hojas(*hojas):
+    firmas = tuple((nombres_hojas[h], registro.firma(nombres_hojas[h])) for h in hojas)
+    if any(firma is None for _, firma in firmas):
+        return None
+    return firmas + (filtro.clave,)
+
+# Tabla paginada: la búsqueda y el orden se aplican en el servidor y al navegador
+# solo se envía la página visible. Las tablas de una sola página se muestran enteras.
+def tabla_paginada(df, clave):
+    if len(df) <= FILAS_POR_PAGINA:
+        st.dataframe(df, width='stretch')
+        return
+    col_busqueda, col_orden, col_sentido = st.columns([2, 2, 1])
+    with col_busqueda:
+        texto = st.text_input("Buscar", key=f"{clave}_busqueda")
+    with col_orden:
+        columna = st.selectbox("Ordenar por", options=[None] + list(df.columns),
+                               format_func=lambda c: "(sin ordenar)" if c is None else str(c),
+                               key=f"{clave}_orden")
+    with col_sentido:
+        sentido = st.selectbox("Sentido", options=["Ascendente", "Descendente"], key=f"{clave}_sentido")
+    vista = ordenar(buscar(df, texto), columna, sentido == "Ascendente")
+    numero = selector_pagina(len(vista), f"{clave}_pagina")
+    st.dataframe(pagina(vista, numero), width='stretch')
+    # Se exporta la vista completa (búsqueda y orden incluidos), no solo la página
+    boton_exportar(vista, clave, clave)
+
+# Botón de descarga de una tabla en el formato elegido. El archivo se genera
+# por bloques recién al hacer clic (ver exportacion.py), no en cada ejecución.
+def boton_exportar(df, nombre, clave, formatos=None, etiqueta="📥 Exportar"):
+    from exportacion import FORMATOS, contenido_exportado, desde_df, nombre_archivo
+
+    formatos = formatos or tuple(FORMATOS)
+    col_formato, col_boton = st.columns([1, 2])
+    with col_formato:
+        formato = st.selectbox("Formato", options=list(formatos), key=f"{clave}_formato",
+                               label_visibility='collapsed')
+    with col_boton:
+        st.download_button(
+            label=f"{etiqueta} ({len(df):,} filas)",
+            data=lambda: contenido_exportado(desde_df(df), formato, nombre),
+            file_name=nombre_archivo(nombre, formato),
+            mime=FORMATOS[formato][1],
+            on_click='ignore',
+            key=f"{clave}_exportar",
+            width='stretch'
+        )
 
 # Verificar que todos los datos necesarios estén disponibles
-dataframes_requeridos = {
-    'Dispensarios': dispensarios_df,
-    'Alertas': alertas_df,
-    'Control de Calidad': control_calidad_df,
-    'Inventario Depósito': inventario_deposito_df,
-    'Inventario Dispensario': inventario_dispensario_df,
-    'Ventas': ventas_df,
-    'Detalle de Ventas': detalle_venta_df,
-    'Productos': productos_df,
-    'Clientes': clientes_df
+hojas_requeridas = {
+    'Dispensarios': 'Dispensarios',
+    'Alertas': 'Alertas',
+    'Control de Calidad': 'Control_Calidad',
+    'Inventario Depósito': 'Inventario_Deposito',
+    'Inventario Dispensario': 'Inventario_Dispensario',
+    'Ventas': 'Ventas',
+    'Detalle de Ventas': 'Detalle_Venta',
+    'Productos': 'Productos',
+    'Clientes': 'Clientes'
 }
 
-for nombre, df in dataframes_requeridos.items():
-    if df is None:
+for nombre, hoja_logica in hojas_requeridas.items():
+    if not registro.disponible(nombres_hojas[hoja_logica]):
         st.sidebar.warning(f"No se encontraron datos para: {nombre}")
 
+# Versión de los datos de una hoja (cambia cuando se modifica su origen)
+def version_datos(df):
+    return None if df is None else df.attrs.get('version')
+
+# Índice de una dimensión, reconstruido solo cuando cambian sus datos
+@st.cache_resource(max_entries=8)
+def obtener_indice(hoja_logica, version, _df):
+    return IndiceDimension(_df)
+
+def indice(hoja_logica):
+    df = obtener_datos(nombres_hojas[hoja_logica])
+    if df is None or 'id' not in df.columns:
+        return None
+    return obtener_indice(hoja_logica, version_datos(df), df)
+
 # Sidebar con filtros
 st.sidebar.header("Filtros")
+try:
+    dispensarios_df = obtener_datos(nombres_hojas['Dispensarios'])
+except Exception as e:
+    st.sidebar.error(f"Error cargando {nombres_hojas['Dispensarios']}: {e}")
+    dispensarios_df = None
 if dispensarios_df is not None and 'nombre' in dispensarios_df.columns:
     dispensario_options = ["Todos"] + list(dispensarios_df['nombre'].unique())
     selected_dispensario = st.sidebar.selectbox("Seleccionar Dispensario", dispensario_options)
@@ -156,488 +580,731 @@ else:
     selected_dispensario = "Todos"
     st.sidebar.info("No hay datos de dispensarios disponibles para filtrar")
 
-# Convertir fechas si los dataframes existen
-for df in [ventas_df, alertas_df]:
-    if df is not None:
-        if 'fecha_venta' in df.columns:
-            df['fecha_venta'] = pd.to_datetime(df['fecha_venta'], errors='coerce')
-        if 'fecha_creacion' in df.columns:
-            df['fecha_creacion'] = pd.to_datetime(df['fecha_creacion'], errors='coerce')
+rango_fechas = st.sidebar.date_input(
+    "Rango de fechas",
+    value=(),
+    help="Filtra ventas, alertas y controles de calidad por fecha"
+)
+
+# Los filtros se aplican al leer cada hoja, en todas las pestañas de análisis
+dispensario_id = None
+if selected_dispensario != "Todos":
+    dispensario_id = dispensarios_df.loc[dispensarios_df['nombre'] == selected_dispensario, 'id'].iloc[0]
+    dispensario_id = int(dispensario_id) if pd.notna(dispensario_id) else None
+filtro = FiltroDatos(
+    dispensario_id,
+    rango_fechas[0] if len(rango_fechas) > 0 else None,
+    rango_fechas[1] if len(rango_fechas) > 1 else None
+)
 
 # Layout principal
-tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["Resumen", "Inventario", "Ventas", "Calidad y Alertas", "Vistas Personalizadas", "Editor de Datos"])
+# Solo se ejecuta la pestaña abierta, y cada una carga únicamente las hojas que usa
+tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["Resumen", "Inventario", "Ventas", "Calidad y Alertas", "Vistas Personalizadas", "Editor de Datos"],
+                                             key="pestana", on_change="rerun")
 
-with tab1:
-    st.header("Resumen General")
-    
-    # KPIs
-    col1, col2, col3, col4 = st.columns(4)
-    
-    with col1:
-        if ventas_df is not None and 'total' in ventas_df.columns:
-            try:
-                # Asegurarse de que la columna 'total' es numérica
-                ventas_df['total'] = pd.to_numeric(ventas_df['total'], errors='coerce')
-                total_ventas = ventas_df['total'].sum()
-                st.metric("Ventas Totales", f"${total_ventas:,.2f}")
-            except Exception as e:
-                st.error(f"Error calculando ventas totales: {e}")
-                st.metric("Ventas Totales", "Error")
-        else:
-            st.metric("Ventas Totales", "N/D")
-    
-    with col2:
-        if alertas_df is not None and 'estado' in alertas_df.columns:
-            try:
-                alertas_activas = alertas_df[alertas_df['estado'] == 'Activa'].shape[0]
-                st.metric("Alertas Activas", alertas_activas)
-            except Exception as e:
-                st.error(f"Error calculando alertas activas: {e}")
-                st.metric("Alertas Activas", "Error")
-        else:
-            st.metric("Alertas Activas", "N/D")
-    
-    with col3:
-        if (inventario_dispensario_df is not None and 
-            'cantidad' in inventario_dispensario_df.columns and 
-            'stock_minimo' in inventario_dispensario_df.columns):
+with tab1, tramo("pestaña/Resumen", activo=tab1.open):
+    if tab1.open:
+        st.header("Resumen General")
+        
+        # Los KPIs y gráficos salen de los agregados, que también indican si cada
+        # hoja tiene las columnas que usan: de las hojas solo se cargan los
+        # productos, para mostrar sus nombres
+        agregados = actualizar_agregados('ventas', 'productos', 'alertas', 'stock')
+        indice_productos = indice('Productos')
+        
+        # KPIs
+        col1, col2, col3, col4 = st.columns(4)
+        
+        with col1:
+            if agregados.disponible('ventas'):
+                try:
+                    total_ventas = agregados.total_ventas()
+                    st.metric("Ventas Totales", f"${total_ventas:,.2f}")
+                except Exception as e:
+                    st.error(f"Error calculando ventas totales: {e}")
+                    st.metric("Ventas Totales", "Error")
+            else:
+                st.metric("Ventas Totales", "N/D")
+        
+        with col2:
+            if agregados.disponible('alertas'):
+                try:
+                    alertas_activas = agregados.alertas['por_estado'].get('Activa', 0)
+                    st.metric("Alertas Activas", alertas_activas)
+                except Exception as e:
+                    st.error(f"Error calculando alertas activas: {e}")
+                    st.metric("Alertas Activas", "Error")
+            else:
+                st.metric("Alertas Activas", "N/D")
+        
+        with col3:
+            if agregados.disponible('stock'):
+                try:
+                    productos_stock_bajo = agregados.stock
+                    st.metric("Productos con Stock Bajo", productos_stock_bajo)
+                except Exception as e:
+                    st.error(f"Error calculando stock bajo: {e}")
+                    st.metric("Productos con Stock Bajo", "Error")
+            else:
+                st.metric("Productos con Stock Bajo", "N/D")
+        
+        with col4:
+            if agregados.disponible('ventas'):
+                try:
+                    ventas_hoy = agregados.ventas_en_fecha(datetime.today())
+                    st.metric("Ventas Hoy", ventas_hoy)
+                except Exception as e:
+                    st.error(f"Error calculando ventas de hoy: {e}")
+                    st.metric("Ventas Hoy", "Error")
+            else:
+                st.metric("Ventas Hoy", "N/D")
+        
+        # Gráfico de ventas por día
+        st.subheader("Ventas por Día")
+        if agregados.disponible('ventas'):
             try:
-                # Asegurarse de que las columnas son numéricas
-                inventario_dispensario_df['cantidad'] = pd.to_numeric(inventario_dispensario_df['cantidad'], errors='coerce')
-                inventario_dispensario_df['stock_minimo'] = pd.to_numeric(inventario_dispensario_df['stock_minimo'], errors='coerce')
-                
-                productos_stock_bajo = inventario_dispensario_df[
-                    inventario_dispensario_df['cantidad'] <= inventario_dispensario_df['stock_minimo']
-                ].shape[0]
-                st.metric("Productos con Stock Bajo", productos_stock_bajo)
+                fig_ventas = figura('ventas_por_dia', version_hojas('Ventas'), lambda: grafico_lineas(
+                    agregados.ventas_por_dia(), x='fecha_venta', y='total', agregacion='sum',
+                    title='Evolución de Ventas Diarias', color_discrete_sequence=[color_principal]))
+                mostrar_grafico(fig_ventas)
             except Exception as e:
-                st.error(f"Error calculando stock bajo: {e}")
-                st.metric("Productos con Stock Bajo", "Error")
+                st.error(f"Error generando gráfico de ventas: {e}")
         else:
-            st.metric("Productos con Stock Bajo", "N/D")
-    
-    with col4:
-        if ventas_df is not None and 'fecha_venta' in ventas_df.columns:
+            st.warning("No hay datos de ventas disponibles para mostrar")
+        
+        # Top productos
+        st.subheader("Productos Más Vendidos")
+        if (agregados.disponible('productos') and indice_productos is not None and
+            'nombre' in indice_productos.filas.columns):
             try:
-                # Asegurarse de que la fecha está en formato datetime
-                ventas_df['fecha_venta'] = pd.to_datetime(ventas_df['fecha_venta'], errors='coerce')
-                ventas_hoy = ventas_df[ventas_df['fecha_venta'].dt.date == datetime.today().date()].shape[0]
-                st.metric("Ventas Hoy", ventas_hoy)
+                # Cantidades agregadas por producto; solo se resuelven los nombres de los vendidos
+                fig_productos = figura('top_productos', version_hojas('Detalle_Venta', 'Productos'), lambda: grafico_barras(
+                    reportes.top_productos(agregados, indice_productos), x='nombre', y='cantidad',
+                    title='Top 5 Productos por Cantidad Vendida', color_discrete_sequence=[color_secundario]))
+                mostrar_grafico(fig_productos)
             except Exception as e:
-                st.error(f"Error calculando ventas de hoy: {e}")
-                st.metric("Ventas Hoy", "Error")
+                st.error(f"Error generando gráfico de productos: {e}")
         else:
-            st.metric("Ventas Hoy", "N/D")
-    
-    # Gráfico de ventas por día
-    st.subheader("Ventas por Día")
-    if ventas_df is not None and 'fecha_venta' in ventas_df.columns and 'total' in ventas_df.columns:
-        try:
-            # Asegurarse de que las columnas tienen el formato correcto
-            ventas_df['fecha_venta'] = pd.to_datetime(ventas_df['fecha_venta'], errors='coerce')
-            ventas_df['total'] = pd.to_numeric(ventas_df['total'], errors='coerce')
+            st.warning("No hay datos de productos disponibles para mostrar")
+
+        # Agregados del resumen (con los filtros de la barra lateral aplicados)
+        with st.expander("📥 Exportar agregados"):
+            exportables = {
+                'ventas_por_dia': lambda: agregados.ventas_por_dia(),
+                'ventas_por_dispensario': lambda: agregados.ventas_por_dispensario().reset_index(),
+                'cantidad_por_producto': lambda: agregados.cantidad_por_producto().reset_index(),
+            }
+            for nombre_agregado, calcular in exportables.items():
+                try:
+                    boton_exportar(calcular(), nombre_agregado, f"agregado_{nombre_agregado}",
+                                   etiqueta=f"📥 {nombre_agregado}")
+                except Exception as e:
+                    st.error(f"Error exportando {nombre_agregado}: {e}")
+
+with tab2, tramo("pestaña/Inventario", activo=tab2.open):
+    if tab2.open:
+        st.header("Gestión de Inventario")
+        
+        with motor_pestana(['Inventario_Deposito', 'Inventario_Dispensario', 'Productos', 'Dispensarios']) as motor:
             
-            # Eliminar filas con valores NaN
-            ventas_df_clean = ventas_df.dropna(subset=['fecha_venta', 'total'])
+            col1, col2 = st.columns(2)
             
-            ventas_por_dia = ventas_df_clean.groupby(ventas_df_clean['fecha_venta'].dt.date)['total'].sum().reset_index()
-            fig_ventas = px.line(ventas_por_dia, x='fecha_venta', y='total', 
-                                 title='Evolución de Ventas Diarias',
-                                 color_discrete_sequence=[color_principal])
-            st.plotly_chart(fig_ventas, width='stretch')
-        except Exception as e:
-            st.error(f"Error generando gráfico de ventas: {e}")
-    else:
-        st.warning("No hay datos de ventas disponibles para mostrar")
-    
-    # Top productos
-    st.subheader("Productos Más Vendidos")
-    if (detalle_venta_df is not None and productos_df is not None and
-        'producto_id' in detalle_venta_df.columns and 'id' in productos_df.columns and
-        'cantidad' in detalle_venta_df.columns and 'nombre' in productos_df.columns):
-        try:
-            # Asegurarse de que las columnas son numéricas donde es necesario
-            detalle_venta_df['cantidad'] = pd.to_numeric(detalle_venta_df['cantidad'], errors='coerce')
-            detalle_venta_df['producto_id'] = pd.to_numeric(detalle_venta_df['producto_id'], errors='coerce')
-            productos_df['id'] = pd.to_numeric(productos_df['id'], errors='coerce')
+            with col1:
+                st.subheader("Inventario en Depósito")
+                if motor.tiene('Inventario_Deposito') and motor.tiene('Productos'):
+                    try:
+                        def grafico_deposito():
+                            inventario_deposito = motor.consultar("""
+                                SELECT p.nombre, d.cantidad, d.cantidad * 100.0 / d.stock_maximo AS nivel_stock
+                                FROM Inventario_Deposito d
+                                JOIN Productos p ON p.id = d.producto_id
+                                ORDER BY d.id
+                            """)
+                            return grafico_barras(inventario_deposito, x='nombre', y='cantidad',
+                                                  title='Cantidad en Depósito por Producto',
+                                                  color='nivel_stock',
+                                                  color_continuous_scale='RdYlGn')
+                        fig_deposito = figura('inventario_deposito',
+                                              version_hojas('Inventario_Deposito', 'Productos'), grafico_deposito)
+                        mostrar_grafico(fig_deposito)
+                    except Exception as e:
+                        st.error(f"Error generando gráfico de inventario: {e}")
+                else:
+                    st.warning("No hay datos de inventario en depósito disponibles")
             
-            # Eliminar filas con valores NaN
-            detalle_venta_df_clean = detalle_venta_df.dropna(subset=['producto_id', 'cantidad'])
-            productos_df_clean = productos_df.dropna(subset=['id'])
+            with col2:
+                st.subheader("Inventario por Dispensario")
+                if motor.tiene('Inventario_Dispensario') and motor.tiene('Productos') and motor.tiene('Dispensarios'):
+                    try:
+                        def grafico_dispensario():
+                            # El filtro por dispensario ya se aplicó al registrar la hoja
+                            inventario_filtrado = motor.consultar("""
+                                SELECT p.nombre AS nombre_producto, i.cantidad, d.nombre AS nombre_dispensario
+                                FROM Inventario_Dispensario i
+                                JOIN Productos p ON p.id = i.producto_id
+                                JOIN Dispensarios d ON d.id = i.dispensario_id
+                                ORDER BY i.id
+                            """)
+                            return grafico_barras(inventario_filtrado, x='nombre_producto', y='cantidad',
+                                                  color='nombre_dispensario',
+                                                  title=f'Inventario por Producto ({selected_dispensario})')
+                        fig_dispensario = figura(('inventario_dispensario', selected_dispensario),
+                                                 version_hojas('Inventario_Dispensario', 'Productos', 'Dispensarios'),
+                                                 grafico_dispensario)
+                        mostrar_grafico(fig_dispensario)
+                    except Exception as e:
+                        st.error(f"Error generando gráfico de inventario por dispensario: {e}")
+                else:
+                    st.warning("No hay datos de inventario por dispensario disponibles")
             
-            ventas_productos = pd.merge(detalle_venta_df_clean, productos_df_clean, left_on='producto_id', right_on='id')
-            top_productos = ventas_productos.groupby('nombre')['cantidad'].sum().nlargest(5).reset_index()
-            fig_productos = px.bar(top_productos, x='nombre', y='cantidad', 
-                                   title='Top 5 Productos por Cantidad Vendida',
-                                   color_discrete_sequence=[color_secundario])
-            st.plotly_chart(fig_productos, width='stretch')
-        except Exception as e:
-            st.error(f"Error generando gráfico de productos: {e}")
-    else:
-        st.warning("No hay datos de productos disponibles para mostrar")
+            # Productos con stock crítico
+            st.subheader("Productos con Stock Crítico")
+            if reportes.puede_stock_critico(motor):
+                try:
+                    stock_critico = reportes.stock_critico(motor)
+                    
+                    if not stock_critico.empty:
+                        tabla_paginada(stock_critico, "stock_critico")
+                    else:
+                        st.success("No hay productos con stock crítico")
+                except Exception as e:
+                    st.error(f"Error cargando datos de stock crítico: {e}")
+            else:
+                st.warning("No hay datos disponibles para mostrar stock crítico")
+            
+            # Historial de movimientos y stock calculado desde el libro (ver movimientos.py)
+            with st.expander("📒 Movimientos de inventario"):
+                from movimientos import TIPOS, MovimientoInvalido, movimientos_de_ventas, movimientos_iniciales
 
-with tab2:
-    st.header("Gestión de Inventario")
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        st.subheader("Inventario en Depósito")
-        if inventario_deposito_df is not None and productos_df is not None:
-            try:
-                inventario_deposito = pd.merge(inventario_deposito_df, productos_df, 
-                                              left_on='producto_id', right_on='id')
-                inventario_deposito['nivel_stock'] = inventario_deposito['cantidad'] / inventario_deposito['stock_maximo'] * 100
-                
-                fig_deposito = px.bar(inventario_deposito, x='nombre', y='cantidad',
-                                     title='Cantidad en Depósito por Producto',
-                                     color='nivel_stock',
-                                     color_continuous_scale='RdYlGn')
-                st.plotly_chart(fig_deposito, width='stretch')
-            except Exception as e:
-                st.error(f"Error generando gráfico de inventario: {e}")
-        else:
-            st.warning("No hay datos de inventario en depósito disponibles")
-    
-    with col2:
-        st.subheader("Inventario por Dispensario")
-        if inventario_dispensario_df is not None and productos_df is not None and dispensarios_df is not None:
-            try:
-                # Filtrar por dispensario si se seleccionó uno
-                if selected_dispensario != "Todos":
-                    dispensario_id = dispensarios_df[dispensarios_df['nombre'] == selected_dispensario]['id'].iloc[0]
-                    inventario_filtrado = inventario_dispensario_df[inventario_dispensario_df['dispensario_id'] == dispensario_id]
-                else:
-                    inventario_filtrado = inventario_dispensario_df
-                
-                # Unir con datos de productos и dispensarios
-                inventario_filtrado = pd.merge(inventario_filtrado, productos_df, 
-                                              left_on='producto_id', right_on='id')
-                inventario_filtrado = pd.merge(inventario_filtrado, dispensarios_df, 
-                                              left_on='dispensario_id', right_on='id', 
-                                              suffixes=('_producto', '_dispensario'))
-                
-                fig_dispensario = px.bar(inventario_filtrado, x='nombre_producto', y='cantidad',
-                                        color='nombre_dispensario',
-                                        title=f'Inventario por Producto ({selected_dispensario})')
-                st.plotly_chart(fig_dispensario, width='stretch')
-            except Exception as e:
-                st.error(f"Error generando gráfico de inventario por dispensario: {e}")
-        else:
-            st.warning("No hay datos de inventario por dispensario disponibles")
-    
-    # Productos con stock crítico
-    st.subheader("Productos con Stock Crítico")
-    if inventario_dispensario_df is not None and productos_df is not None and dispensarios_df is not None:
-        try:
-            stock_critico = inventario_dispensario_df[
-                inventario_dispensario_df['cantidad'] <= inventario_dispensario_df['stock_minimo']
-            ]
+                libro = obtener_libro_movimientos()
+                try:
+                    if not libro.existe():
+                        st.info("El libro de movimientos está vacío. Se puede iniciar con el stock de las hojas de inventario.")
+                        if st.button("Iniciar con el inventario actual"):
+                            libro.registrar(movimientos_iniciales(
+                                obtener_datos(nombres_hojas['Inventario_Deposito']),
+                                obtener_datos(nombres_hojas['Inventario_Dispensario'])
+                            ))
+                            st.rerun()
+                    else:
+                        fecha_stock = st.date_input("Stock al", value=datetime.today(), key="movimientos_fecha")
+                        # Hasta el final del día elegido
+                        with tramo("movimientos/stock"):
+                            stock_libro = libro.stock(pd.Timestamp(fecha_stock) + pd.Timedelta(days=1, microseconds=-1))
+                        stock_libro['ubicacion'] = ('Dispensario ' + stock_libro['dispensario_id'].astype(str)).where(
+                            stock_libro['dispensario_id'].notna(), 'Depósito')
+                        tabla_paginada(stock_libro[['producto_id', 'ubicacion', 'cantidad']], "movimientos_stock")
+                        
+                        if st.button("Registrar ventas pendientes"):
+                            nuevos = movimientos_de_ventas(obtener_datos(nombres_hojas['Ventas']),
+                                                           obtener_datos(nombres_hojas['Detalle_Venta']),
+                                                           libro.referencias(), libro.fecha_inicio())
+                            st.success(f"{len(libro.registrar(nuevos))} ventas registradas como movimientos")
+                    
+                    st.subheader("Registrar movimiento")
+                    col_tipo, col_producto, col_cantidad = st.columns(3)
+                    with col_tipo:
+                        tipo_movimiento = st.selectbox("Tipo de movimiento", TIPOS)
+                    with col_producto:
+                        producto_movimiento = st.number_input("Producto (id)", min_value=1, step=1)
+                    with col_cantidad:
+                        cantidad_movimiento = st.number_input("Cantidad", value=0.0)
+                    col_desde, col_hacia, col_referencia = st.columns(3)
+                    with col_desde:
+                        desde_movimiento = st.text_input("Desde", help="'deposito' o id de dispensario")
+                    with col_hacia:
+                        hacia_movimiento = st.text_input("Hacia", help="'deposito' o id de dispensario")
+                    with col_referencia:
+                        referencia_movimiento = st.text_input("Referencia")
+                    if st.button("➕ Registrar movimiento"):
+                        try:
+                            libro.registrar([{
+                                'tipo': tipo_movimiento, 'producto_id': producto_movimiento,
+                                'cantidad': cantidad_movimiento, 'desde': desde_movimiento or None,
+                                'hacia': hacia_movimiento or None, 'referencia': referencia_movimiento or None,
+                            }])
+                            st.success("Movimiento registrado")
+                        except MovimientoInvalido as e:
+                            st.warning(str(e))
+                except Exception as e:
+                    st.error(f"Error en el libro de movimientos: {e}")
+
+with tab3, tramo("pestaña/Ventas", activo=tab3.open):
+    if tab3.open:
+        st.header("Análisis de Ventas")
+        
+        agregados = actualizar_agregados('ventas')
+        with motor_pestana(['Ventas', 'Clientes']) as motor:
+            indice_dispensarios = indice('Dispensarios')
             
-            # Realizar los merges correctamente
-            stock_critico = pd.merge(stock_critico, productos_df, left_on='producto_id', right_on='id')
-            stock_critico = pd.merge(stock_critico, dispensarios_df, left_on='dispensario_id', right_on='id')
+            col1, col2 = st.columns(2)
             
-            # Renombrar columnas para mayor claridad
-            stock_critico = stock_critico.rename(columns={
-                'nombre_x': 'nombre_producto',
-                'nombre_y': 'nombre_dispensario'
-            })
+            with col1:
+                st.subheader("Ventas por Método de Pago")
+                if motor.tiene('Ventas', 'metodo_pago', 'total'):
+                    try:
+                        def grafico_metodo():
+                            ventas_metodo = motor.consultar("""
+                                SELECT metodo_pago, SUM(total) AS total
+                                FROM Ventas
+                                WHERE metodo_pago IS NOT NULL
+                                GROUP BY metodo_pago
+                                ORDER BY metodo_pago
+                            """)
+                            return grafico_pastel(ventas_metodo, values='total', names='metodo_pago',
+                                                  title='Distribución de Ventas por Método de Pago')
+                        fig_metodo = figura('ventas_metodo', version_hojas('Ventas'), grafico_metodo)
+                        mostrar_grafico(fig_metodo)
+                    except Exception as e:
+                        st.error(f"Error generando gráfico de métodos de pago: {e}")
+                else:
+                    st.warning("No hay datos de métodos de pago disponibles")
             
-            if not stock_critico.empty:
-                st.dataframe(stock_critico[['nombre_dispensario', 'nombre_producto', 'cantidad', 'stock_minimo']], width='stretch')
+            with col2:
+                st.subheader("Ventas por Dispensario")
+                if motor.tiene('Ventas', 'dispensario_id') and dispensarios_df is not None:
+                    try:
+                        fig_dispensario_ventas = figura(
+                            'ventas_dispensario', version_hojas('Ventas', 'Dispensarios'), lambda: grafico_barras(
+                                reportes.ventas_por_dispensario(agregados, indice_dispensarios), x='nombre', y='total',
+                                title='Ventas Totales por Dispensario', color_discrete_sequence=[color_principal]))
+                        mostrar_grafico(fig_dispensario_ventas)
+                    except Exception as e:
+                        st.error(f"Error generando gráfico de ventas por dispensario: {e}")
+                else:
+                    st.warning("No hay datos de ventas por dispensario disponibles")
+            
+            # Top clientes
+            st.subheader("Top 5 Clientes por Consumo")
+            if reportes.puede_top_clientes(motor):
+                try:
+                    fig_clientes = figura('top_clientes', version_hojas(*reportes.HOJAS_TOP_CLIENTES), lambda: grafico_barras(
+                        reportes.top_clientes(motor, 5), x='nombre_completo', y='total',
+                        title='Top 5 Clientes por Monto Gastado', color_discrete_sequence=[color_secundario]))
+                    mostrar_grafico(fig_clientes)
+                except Exception as e:
+                    st.error(f"Error generando gráfico de clientes: {e}")
             else:
-                st.success("No hay productos con stock crítico")
-        except Exception as e:
-            st.error(f"Error cargando datos de stock crítico: {e}")
-    else:
-        st.warning("No hay datos disponibles para mostrar stock crítico")
-
-with tab3:
-    st.header("Análisis de Ventas")
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        st.subheader("Ventas por Método de Pago")
-        if ventas_df is not None and 'metodo_pago' in ventas_df.columns and 'total' in ventas_df.columns:
-            try:
-                ventas_metodo = ventas_df.groupby('metodo_pago')['total'].sum().reset_index()
-                fig_metodo = px.pie(ventas_metodo, values='total', names='metodo_pago',
-                                   title='Distribución de Ventas por Método de Pago')
-                st.plotly_chart(fig_metodo, width='stretch')
-            except Exception as e:
-                st.error(f"Error generando gráfico de métodos de pago: {e}")
-        else:
-            st.warning("No hay datos de métodos de pago disponibles")
-    
-    with col2:
-        st.subheader("Ventas por Dispensario")
-        if ventas_df is not None and dispensarios_df is not None and 'dispensario_id' in ventas_df.columns:
-            try:
-                ventas_dispensario = pd.merge(ventas_df, dispensarios_df, left_on='dispensario_id', right_on='id')
-                ventas_por_dispensario = ventas_dispensario.groupby('nombre')['total'].sum().reset_index()
-                fig_dispensario_ventas = px.bar(ventas_por_dispensario, x='nombre', y='total',
-                                               title='Ventas Totales por Dispensario',
-                                               color_discrete_sequence=[color_principal])
-                st.plotly_chart(fig_dispensario_ventas, width='stretch')
-            except Exception as e:
-                st.error(f"Error generando gráfico de ventas por dispensario: {e}")
-        else:
-            st.warning("No hay datos de ventas por dispensario disponibles")
-    
-    # Top clientes
-    st.subheader("Top 5 Clientes por Consumo")
-    if ventas_df is not None and clientes_df is not None and 'cliente_id' in ventas_df.columns:
-        try:
-            ventas_clientes = pd.merge(ventas_df, clientes_df, left_on='cliente_id', right_on='id')
-            top_clientes = ventas_clientes.groupby(['nombre', 'apellido'])['total'].sum().nlargest(5).reset_index()
-            top_clientes['nombre_completo'] = top_clientes['nombre'] + ' ' + top_clientes['apellido']
-            fig_clientes = px.bar(top_clientes, x='nombre_completo', y='total',
-                                 title='Top 5 Clientes por Monto Gastado',
-                                 color_discrete_sequence=[color_secundario])
-            st.plotly_chart(fig_clientes, width='stretch')
-        except Exception as e:
-            st.error(f"Error generando gráfico de clientes: {e}")
-    else:
-        st.warning("No hay datos de clientes disponibles")
+                st.warning("No hay datos de clientes disponibles")
 
-with tab4:
-    st.header("Control de Calidad y Alertas")
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        st.subheader("Estado de Alertas")
-        if alertas_df is not None and 'estado' in alertas_df.columns:
-            try:
-                estado_alertas = alertas_df.groupby('estado').size().reset_index(name='count')
-                fig_alertas = px.pie(estado_alertas, values='count', names='estado',
-                                    title='Distribución de Alertas por Estado')
-                st.plotly_chart(fig_alertas, width='stretch')
-            except Exception as e:
-                st.error(f"Error generando gráfico de alertas: {e}")
-        else:
-            st.warning("No hay datos de alertas disponibles")
+with tab4, tramo("pestaña/Calidad y Alertas", activo=tab4.open):
+    if tab4.open:
+        st.header("Control de Calidad y Alertas")
         
-        # Alertas activas por prioridad
-        if alertas_df is not None and 'estado' in alertas_df.columns and 'prioridad' in alertas_df.columns:
-            try:
-                alertas_activas = alertas_df[alertas_df['estado'] == 'Activa']
-                if not alertas_activas.empty:
-                    st.subheader("Alertas Activas por Prioridad")
-                    alertas_prioridad = alertas_activas.groupby('prioridad').size().reset_index(name='count')
-                    fig_prioridad = px.bar(alertas_prioridad, x='prioridad', y='count',
-                                          title='Alertas Activas por Nivel de Prioridad',
-                                          color_discrete_sequence=[color_principal])
-                    st.plotly_chart(fig_prioridad, width='stretch')
-            except Exception as e:
-                st.error(f"Error generando gráfico de prioridad de alertas: {e}")
-        else:
-            st.warning("No hay datos de alertas disponibles")
-    
-    with col2:
-        st.subheader("Resultados de Control de Calidad")
-        if control_calidad_df is not None and 'resultado' in control_calidad_df.columns:
-            try:
-                resultados_calidad = control_calidad_df.groupby('resultado').size().reset_index(name='count')
-                fig_calidad = px.pie(resultados_calidad, values='count', names='resultado',
-                                    title='Distribución de Resultados de Control de Calidad')
-                st.plotly_chart(fig_calidad, width='stretch')
-            except Exception as e:
-                st.error(f"Error generando gráfico de control de calidad: {e}")
-        else:
-            st.warning("No hay datos de control de calidad disponibles")
-    
-    # Detalle de alertas activas
-    st.subheader("Detalle de Alertas Activas")
-    if alertas_df is not None and productos_df is not None:
-        try:
-            alertas_detalle = alertas_df[alertas_df['estado'] == 'Activa']
-            if not alertas_detalle.empty:
-                # Unir solo con las columnas necesarias de productos
-                alertas_detalle = pd.merge(alertas_detalle, productos_df[['id', 'nombre']], 
-                                          left_on='producto_id', right_on='id', how='left')
-                
-                # Seleccionar solo las columnas que existen
-                columnas_disponibles = []
-                for col in ['tipo_alerta', 'mensaje', 'prioridad', 'nombre', 'fecha_creacion']:
-                    if col in alertas_detalle.columns:
-                        columnas_disponibles.append(col)
+        agregados = actualizar_agregados('alertas')
+        with motor_pestana(['Alertas', 'Control_Calidad', 'Productos']) as motor:
+            
+            col1, col2 = st.columns(2)
+            
+            with col1:
+                st.subheader("Estado de Alertas")
+                if motor.tiene('Alertas', 'estado'):
+                    try:
+                        fig_alertas = figura('estado_alertas', version_hojas('Alertas'), lambda: grafico_pastel(
+                            pd.DataFrame(list(agregados.alertas['por_estado'].items()), columns=['estado', 'count']),
+                            values='count', names='estado', title='Distribución de Alertas por Estado'))
+                        mostrar_grafico(fig_alertas)
+                    except Exception as e:
+                        st.error(f"Error generando gráfico de alertas: {e}")
+                else:
+                    st.warning("No hay datos de alertas disponibles")
                 
-                if columnas_disponibles:
-                    st.dataframe(alertas_detalle[columnas_disponibles], width='stretch')
+                # Alertas activas por prioridad
+                if motor.tiene('Alertas', 'estado', 'prioridad'):
+                    try:
+                        activas_por_prioridad = agregados.alertas['activas_por_prioridad']
+                        if activas_por_prioridad:
+                            st.subheader("Alertas Activas por Prioridad")
+                            fig_prioridad = figura('alertas_prioridad', version_hojas('Alertas'), lambda: grafico_barras(
+                                pd.DataFrame(list(activas_por_prioridad.items()), columns=['prioridad', 'count']),
+                                x='prioridad', y='count', title='Alertas Activas por Nivel de Prioridad',
+                                color_discrete_sequence=[color_principal]))
+                            mostrar_grafico(fig_prioridad)
+                    except Exception as e:
+                        st.error(f"Error generando gráfico de prioridad de alertas: {e}")
+                else:
+                    st.warning("No hay datos de alertas disponibles")
+            
+            with col2:
+                st.subheader("Resultados de Control de Calidad")
+                if motor.tiene('Control_Calidad', 'resultado'):
+                    try:
+                        def grafico_calidad():
+                            resultados_calidad = motor.consultar("""
+                                SELECT resultado, COUNT(*) AS "count"
+                                FROM Control_Calidad
+                                WHERE resultado IS NOT NULL
+                                GROUP BY resultado
+                                ORDER BY resultado
+                            """)
+                            return grafico_pastel(resultados_calidad, values='count', names='resultado',
+                                                  title='Distribución de Resultados de Control de Calidad')
+                        fig_calidad = figura('resultados_calidad', version_hojas('Control_Calidad'), grafico_calidad)
+                        mostrar_grafico(fig_calidad)
+                    except Exception as e:
+                        st.error(f"Error generando gráfico de control de calidad: {e}")
                 else:
-                    st.warning("No hay columnas disponibles para mostrar")
+                    st.warning("No hay datos de control de calidad disponibles")
+            
+            # Detalle de alertas activas
+            st.subheader("Detalle de Alertas Activas")
+            if motor.tiene('Alertas') and motor.tiene('Productos'):
+                try:
+                    # Seleccionar solo las columnas que existen; el nombre del producto sale del join
+                    columnas_disponibles = []
+                    for col in ['tipo_alerta', 'mensaje', 'prioridad', 'nombre', 'fecha_creacion']:
+                        if col == 'nombre':
+                            columnas_disponibles.append('p.nombre')
+                        elif motor.tiene('Alertas', col):
+                            columnas_disponibles.append(f"a.{col}")
+                    
+                    alertas_detalle = motor.consultar(f"""
+                        SELECT {', '.join(columnas_disponibles)}
+                        FROM Alertas a
+                        LEFT JOIN Productos p ON p.id = a.producto_id
+                        WHERE a.estado = 'Activa'
+                        ORDER BY a.id
+                    """)
+                    if not alertas_detalle.empty:
+                        tabla_paginada(alertas_detalle, "alertas_activas")
+                    else:
+                        st.success("No hay alertas activas en este momento")
+                except Exception as e:
+                    st.error(f"Error al cargar alertas: {e}")
             else:
-                st.success("No hay alertas activas en este momento")
-        except Exception as e:
-            st.error(f"Error al cargar alertas: {e}")
-    else:
-        st.warning("No hay datos de alertas o productos disponibles")
+                st.warning("No hay datos de alertas o productos disponibles")
 
-with tab5:
-    st.header("Vistas Personalizadas")
-    
-    # Mostrar todas las hojas disponibles
-    st.subheader("Hojas de datos disponibles")
-    for nombre_hoja, df in excel_data.items():
-        with st.expander(f"Hoja: {nombre_hoja}"):
-            st.write(f"Filas: {df.shape[0]}, Columnas: {df.shape[1]}")
-            st.dataframe(df.head(), width='stretch')
-    
-    # Crear vistas personalizadas
-    st.subheader("Crear vista personalizada")
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        hoja_seleccionada = st.selectbox(
-            "Seleccionar hoja de datos",
-            options=list(excel_data.keys())
+with tab5, tramo("pestaña/Vistas Personalizadas", activo=tab5.open):
+    if tab5.open:
+        st.header("Vistas Personalizadas")
+        
+        # Mostrar todas las hojas disponibles. Salen del catálogo: una hoja solo
+        # se lee la primera vez que se ve cada versión.
+        st.subheader("Hojas de datos disponibles")
+        fuentes = [registro.fuente(clave) for clave in registro.claves()]
+        fichas = obtener_catalogo().describir(
+            fuentes, cargar=lambda fuente: registro.cargar(fuente.clave),
+            al_fallar=lambda clave, e: st.error(f"Error cargando {clave}: {e}")
         )
-    
-    with col2:
-        if hoja_seleccionada:
-            df_seleccionado = excel_data[hoja_seleccionada]
-            columnas_seleccionadas = st.multiselect(
-                "Seleccionar columnas",
-                options=list(df_seleccionado.columns),
-                default=list(df_seleccionado.columns)
+        catalogo_hojas = {fuente.clave: ficha for fuente, ficha in zip(fuentes, fichas) if ficha is not None}
+        if catalogo_hojas:
+            st.dataframe(pd.DataFrame([{
+                'hoja': clave,
+                'filas': ficha['filas'],
+                'columnas': len(ficha['columnas']),
+                # Fuente que usan las pestañas para ese nombre de hoja
+                'en uso': registro.resolver(ficha['hoja']) == clave,
+            } for clave, ficha in catalogo_hojas.items()]), hide_index=True, width='stretch')
+        for nombre_hoja, ficha in catalogo_hojas.items():
+            with st.expander(f"Hoja: {nombre_hoja}"):
+                st.write(f"Filas: {ficha['filas']}, Columnas: {len(ficha['columnas'])}")
+                st.dataframe(vista_previa(ficha), width='stretch')
+                st.dataframe(columnas_ficha(ficha), hide_index=True, width='stretch')
+        
+        # Crear vistas personalizadas
+        st.subheader("Crear vista personalizada")
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            hoja_seleccionada = st.selectbox(
+                "Seleccionar hoja de datos",
+                options=list(catalogo_hojas.keys())
             )
-    
-    if hoja_seleccionada and columnas_seleccionadas:
-        df_filtrado = excel_data[hoja_seleccionada][columnas_seleccionadas]
-        st.dataframe(df_filtrado, width='stretch')
         
-        # Opciones de visualización
-        tipo_grafico = st.selectbox(
-            "Tipo de gráfico",
-            options=["Ninguno", "Barras", "Líneas", "Pastel", "Dispersión"]
-        )
+        with col2:
+            if hoja_seleccionada:
+                columnas_hoja = [columna['nombre'] for columna in catalogo_hojas[hoja_seleccionada]['columnas']]
+                columnas_seleccionadas = st.multiselect(
+                    "Seleccionar columnas",
+                    options=columnas_hoja,
+                    default=columnas_hoja
+                )
         
-        if tipo_grafico != "Ninguno":
-            col_x = st.selectbox("Columna para eje X", options=columnas_seleccionadas)
-            col_y = st.selectbox("Columna para eje Y", options=columnas_seleccionadas)
+        if hoja_seleccionada and columnas_seleccionadas:
+            # Solo se carga la hoja elegida
+            df_filtrado = registro.cargar(hoja_seleccionada)[columnas_seleccionadas]
+            tabla_paginada(df_filtrado, f"vista_{hoja_seleccionada}")
             
-            if st.button("Generar gráfico"):
-                try:
-                    if tipo_grafico == "Barras":
-                        fig = px.bar(df_filtrado, x=col_x, y=col_y, title=f"{col_y} por {col_x}")
-                    elif tipo_grafico == "Líneas":
-                        fig = px.line(df_filtrado, x=col_x, y=col_y, title=f"{col_y} por {col_x}")
-                    elif tipo_grafico == "Pastel":
-                        fig = px.pie(df_filtrado, names=col_x, values=col_y, title=f"Distribución de {col_y} por {col_x}")
-                    elif tipo_grafico == "Dispersión":
-                        fig = px.scatter(df_filtrado, x=col_x, y=col_y, title=f"{col_y} vs {col_x}")
-                    
-                    st.plotly_chart(fig, width='stretch')
-                except Exception as e:
-                    st.error(f"Error al generar gráfico: {e}")
+            # Opciones de visualización
+            tipo_grafico = st.selectbox(
+                "Tipo de gráfico",
+                options=["Ninguno", "Barras", "Líneas", "Pastel", "Dispersión"]
+            )
+            
+            if tipo_grafico != "Ninguno":
+                col_x = st.selectbox("Columna para eje X", options=columnas_seleccionadas)
+                col_y = st.selectbox("Columna para eje Y", options=columnas_seleccionadas)
+                
+                if st.button("Generar gráfico"):
+                    try:
+                        def grafico_vista():
+                            if tipo_grafico == "Barras":
+                                return grafico_barras(df_filtrado, x=col_x, y=col_y, title=f"{col_y} por {col_x}")
+                            elif tipo_grafico == "Líneas":
+                                return grafico_lineas(df_filtrado, x=col_x, y=col_y, title=f"{col_y} por {col_x}")
+                            elif tipo_grafico == "Pastel":
+                                return grafico_pastel(df_filtrado, names=col_x, values=col_y, title=f"Distribución de {col_y} por {col_x}")
+                            elif tipo_grafico == "Dispersión":
+                                return grafico_dispersion(df_filtrado, x=col_x, y=col_y, title=f"{col_y} vs {col_x}")
+                        
+                        firma_vista = registro.fuente(hoja_seleccionada).firma
+                        version_vista = firma_vista() if firma_vista is not None else None
+                        fig = figura(('vista', hoja_seleccionada, tuple(columnas_seleccionadas), tipo_grafico, col_x, col_y),
+                                     version_vista, grafico_vista)
+                        mostrar_grafico(fig)
+                    except Exception as e:
+                        st.error(f"Error al generar gráfico: {e}")
+        
+        # Consultas SQL sobre las hojas cargadas (solo lectura)
+        st.subheader("Consulta SQL")
+        st.caption("Cada hoja es una tabla con su nombre lógico (Ventas, Productos, ...) "
+                   "o con su nombre completo entre comillas dobles.")
+        consulta_sql = st.text_area(
+            "Consulta",
+            value="SELECT metodo_pago, COUNT(*) AS ventas, SUM(total) AS total\n"
+                  "FROM Ventas\nGROUP BY metodo_pago\nORDER BY total DESC"
+        )
+        if st.button("Ejecutar consulta"):
+            from consultas import MotorConsultas
 
-with tab6:
-    st.header("Editor de Datos")
-    st.markdown("Esta sección permite editar directamente los datos del archivo Excel.")
-    
-    # Seleccionar archivo para editar
-    archivos_opciones = ["data/db.xlsx"]
-    if archivos_cargados:
-        archivos_opciones.extend([archivo.name for archivo in archivos_cargados])
-    
-    archivo_editar = st.selectbox(
-        "Seleccionar archivo para editar",
-        options=archivos_opciones
-    )
-    
-    # Cargar el archivo seleccionado
-    archivo_data = {}
-    try:
-        if archivo_editar == "data/db.xlsx":
-            if os.path.exists('data/db.xlsx'):
-                archivo_data = pd.read_excel('data/db.xlsx', sheet_name=None)
-            else:
-                st.warning("El archivo data/db.xlsx no existe. Se creará uno nuevo al guardar.")
-        else:
-            # Buscar el archivo cargado
-            for archivo in archivos_cargados:
-                if archivo.name == archivo_editar:
-                    archivo_data = pd.read_excel(archivo, sheet_name=None)
-                    break
-    except Exception as e:
-        st.error(f"Error cargando {archivo_editar}: {e}")
-    
-    # Seleccionar hoja para editar
-    if archivo_data:
-        hojas_disponibles = list(archivo_data.keys())
-        hoja_seleccionada = st.selectbox("Seleccionar hoja para editar", hojas_disponibles)
+            motor = MotorConsultas()
+            try:
+                excel_data = {
+                    clave: df for clave, df in registro.cargar_todas(
+                        al_fallar=lambda clave, e: st.error(f"Error cargando {clave}: {e}")
+                    ).items()
+                    if df is not None
+                }
+                for clave, df in excel_data.items():
+                    motor.registrar(clave, df)
+                for logica, nombre in nombres_hojas.items():
+                    clave = registro.resolver(nombre)
+                    if clave in excel_data and logica not in excel_data:
+                        motor.registrar(logica, excel_data[clave])
+                motor.solo_lectura()
+                resultado_sql = motor.consultar(consulta_sql)
+                st.write(f"Filas: {resultado_sql.shape[0]}")
+                tabla_paginada(resultado_sql, "consulta_sql")
+            except Exception as e:
+                st.error(f"Error en la consulta: {e}")
+            finally:
+                motor.cerrar()
+
+with tab6, tramo("pestaña/Editor de Datos", activo=tab6.open):
+    if tab6.open:
+        st.header("Editor de Datos")
+        st.markdown("Esta sección permite editar directamente los datos del archivo Excel.")
         
-        # Mostrar datos actuales
-        st.subheader(f"Datos actuales en {hoja_seleccionada}")
-        df_actual = archivo_data[hoja_seleccionada]
-        edited_df = st.data_editor(df_actual, num_rows="dynamic", width='stretch')
+        # Seleccionar archivo para editar
+        archivos_opciones = [RUTA_DB]
+        if archivos_cargados:
+            archivos_opciones.extend([archivo.name for archivo in archivos_cargados])
         
-        # Botones para guardar cambios
-        col1, col2, col3 = st.columns(3)
+        archivo_editar = st.selectbox(
+            "Seleccionar archivo para editar",
+            options=archivos_opciones
+        )
         
-        with col1:
-            if st.button("💾 Guardar cambios", width='stretch'):
-                if save_to_excel(edited_df, hoja_seleccionada, archivo_editar):
-                    # Limpiar caché para recargar datos
-                    st.rerun()
+        # Cargar el archivo seleccionado (hoja por hoja, solo la que se edita)
+        archivo_data = {}
+        archivo_origen = None
+        try:
+            if archivo_editar == RUTA_DB:
+                if almacen.existe():
+                    archivo_data = {hoja: None for hoja in almacen.hojas()}
+                elif not obtener_cola_escritura(archivo_editar).hojas_pendientes():
+                    st.warning(f"El archivo {RUTA_DB} no existe. Se creará uno nuevo al guardar.")
+            else:
+                # Buscar el archivo cargado
+                for archivo in archivos_cargados:
+                    if archivo.name == archivo_editar:
+                        archivo_origen = archivo
+                        archivo_data = {hoja: None for hoja in hojas_libro(obtener_cache_libros(), archivo, tipado)}
+                        break
+        except Exception as e:
+            st.error(f"Error cargando {archivo_editar}: {e}")
+        # Las hojas con guardados en curso se editan en su última versión encolada
+        cola_escritura = obtener_cola_escritura(archivo_editar)
+        for hoja in cola_escritura.hojas_pendientes():
+            archivo_data.setdefault(hoja, None)
         
-        with col2:
-            if st.button("🔄 Restaurar original", width='stretch'):
+        # Cambios guardados en el diario que aún no se aplicaron a las hojas base
+        if archivo_editar == RUTA_DB and almacen.registros():
+            st.caption(f"{len(almacen.registros())} cambios pendientes de compactar en el diario")
+            if st.button("🗜️ Compactar diario"):
+                firmas_antes = firmas_agregados()
+                almacen.compactar()
+                # La compactación no cambia el contenido: los agregados siguen vigentes
+                obtener_agregados().registrar_guardado(None, firmas_antes, firmas_agregados())
                 st.rerun()
         
-        with col3:
-            if st.button("📥 Descargar como Excel", width='stretch'):
-                buffer = io.BytesIO()
-                with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-                    edited_df.to_excel(writer, sheet_name=hoja_seleccionada, index=False)
+        # Importar/exportar entre el almacén Parquet y el formato Excel
+        if archivo_editar == RUTA_DB and almacen.tipo == 'parquet':
+            with st.expander("Almacenamiento Parquet"):
+                col_importar, col_exportar = st.columns(2)
+                with col_importar:
+                    if st.button(f"⬆️ Importar desde {RUTA_DB}", width='stretch'):
+                        almacen.importar_xlsx(RUTA_DB)
+                        st.rerun()
+                with col_exportar:
+                    if st.button(f"⬇️ Exportar a {RUTA_DB}", width='stretch'):
+                        almacen.exportar_xlsx(RUTA_DB)
+                        st.success(f"Datos exportados a {RUTA_DB}")
+        
+        # Seleccionar hoja para editar
+        if archivo_data:
+            hojas_disponibles = list(archivo_data.keys())
+            hoja_seleccionada = st.selectbox("Seleccionar hoja para editar", hojas_disponibles)
+            pendiente = cola_escritura.pendiente(hoja_seleccionada)
+            # Hoja completa: solo se carga para hojas chicas y al guardar una página
+            if pendiente is not None:
+                hoja_completa = lambda: pendiente
+            elif archivo_origen is None:
+                hoja_completa = lambda: almacen.leer(hoja_seleccionada)
+            else:
+                hoja_completa = lambda: leer_libro(
+                    obtener_cache_libros(), archivo_origen, tipado, hojas=[hoja_seleccionada])[hoja_seleccionada]
+            # Del almacén se leen solo la cantidad de filas y la página que se muestra
+            lectura_parcial = pendiente is None and archivo_origen is None
+            total_filas = almacen.contar_filas(hoja_seleccionada) if lectura_parcial else len(hoja_completa())
+            
+            # Mostrar datos actuales
+            st.subheader(f"Datos actuales en {hoja_seleccionada}")
+            clave_editor = f"editor_{archivo_editar}_{hoja_seleccionada}"
+            # Al guardar o restaurar cambia la revisión: el editor vuelve a partir de los datos leídos
+            revision = st.session_state.get(f"{clave_editor}_revision", 0)
+            if (total_filas or 0) <= FILAS_POR_PAGINA:
+                df_actual = hoja_completa()
+                edited_df = st.data_editor(df_actual, num_rows="dynamic", width='stretch',
+                                           key=f"{clave_editor}_{revision}")
+                hoja_original, hoja_editada = (lambda: df_actual), (lambda completa: edited_df)
+            else:
+                # Hojas grandes: se edita una página por vez y al guardar se combina
+                # con el resto de la hoja (el diario registra solo las filas cambiadas).
+                # Con cambios sin guardar no se puede cambiar de página: se perderían.
+                clave_pagina = f"{clave_editor}_pagina"
+                estado = st.session_state.get(f"{clave_editor}_{revision}_{st.session_state.get(clave_pagina, 1)}")
+                sin_guardar = bool(estado and (estado.get('edited_rows') or estado.get('added_rows')
+                                               or estado.get('deleted_rows')))
+                numero = selector_pagina(total_filas, clave_pagina, deshabilitado=sin_guardar)
+                if sin_guardar:
+                    st.warning("Hay cambios sin guardar en esta página: guárdelos o restaure el original para cambiar de página.")
+                inicio = (numero - 1) * FILAS_POR_PAGINA
+                if lectura_parcial:
+                    df_pagina = almacen.leer_filas(hoja_seleccionada, inicio, inicio + FILAS_POR_PAGINA)
+                else:
+                    df_pagina = pagina(hoja_completa(), numero)
+                edited_pagina = st.data_editor(df_pagina, num_rows="dynamic", width='stretch',
+                                               key=f"{clave_editor}_{revision}_{numero}")
+                edited_df = edited_pagina
+                hoja_original = hoja_completa
+                hoja_editada = lambda completa: combinar_pagina(completa, df_pagina.index, edited_pagina)
+            
+            # Botones para guardar cambios
+            col1, col2, col3 = st.columns(3)
+            
+            with col1:
+                if st.button("💾 Guardar cambios", width='stretch'):
+                    df_actual = hoja_original()
+                    if (total_filas or 0) > FILAS_POR_PAGINA and df_pagina.attrs.get('firma') != df_actual.attrs.get('firma'):
+                        st.warning("La hoja cambió desde que se leyó esta página. Restaure el original y vuelva a aplicar sus cambios.")
+                    elif save_to_excel(hoja_editada(df_actual), hoja_seleccionada, archivo_editar, original=df_actual):
+                        # Volver a mostrar la hoja con lo guardado (de la cola, si todavía no se escribió)
+                        st.session_state[f"{clave_editor}_revision"] = revision + 1
+                        st.rerun()
+            
+            with col2:
+                if st.button("🔄 Restaurar original", width='stretch'):
+                    st.session_state[f"{clave_editor}_revision"] = revision + 1
+                    st.rerun()
+            
+            with col3:
+                from exportacion import FORMATOS, contenido_exportado, desde_df
+
                 st.download_button(
-                    label="Descargar",
-                    data=buffer.getvalue(),
+                    label="📥 Descargar como Excel",
+                    data=lambda: contenido_exportado(desde_df(hoja_editada(hoja_original())), 'xlsx', hoja_seleccionada),
                     file_name=f"{hoja_seleccionada}_editado.xlsx",
-                    mime="application/vnd.ms-excel",
+                    mime=FORMATOS['xlsx'][1],
+                    on_click='ignore',
                     width='stretch'
                 )
+            
+            # Sección para agregar nuevas columnas
+            st.subheader("Agregar nueva columna")
+            col_nombre = st.text_input("Nombre de la nueva columna")
+            col_tipo = st.selectbox("Tipo de datos", ["Texto", "Número", "Fecha", "Booleano"])
+            
+            if st.button("➕ Agregar columna"):
+                if col_nombre:
+                    if col_tipo == "Texto":
+                        edited_df[col_nombre] = ""
+                    elif col_tipo == "Número":
+                        edited_df[col_nombre] = 0
+                    elif col_tipo == "Fecha":
+                        edited_df[col_nombre] = pd.Timestamp.now()
+                    elif col_tipo == "Booleano":
+                        edited_df[col_nombre] = False
+                    
+                    st.success(f"Columna '{col_nombre}' agregada. Recuerde guardar los cambios.")
+                else:
+                    st.warning("Por favor, ingrese un nombre para la columna")
+            
+            # Sección para crear nuevas hojas
+            st.subheader("Crear nueva hoja")
+            nueva_hoja_nombre = st.text_input("Nombre de la nueva hoja")
+            
+            if st.button("📄 Crear nueva hoja"):
+                if nueva_hoja_nombre:
+                    try:
+                        # El nombre también es el del archivo de la hoja en el backend Parquet
+                        validar_nombre_hoja(nueva_hoja_nombre)
+                        if nueva_hoja_nombre in archivo_data:
+                            raise ValueError(f"Ya existe una hoja llamada '{nueva_hoja_nombre}'")
+                    except ValueError as e:
+                        st.warning(str(e))
+                    else:
+                        # Crear un DataFrame vacío con una columna por defecto
+                        nuevo_df = pd.DataFrame(columns=['ID'])
+                        if save_to_excel(nuevo_df, nueva_hoja_nombre, archivo_editar):
+                            st.rerun()
+                else:
+                    st.warning("Por favor, ingrese un nombre para la nueva hoja")
         
-        # Sección para agregar nuevas columnas
-        st.subheader("Agregar nueva columna")
-        col_nombre = st.text_input("Nombre de la nueva columna")
-        col_tipo = st.selectbox("Tipo de datos", ["Texto", "Número", "Fecha", "Booleano"])
-        
-        if st.button("➕ Agregar columna"):
-            if col_nombre:
-                if col_tipo == "Texto":
-                    edited_df[col_nombre] = ""
-                elif col_tipo == "Número":
-                    edited_df[col_nombre] = 0
-                elif col_tipo == "Fecha":
-                    edited_df[col_nombre] = pd.Timestamp.now()
-                elif col_tipo == "Booleano":
-                    edited_df[col_nombre] = False
-                
-                st.success(f"Columna '{col_nombre}' agregada. Recuerde guardar los cambios.")
-            else:
-                st.warning("Por favor, ingrese un nombre para la columna")
-        
-        # Sección para crear nuevas hojas
-        st.subheader("Crear nueva hoja")
-        nueva_hoja_nombre = st.text_input("Nombre de la nueva hoja")
-        
-        if st.button("📄 Crear nueva hoja"):
-            if nueva_hoja_nombre:
-                # Crear un DataFrame vacío con una columna por defecto
-                nuevo_df = pd.DataFrame(columns=['ID'])
-                if save_to_excel(nuevo_df, nueva_hoja_nombre, archivo_editar):
-                    st.rerun()
-            else:
-                st.warning("Por favor, ingrese un nombre para la nueva hoja")
-    
-    else:
-        st.warning("No hay datos disponibles para editar.")
+        else:
+            st.warning("No hay datos disponibles para editar.")
 
 # Footer
 st.markdown("---")
-st.markdown("© 2024 Sistema de Gestión de Cannabis Medicinal - Todos los derechos reservados")
\ No newline at end of file
+st.markdown("© 2024 Sistema de Gestión de Cannabis Medicinal - Todos los derechos reservados")
+
+# Panel de rendimiento: tramos de este rerun y métricas acumuladas de la app
+metricas = obtener_metricas()
+metricas.registrar(perfil.terminar())
+if st.sidebar.checkbox("Mostrar rendimiento", help="Tiempos, filas y memoria de cada parte del rerun"):
+    with st.sidebar.expander("Rendimiento", expanded=True):
+        memoria = memoria_pico_bytes()
+        presupuesto = metricas.presupuesto(perfil)
+        st.write(f"{'Arranque' if perfil.arranque else 'Rerun'}: {perfil.segundos:.3f} s"
+                 f" (presupuesto {presupuesto:.1f} s)"
+                 + (f" · memoria máxima: {memoria / 2**20:.0f} MB" if memoria is not None else ""))
+        if perfil.segundos > presupuesto:
+            st.warning("Esta ejecución superó su presupuesto de tiempo")
+        if metricas.segundos_arranque is not None and not perfil.arranque:
+            st.caption(f"Arranque en frío: {metricas.segundos_arranque:.3f} s · "
+                       f"ejecuciones sobre el presupuesto: {metricas.excedidos}")
+        st.dataframe(pd.DataFrame([{
+            'tramo': '  ' * t.nivel + t.nombre,
+            'segundos': round(t.segundos, 4),
+            'filas': t.filas,
+        } for t in perfil.tramos]), hide_index=True, width='stretch')
+        if metricas.por_tramo:
+            st.caption(f"Acumulado de {metricas.reruns} reruns")
+            acumulado = pd.DataFrame.from_dict(metricas.por_tramo, orient='index')
+            acumulado['promedio'] = acumulado['segundos'] / acumulado['cantidad']
+            st.dataframe(acumulado.sort_values('segundos', ascending=False).round(4), width='stretch')
+        st.download_button("Métricas (Prometheus)", metricas.a_prometheus(),
+                           file_name="metricas.prom", mime="text/plain", width='stretch')
+        st.download_button("Perfiles (JSON por línea)", metricas.a_json_lineas(),
+                           file_name="perfiles.jsonl", mime="application/x-ndjson", width='stretch')
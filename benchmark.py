@@ -0,0 +1,371 @@
+# Benchmark del tablero con datos sintéticos (ver datos_sinteticos.py).
+# Mide sin navegador cada etapa con la escala elegida: escritura del almacén,
+# carga de cada hoja, agregados del Resumen, consultas SQL, construcción de los
+# gráficos, guardados y la ejecución completa de cada pestaña de app.py (con el
+# AppTest de Streamlit), incluido el arranque en frío en un proceso nuevo. Los
+# resultados se guardan en JSON y se pueden comparar con los de otra ejecución
+# (--comparar) para detectar regresiones, o con los presupuestos de tiempo del
+# arranque y de cada rerun (--presupuesto).
+import argparse
+import importlib.metadata
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from agregados import PARTES, AgregadosResumen
+from almacenamiento import AlmacenExcel, AlmacenParquet
+from cache_libros import CacheLibros, activar_copy_on_write
+from carga_paralela import cantidad_trabajadores
+from consultas import MotorConsultas
+from datos_sinteticos import ESCALAS, escribir, filas_escala, generar
+from diario import AlmacenConDiario
+from esquemas import MAXIMO_FILAS_XLSX, Tipado
+from filtros import FiltroDatos
+from graficos import grafico_barras, grafico_dispersion, grafico_lineas, grafico_pastel
+from metricas import presupuestos
+
+DIRECTORIO_RESULTADOS = 'data/benchmarks'
+
+PESTANAS = ["Resumen", "Inventario", "Ventas", "Calidad y Alertas", "Vistas Personalizadas", "Editor de Datos"]
+
+# Una etapa es una regresión si su mediana empeora más que este porcentaje
+UMBRAL_REGRESION = 0.20
+
+# Filas editadas en el guardado por filas (una página del editor)
+FILAS_EDITADAS = 50
+
+CONSULTAS = {
+    'inventario_por_dispensario': """
+        SELECT d.nombre AS nombre_dispensario, p.nombre AS nombre_producto, i.cantidad, i.stock_minimo
+        FROM Inventario_Dispensario i
+        JOIN Productos p ON p.id = i.producto_id
+        JOIN Dispensarios d ON d.id = i.dispensario_id
+        WHERE i.cantidad <= i.stock_minimo
+    """,
+    'ventas_por_metodo': """
+        SELECT metodo_pago, SUM(total) AS total FROM Ventas GROUP BY metodo_pago
+    """,
+    'top_clientes': """
+        SELECT c.nombre, c.apellido, SUM(v.total) AS total
+        FROM Ventas v JOIN Clientes c ON c.id = v.cliente_id
+        GROUP BY c.nombre, c.apellido
+        ORDER BY total DESC
+        LIMIT 5
+    """,
+    'productos_vendidos': """
+        SELECT p.nombre, SUM(dv.cantidad) AS cantidad
+        FROM Detalle_Venta dv JOIN Productos p ON p.id = dv.producto_id
+        GROUP BY p.nombre
+        ORDER BY cantidad DESC
+        LIMIT 5
+    """,
+}
+
+
+class Medicion:
+    def __init__(self, repeticiones):
+        self.repeticiones = repeticiones
+        self.etapas = {}
+
+    # Ejecuta `funcion` `repeticiones` veces y guarda sus tiempos. Si se pasa
+    # `preparar`, se llama antes de cada repetición (fuera de la medición) y su
+    # resultado se pasa a `funcion`.
+    def medir(self, etapa, funcion, repeticiones=None, preparar=None):
+        tiempos = []
+        resultado = None
+        for _ in range(repeticiones or self.repeticiones):
+            argumentos = (preparar(),) if preparar is not None else ()
+            inicio = time.perf_counter()
+            resultado = funcion(*argumentos)
+            tiempos.append(time.perf_counter() - inicio)
+        self.etapas[etapa] = {
+            'segundos': tiempos,
+            'mediana': statistics.median(tiempos),
+            'minimo': min(tiempos),
+        }
+        print(f"{etapa:<45} {statistics.median(tiempos):10.4f} s", flush=True)
+        return resultado
+
+    def error(self, etapa, error):
+        self.etapas[etapa] = {'error': str(error)}
+        print(f"{etapa:<45} ERROR: {error}", flush=True)
+
+
+def _version(paquete):
+    try:
+        return importlib.metadata.version(paquete)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def entorno():
+    return {
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'cpus': os.cpu_count(),
+        'trabajadores': cantidad_trabajadores(),
+        **{paquete: _version(paquete) for paquete in ['pandas', 'pyarrow', 'duckdb', 'plotly', 'streamlit']},
+    }
+
+
+# Almacén sobre los datos del benchmark, con una caché nueva (lectura en frío)
+def _almacen(directorio_datos, backend):
+    cache = CacheLibros.desde_entorno()
+    if backend == 'parquet':
+        return AlmacenParquet(os.path.join(directorio_datos, 'parquet'), cache, preparar=Tipado())
+    return AlmacenExcel(os.path.join(directorio_datos, 'db.xlsx'), cache, preparar=Tipado())
+
+
+def medir_carga(medicion, directorio_datos, backend, hojas):
+    datos = {}
+    for hoja in hojas:
+        datos[hoja] = medicion.medir(
+            f"carga/{hoja}",
+            lambda almacen, hoja=hoja: almacen.leer(hoja),
+            preparar=lambda: _almacen(directorio_datos, backend),
+        )
+    predicados = FiltroDatos(dispensario_id=1).predicados('Ventas')
+    medicion.medir(
+        "carga/Ventas (filtrada por dispensario)",
+        lambda almacen: almacen.leer('Ventas', filtros=predicados),
+        preparar=lambda: _almacen(directorio_datos, backend),
+    )
+    return datos
+
+
+def medir_agregados(medicion, datos):
+    def calcular():
+        agregados = AgregadosResumen(None)
+        agregados.sincronizar({parte: None for parte in PARTES}, lambda parte: datos.get(PARTES[parte]))
+        return agregados
+    return medicion.medir("agregados/resumen", calcular)
+
+
+def medir_consultas(medicion, datos):
+    motor = MotorConsultas()
+    medicion.medir("consultas/registrar", lambda: [motor.registrar(hoja, df) for hoja, df in datos.items()],
+                   repeticiones=1)
+    for nombre, sql in CONSULTAS.items():
+        medicion.medir(f"consultas/{nombre}", lambda sql=sql: motor.consultar(sql))
+    motor.cerrar()
+
+
+# Cada gráfico se construye y se serializa, como al enviarlo al navegador
+def medir_graficos(medicion, datos, agregados):
+    ventas = datos['Ventas']
+    graficos = {
+        'ventas_por_dia': lambda: grafico_lineas(agregados.ventas_por_dia(), x='fecha_venta', y='total', agregacion='sum'),
+        'lineas_ventas': lambda: grafico_lineas(ventas, x='fecha_venta', y='total', agregacion='sum'),
+        'barras_detalle': lambda: grafico_barras(datos['Detalle_Venta'], x='producto_id', y='cantidad'),
+        'barras_inventario': lambda: grafico_barras(datos['Inventario_Dispensario'], x='producto_id',
+                                                    y='cantidad', color='dispensario_id'),
+        'pastel_metodo_pago': lambda: grafico_pastel(ventas, values='total', names='metodo_pago'),
+        'dispersion_ventas': lambda: grafico_dispersion(ventas, x='fecha_venta', y='total'),
+    }
+    for nombre, construir in graficos.items():
+        medicion.medir(f"graficos/{nombre}", lambda construir=construir: construir().to_json())
+
+
+def medir_guardado(medicion, directorio_datos, backend):
+    base = _almacen(directorio_datos, backend)
+    ruta_diario = os.path.join(directorio_datos, 'benchmark.diario.jsonl')
+    almacen = AlmacenConDiario(base, ruta_diario, maximo_registros=10 ** 9)
+
+    # Una página editada: se cambia el total de las primeras filas
+    def editar():
+        original = almacen.leer('Ventas')
+        editado = original.copy()
+        filas = editado.index[:FILAS_EDITADAS]
+        editado.loc[filas, 'total'] = editado.loc[filas, 'total'] + 1
+        return original, editado
+
+    medicion.medir("guardado/filas", lambda par: almacen.guardar_cambios('Ventas', *par), preparar=editar)
+    medicion.medir("guardado/compactar", almacen.compactar, repeticiones=1)
+    ventas = almacen.leer('Ventas')
+    medicion.medir("guardado/hoja_completa", lambda: almacen.escribir('Ventas', ventas), repeticiones=1)
+
+
+# Arranque en frío: un proceso nuevo de Python que importa Streamlit y ejecuta
+# app.py una vez (las importaciones cuentan, a diferencia de app/inicio)
+def medir_arranque(medicion, directorio_trabajo, backend, ruta_app):
+    codigo = ("from streamlit.testing.v1 import AppTest\n"
+              f"app = AppTest.from_file({ruta_app!r}, default_timeout=24 * 3600)\n"
+              "app.run()\n"
+              "assert not app.exception and not app.error\n")
+    entorno_app = {**os.environ, 'CANNABIS_BACKEND': backend}
+    medicion.medir("app/arranque", lambda: subprocess.run(
+        [sys.executable, '-c', codigo], cwd=directorio_trabajo, env=entorno_app, check=True, capture_output=True))
+
+
+# Ejecuta app.py con el AppTest de Streamlit sobre los datos del benchmark:
+# el arranque en un proceso nuevo, la primera ejecución (en frío), cada pestaña
+# y un rerun sin cambios
+def medir_app(medicion, directorio_trabajo, backend):
+    try:
+        import streamlit as st
+        from streamlit.testing.v1 import AppTest
+    except ImportError as e:
+        medicion.error("app", f"Streamlit no disponible: {e}")
+        return
+
+    ruta_app = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+    directorio_anterior = os.getcwd()
+    backend_anterior = os.environ.get('CANNABIS_BACKEND')
+    os.chdir(directorio_trabajo)
+    os.environ['CANNABIS_BACKEND'] = backend
+    try:
+        def preparar():
+            st.cache_resource.clear()
+            st.cache_data.clear()
+            return AppTest.from_file(ruta_app, default_timeout=24 * 3600)
+
+        def ejecutar(app, pestana=None):
+            if pestana is not None:
+                app.session_state['pestana'] = pestana
+            app.run()
+            # Una pestaña que muestra errores no mide el trabajo real
+            if app.exception:
+                raise RuntimeError(app.exception[0].value)
+            if app.error:
+                raise RuntimeError(app.error[0].value)
+            return app
+
+        try:
+            medir_arranque(medicion, directorio_trabajo, backend, ruta_app)
+        except subprocess.CalledProcessError as e:
+            salida = e.stderr.decode(errors='replace').strip()
+            medicion.error("app/arranque", salida.splitlines()[-1] if salida else e)
+        app = medicion.medir("app/inicio", ejecutar, preparar=preparar)
+        for pestana in PESTANAS[1:]:
+            medicion.medir(f"app/{pestana}", lambda pestana=pestana: ejecutar(app, pestana), repeticiones=1)
+        medicion.medir("app/rerun", lambda: ejecutar(app, PESTANAS[0]))
+    except Exception as e:
+        medicion.error("app", e)
+    finally:
+        os.chdir(directorio_anterior)
+        if backend_anterior is None:
+            os.environ.pop('CANNABIS_BACKEND', None)
+        else:
+            os.environ['CANNABIS_BACKEND'] = backend_anterior
+
+
+def ejecutar_benchmark(escala, backend='xlsx', repeticiones=3, semilla=0, con_app=True):
+    filas_ventas = filas_escala(escala)
+    medicion = Medicion(repeticiones)
+    datos = medicion.medir("generar", lambda: generar(filas_ventas, semilla), repeticiones=1)
+    if backend == 'xlsx' and any(len(df) > MAXIMO_FILAS_XLSX for df in datos.values()):
+        raise ValueError(f"La escala {escala} no entra en un archivo .xlsx; use --backend parquet")
+    filas = {hoja: len(df) for hoja, df in datos.items()}
+
+    with tempfile.TemporaryDirectory(prefix='benchmark_') as directorio_trabajo:
+        # Misma estructura que el directorio de la app: data/db.xlsx o data/parquet
+        directorio_datos = os.path.join(directorio_trabajo, 'data')
+        destino = os.path.join(directorio_datos, 'parquet' if backend == 'parquet' else 'db.xlsx')
+        medicion.medir("escribir_almacen", lambda datos=datos: escribir(datos, destino, backend),
+                       repeticiones=1)
+        # Se libera lo generado antes de medir la carga desde el almacén
+        del datos
+
+        datos = medir_carga(medicion, directorio_datos, backend, list(filas))
+        agregados = medir_agregados(medicion, datos)
+        medir_consultas(medicion, datos)
+        medir_graficos(medicion, datos, agregados)
+        del datos, agregados
+
+        if con_app:
+            medir_app(medicion, directorio_trabajo, backend)
+        medir_guardado(medicion, directorio_datos, backend)
+
+    return {
+        'escala': escala,
+        'filas_ventas': filas_ventas,
+        'backend': backend,
+        'semilla': semilla,
+        'repeticiones': repeticiones,
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'entorno': entorno(),
+        'filas': filas,
+        'etapas': medicion.etapas,
+    }
+
+
+# Etapas que superan su presupuesto de tiempo (ver metricas.presupuestos)
+def verificar_presupuestos(resultado):
+    presupuesto_arranque, presupuesto_rerun = presupuestos()
+    excedidas = []
+    print()
+    for etapa, presupuesto in [('app/arranque', presupuesto_arranque), ('app/rerun', presupuesto_rerun)]:
+        medida = resultado['etapas'].get(etapa, {})
+        if 'mediana' not in medida:
+            continue
+        excedida = medida['mediana'] > presupuesto
+        print(f"{etapa:<45} {medida['mediana']:10.4f} s (presupuesto {presupuesto:.2f} s)"
+              + ('  <- excedido' if excedida else ''))
+        if excedida:
+            excedidas.append(etapa)
+    return excedidas
+
+
+# Compara las medianas con las de un resultado anterior; devuelve las etapas
+# que empeoraron más que `umbral`
+def comparar(actual, anterior, umbral=UMBRAL_REGRESION):
+    regresiones = []
+    print(f"\n{'etapa':<45} {'anterior':>10} {'actual':>10} {'cambio':>8}")
+    for etapa, medida in actual['etapas'].items():
+        previa = anterior.get('etapas', {}).get(etapa)
+        if 'mediana' not in medida or not previa or 'mediana' not in previa:
+            continue
+        cambio = medida['mediana'] / previa['mediana'] - 1 if previa['mediana'] else 0.0
+        marca = '  <- regresión' if cambio > umbral else ''
+        print(f"{etapa:<45} {previa['mediana']:10.4f} {medida['mediana']:10.4f} {cambio:+8.1%}{marca}")
+        if cambio > umbral:
+            regresiones.append(etapa)
+    return regresiones
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark del tablero con datos sintéticos")
+    parser.add_argument('--escala', default='10k', help=f"{', '.join(ESCALAS)} o cantidad de filas de Ventas")
+    parser.add_argument('--backend', choices=['xlsx', 'parquet'], default='xlsx')
+    parser.add_argument('--repeticiones', type=int, default=3)
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--sin-app', action='store_true', help="No ejecutar app.py con AppTest")
+    parser.add_argument('--salida', help=f"Archivo JSON de resultados (por defecto en {DIRECTORIO_RESULTADOS}/)")
+    parser.add_argument('--comparar', help="Resultado JSON anterior con el que comparar")
+    parser.add_argument('--umbral', type=float, default=UMBRAL_REGRESION)
+    parser.add_argument('--presupuesto', action='store_true',
+                        help="Terminar con error si el arranque o el rerun superan su presupuesto")
+    args = parser.parse_args()
+
+    activar_copy_on_write()
+    resultado = ejecutar_benchmark(args.escala, args.backend, args.repeticiones, args.semilla,
+                                   con_app=not args.sin_app)
+
+    salida = args.salida or os.path.join(
+        DIRECTORIO_RESULTADOS, f"{args.escala}-{args.backend}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    if os.path.dirname(salida):
+        os.makedirs(os.path.dirname(salida), exist_ok=True)
+    with open(salida, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados: {salida}")
+
+    fallas = False
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            anterior = json.load(f)
+        regresiones = comparar(resultado, anterior, args.umbral)
+        if regresiones:
+            print(f"\n{len(regresiones)} etapas empeoraron más de {args.umbral:.0%}")
+            fallas = True
+    excedidas = verificar_presupuestos(resultado)
+    if args.presupuesto and excedidas:
+        print(f"\n{len(excedidas)} etapas superaron su presupuesto")
+        fallas = True
+    if fallas:
+        sys.exit(1)
@@ -0,0 +1,129 @@
+# Escrituras seguras con varios usuarios y procesos.
+# Cada almacén tiene un archivo de bloqueo: las escrituras toman el bloqueo
+# exclusivo (entre hilos y entre procesos) y generan los archivos completos en
+# un temporal del mismo directorio que después reemplaza al original con un
+# rename atómico. Los lectores no toman el bloqueo: siempre ven la versión
+# anterior o la nueva completa, nunca un archivo a medio escribir. Las ediciones
+# llevan la versión de los datos sobre la que se hicieron; si al guardar la
+# hoja ya cambió, se rechazan con VersionObsoleta.
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: bloqueo con msvcrt
+    fcntl = None
+    import msvcrt
+
+# Segundos de espera por el bloqueo (configurable con CANNABIS_BLOQUEO_SEGUNDOS)
+ESPERA_POR_DEFECTO = 30.0
+
+
+def espera_segundos():
+    try:
+        return float(os.environ.get('CANNABIS_BLOQUEO_SEGUNDOS', ESPERA_POR_DEFECTO))
+    except ValueError:
+        return ESPERA_POR_DEFECTO
+
+
+class BloqueoOcupado(TimeoutError):
+    pass
+
+
+# La hoja cambió desde que se leyó la versión sobre la que se hicieron los cambios
+class VersionObsoleta(RuntimeError):
+    def __init__(self, hoja):
+        super().__init__(f"La hoja '{hoja}' fue modificada por otro usuario después de abrirla")
+        self.hoja = hoja
+
+
+def _intentar_bloqueo(archivo):
+    try:
+        if fcntl is not None:
+            fcntl.flock(archivo.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            archivo.seek(0)
+            msvcrt.locking(archivo.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _soltar_bloqueo(archivo):
+    if fcntl is not None:
+        fcntl.flock(archivo.fileno(), fcntl.LOCK_UN)
+    else:
+        archivo.seek(0)
+        msvcrt.locking(archivo.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+# Bloqueo exclusivo sobre un archivo, reentrante dentro de un mismo hilo (por
+# ejemplo, la compactación del diario reescribe hojas con el bloqueo ya tomado)
+class BloqueoArchivo:
+    def __init__(self, ruta, espera=None):
+        self.ruta = ruta
+        self.espera = espera
+        self._hilos = threading.RLock()
+        self._nivel = 0
+        self._archivo = None
+
+    def __enter__(self):
+        espera = self.espera if self.espera is not None else espera_segundos()
+        limite = time.monotonic() + espera
+        if not self._hilos.acquire(timeout=espera):
+            raise BloqueoOcupado(f"No se pudo tomar el bloqueo {self.ruta}")
+        try:
+            if self._nivel == 0:
+                directorio = os.path.dirname(self.ruta)
+                if directorio:
+                    os.makedirs(directorio, exist_ok=True)
+                archivo = open(self.ruta, 'a+b')
+                while not _intentar_bloqueo(archivo):
+                    if time.monotonic() >= limite:
+                        archivo.close()
+                        raise BloqueoOcupado(f"No se pudo tomar el bloqueo {self.ruta}: otro proceso está guardando")
+                    time.sleep(0.05)
+                self._archivo = archivo
+        except BaseException:
+            self._hilos.release()
+            raise
+        self._nivel += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._nivel -= 1
+        if self._nivel == 0:
+            try:
+                _soltar_bloqueo(self._archivo)
+            finally:
+                self._archivo.close()
+                self._archivo = None
+        self._hilos.release()
+
+
+# Escribe `ruta` de forma atómica: `escribir(temporal)` genera el archivo completo
+# en un temporal del mismo directorio (con la misma extensión), que se pasa a
+# disco y reemplaza al original. Si algo falla, el original queda intacto.
+def reemplazo_atomico(ruta, escribir):
+    directorio, nombre = os.path.split(os.path.abspath(ruta))
+    os.makedirs(directorio, exist_ok=True)
+    descriptor, temporal = tempfile.mkstemp(
+        dir=directorio, prefix=f".{nombre}.", suffix=os.path.splitext(nombre)[1])
+    os.close(descriptor)
+    try:
+        escribir(temporal)
+        # mkstemp crea el temporal solo con permisos para el dueño
+        if os.path.exists(ruta):
+            shutil.copymode(ruta, temporal)
+        else:
+            os.chmod(temporal, 0o644)
+        with open(temporal, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(temporal, ruta)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
@@ -0,0 +1,286 @@
+# Caché de libros Excel ya parseados, compartida entre reruns de Streamlit.
+# Las entradas se identifican por ruta + mtime + tamaño (archivos en disco) o por
+# el hash SHA-256 del contenido (archivos subidos), y se desalojan en orden LRU
+# cuando se supera el presupuesto de memoria. Cada hoja es una entrada propia,
+# así que se puede parsear (y desalojar) una hoja sin tocar el resto del libro.
+# La caché es el conjunto de datos compartido por todas las sesiones: cada
+# lectura devuelve una copia superficial (los datos no se duplican) y, con
+# Copy-on-Write, la sesión que modifica su copia obtiene columnas propias sin
+# alterar la caché. Cada versión de un archivo es una clave distinta; al guardar
+# una hoja, las demás pasan ya parseadas a la versión nueva. Para un archivo en
+# disco también se puede publicar la versión que ven las lecturas (ver
+# vigilante.py): mientras una versión nueva se parsea en segundo plano, las
+# lecturas siguen usando la anterior, y el cambio de versión es atómico.
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+PANDAS_3 = int(pd.__version__.split('.')[0]) >= 3
+
+# Presupuesto de memoria por defecto en MB (configurable con CANNABIS_CACHE_MB)
+PRESUPUESTO_MB_POR_DEFECTO = 256
+
+
+# Copy-on-Write: siempre activo desde pandas 3; en versiones anteriores lo
+# activa el punto de entrada (app.py, api.py) y no este módulo al importarse
+def activar_copy_on_write():
+    if not PANDAS_3:
+        try:
+            pd.set_option('mode.copy_on_write', True)
+        except KeyError:  # pandas < 1.5 no lo tiene
+            pass
+
+
+def copy_on_write_activo():
+    if PANDAS_3:
+        return True
+    try:
+        return pd.get_option('mode.copy_on_write') is True  # 'warn' no copia al escribir
+    except KeyError:
+        return False
+
+
+# Función para estimar la memoria ocupada por un libro parseado
+def tamano_libro(hojas):
+    return int(sum(df.memory_usage(index=True, deep=True).sum() for df in hojas.values()))
+
+
+# Clave de caché para un archivo en disco: cambia si se modifica el archivo
+def clave_archivo(ruta):
+    info = os.stat(ruta)
+    return ('archivo', os.path.abspath(ruta), info.st_mtime_ns, info.st_size)
+
+
+# Clave de caché para un archivo subido: hash del contenido
+def clave_contenido(contenido):
+    return ('contenido', hashlib.sha256(contenido).hexdigest())
+
+
+# Hash del contenido de un archivo subido leído por partes, sin copiarlo entero
+def huella_archivo(archivo, tamano_parte=1024 * 1024):
+    resumen = hashlib.sha256()
+    archivo.seek(0)
+    for parte in iter(lambda: archivo.read(tamano_parte), b''):
+        resumen.update(parte)
+    archivo.seek(0)
+    return resumen.hexdigest()
+
+
+class CacheLibros:
+    def __init__(self, presupuesto_bytes):
+        self.presupuesto_bytes = presupuesto_bytes
+        self._entradas = OrderedDict()  # clave -> (hojas, bytes)
+        self._nombres = {}  # clave del libro -> nombres de sus hojas
+        self._publicadas = {}  # (ruta absoluta, preparado) -> clave del libro publicada
+        self._uso_bytes = 0
+        self._aciertos = 0
+        self._fallos = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def desde_entorno(cls):
+        try:
+            megabytes = float(os.environ.get('CANNABIS_CACHE_MB', PRESUPUESTO_MB_POR_DEFECTO))
+        except ValueError:
+            megabytes = PRESUPUESTO_MB_POR_DEFECTO
+        return cls(int(megabytes * 1024 * 1024))
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self._fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self._aciertos += 1
+            return entrada[0]
+
+    # Si hay una entrada, sin contarla como acierto ni moverla en el orden LRU
+    def contiene(self, clave):
+        with self._lock:
+            return clave in self._entradas
+
+    def guardar(self, clave, hojas):
+        tamano = tamano_libro(hojas)
+        with self._lock:
+            self._guardar(clave, hojas, tamano)
+
+    # Nombres de las hojas de un libro, leídos una sola vez por versión
+    def nombres_hojas(self, clave, fuente):
+        with self._lock:
+            nombres = self._nombres.get(clave)
+        if nombres is None:
+            nombres = _leer_nombres_hojas(fuente)
+            with self._lock:
+                self._nombres[clave] = nombres
+        return list(nombres)
+
+    # Clave del libro en disco que usan las lecturas: la versión publicada o, si
+    # no hay ninguna, la versión actual del archivo
+    def clave_vigente(self, ruta, preparar=None):
+        with self._lock:
+            publicada = self._publicadas.get(_llave_publicacion(ruta, preparar))
+        if publicada is not None:
+            return publicada
+        return _con_preparar(clave_archivo(ruta), preparar)
+
+    # Pasa un archivo en disco de la versión `anterior` a la versión `clave`.
+    # `hojas` son hojas de la versión nueva ya parseadas y `conservar`, las que no
+    # cambiaron: sus entradas pasan a la versión nueva sin volver a parsearlas. El
+    # resto de la versión anterior se descarta. Con `publicar=True` la versión
+    # nueva queda como la que ven las lecturas (ver clave_vigente); si no, las
+    # lecturas usan la versión actual del archivo.
+    def nueva_version(self, ruta, preparar, anterior, clave, nombres, hojas=None, conservar=(), publicar=False):
+        hojas = hojas or {}
+        tamanos = {hoja: tamano_libro({hoja: df}) for hoja, df in hojas.items()}
+        llave = _llave_publicacion(ruta, preparar)
+        with self._lock:
+            if anterior is not None and anterior != clave:
+                for hoja in conservar:
+                    entrada = self._entradas.get(anterior + (hoja,))
+                    if entrada is not None and clave + (hoja,) not in self._entradas:
+                        self._quitar(anterior + (hoja,))
+                        self._guardar(clave + (hoja,), *entrada)
+                for vieja in [c for c in self._entradas if c[:-1] == anterior]:
+                    self._quitar(vieja)
+                self._nombres.pop(anterior, None)
+            for hoja, df in hojas.items():
+                self._guardar(clave + (hoja,), {hoja: df}, tamanos[hoja])
+            self._nombres[clave] = list(nombres)
+            if publicar:
+                self._publicadas[llave] = clave
+            else:
+                self._publicadas.pop(llave, None)
+
+    # Elimina todas las versiones cacheadas de un archivo en disco
+    def invalidar(self, ruta):
+        ruta_absoluta = os.path.abspath(ruta)
+        with self._lock:
+            for llave in [l for l in self._publicadas if l[0] == ruta_absoluta]:
+                del self._publicadas[llave]
+            for clave in [c for c in self._entradas if c[0] == 'archivo' and c[1] == ruta_absoluta]:
+                self._quitar(clave)
+            for clave in [c for c in self._nombres if c[0] == 'archivo' and c[1] == ruta_absoluta]:
+                del self._nombres[clave]
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._nombres.clear()
+            self._publicadas.clear()
+            self._uso_bytes = 0
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                'entradas': len(self._entradas),
+                'uso_bytes': self._uso_bytes,
+                'presupuesto_bytes': self.presupuesto_bytes,
+                'aciertos': self._aciertos,
+                'fallos': self._fallos,
+            }
+
+    def _guardar(self, clave, hojas, tamano):
+        if clave in self._entradas:
+            self._quitar(clave)
+        # Un libro más grande que todo el presupuesto no se guarda
+        if tamano > self.presupuesto_bytes:
+            return
+        while self._entradas and self._uso_bytes + tamano > self.presupuesto_bytes:
+            self._quitar(next(iter(self._entradas)))
+        self._entradas[clave] = (hojas, tamano)
+        self._uso_bytes += tamano
+
+    def _quitar(self, clave):
+        _, tamano = self._entradas.pop(clave)
+        self._uso_bytes -= tamano
+
+
+# La clave de un libro incluye la del preparado que se le aplica al parsearlo
+def _con_preparar(clave, preparar):
+    if preparar is not None:
+        clave = clave + (getattr(preparar, 'clave', None),)
+    return clave
+
+
+def _llave_publicacion(ruta, preparar):
+    return (os.path.abspath(ruta), _con_preparar((), preparar))
+
+
+# Fuente que acepta pandas / openpyxl (los bytes de un archivo subido van en un BytesIO)
+def abrir_fuente(fuente):
+    return io.BytesIO(fuente) if isinstance(fuente, bytes) else fuente
+
+
+def _leer_nombres_hojas(fuente):
+    from openpyxl import load_workbook
+
+    libro = load_workbook(abrir_fuente(fuente), read_only=True)
+    try:
+        return libro.sheetnames
+    finally:
+        libro.close()
+
+
+# Clave de caché y fuente parseable de un origen (ruta o archivo subido).
+# Para los archivos subidos la fuente es el contenido en bytes. Con `cache`, la
+# clave de un archivo en disco es la de su versión publicada, si la hay.
+def identificar_origen(origen, preparar=None, cache=None):
+    if isinstance(origen, (str, os.PathLike)):
+        if cache is not None:
+            return cache.clave_vigente(origen, preparar), origen
+        return _con_preparar(clave_archivo(origen), preparar), origen
+    fuente = origen.getvalue() if hasattr(origen, 'getvalue') else origen.read()
+    return _con_preparar(clave_contenido(fuente), preparar), fuente
+
+
+# Como identificar_origen para un archivo subido cuya huella ya se calculó:
+# misma clave, pero la fuente es el propio archivo y no una copia en bytes (sirve
+# para openpyxl, no para mandarla al pool de procesos)
+def identificar_subida(archivo, huella, preparar=None):
+    return _con_preparar(('contenido', huella), preparar), archivo
+
+
+# Nombres de las hojas de un libro sin parsear sus datos
+def hojas_libro(cache, origen, preparar=None):
+    clave, fuente = identificar_origen(origen, preparar, cache)
+    return cache.nombres_hojas(clave, fuente)
+
+
+# Función para leer un libro (o solo las hojas de `hojas`) pasando por la caché.
+# `origen` puede ser una ruta o un archivo subido (UploadedFile / BytesIO).
+# `preparar(hoja, df)` se aplica una sola vez al parsear (por ejemplo, el tipado)
+# y su resultado es lo que queda en la caché. Solo se parsean las hojas pedidas
+# que no estén ya en la caché.
+def leer_libro(cache, origen, preparar=None, hojas=None):
+    clave, fuente = identificar_origen(origen, preparar, cache)
+    nombres = cache.nombres_hojas(clave, fuente)
+    if hojas is not None:
+        nombres = [hoja for hoja in nombres if hoja in hojas]
+
+    parseadas = {}
+    for hoja in nombres:
+        entrada = cache.obtener(clave + (hoja,))
+        if entrada is not None:
+            parseadas[hoja] = entrada[hoja]
+    faltantes = [hoja for hoja in nombres if hoja not in parseadas]
+    if faltantes:
+        for hoja, df in pd.read_excel(abrir_fuente(fuente), sheet_name=faltantes).items():
+            if preparar is not None:
+                df = preparar(hoja, df)
+            cache.guardar(clave + (hoja,), {hoja: df})
+            parseadas[hoja] = df
+
+    # Copias superficiales: con Copy-on-Write las asignaciones de columnas en la app no
+    # alteran la caché. Sin Copy-on-Write solo una copia completa la protege.
+    # La clave de caché identifica la versión de los datos de cada hoja.
+    profunda = not copy_on_write_activo()
+    copias = {}
+    for hoja in nombres:
+        copias[hoja] = parseadas[hoja].copy(deep=profunda)
+        copias[hoja].attrs['version'] = clave + (hoja,)
+    return copias
@@ -0,0 +1,143 @@
+# Carga en paralelo de varios libros Excel y de sus hojas.
+# El parseo de XLSX es CPU y Python puro, así que se reparte por hoja en un pool
+# de procesos. El resultado se deja en la caché de libros, de modo que la carga
+# normal (leer_libro) encuentra todo ya parseado.
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+
+from cache_libros import abrir_fuente, identificar_origen
+
+
+# CPUs que este proceso puede usar (en contenedores puede ser menos que os.cpu_count())
+def _cpus_disponibles():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+# Cantidad de procesos (configurable con CANNABIS_TRABAJADORES; 1 desactiva el pool)
+def cantidad_trabajadores():
+    try:
+        return int(os.environ.get('CANNABIS_TRABAJADORES', _cpus_disponibles()))
+    except ValueError:
+        return _cpus_disponibles()
+
+
+# Segundos que espera cada proceso nuevo a que arranquen los demás
+ESPERA_ARRANQUE = 60
+
+# Los procesos con 'forkserver' o 'spawn' vuelven a importar el módulo __main__
+# del padre al arrancar, y Streamlit instala ahí la app: los hijos la ejecutarían
+# entera. Por eso todos los procesos del pool se crean juntos al crearlo, una
+# sola vez, con este módulo (que solo importa lo necesario para _parsear_hoja)
+# como __main__. Después el pool no crea procesos nuevos.
+_bloqueo_main = threading.Lock()
+
+
+def _esperar_a_los_demas(barrera):
+    barrera.wait(ESPERA_ARRANQUE)
+
+
+# Cada proceso espera en la barrera hasta que existen todos, así ninguno queda
+# libre antes de tiempo y cada tarea de arranque crea un proceso propio
+def _pool_procesos(trabajadores, contexto):
+    ejecutor = ProcessPoolExecutor(max_workers=trabajadores, mp_context=contexto,
+                                   initializer=_esperar_a_los_demas,
+                                   initargs=(contexto.Barrier(trabajadores),))
+    este = sys.modules[__name__]
+    with _bloqueo_main:
+        principal = sys.modules.get('__main__')
+        sys.modules['__main__'] = este
+        try:
+            arranques = [ejecutor.submit(os.getpid) for _ in range(trabajadores)]
+        finally:
+            # Si otra sesión instaló su app mientras tanto, se deja la suya
+            if sys.modules.get('__main__') is este:
+                sys.modules['__main__'] = principal
+    try:
+        for arranque in arranques:
+            arranque.result()
+    except BaseException:
+        ejecutor.shutdown(wait=False, cancel_futures=True)
+        raise
+    return ejecutor
+
+
+# Pool para el parseo. El servidor de Streamlit tiene varios hilos (y el
+# vigilante usa este pool desde uno de ellos), así que no se usa 'fork': un hijo
+# copiado mientras otro hilo tiene tomado un bloqueo puede quedar trabado. Donde
+# no hay 'forkserver' ni 'spawn', o no se pueden crear procesos, se usa un pool
+# de hilos.
+def crear_ejecutor(trabajadores=None):
+    trabajadores = trabajadores or cantidad_trabajadores()
+    if trabajadores <= 1:
+        return None
+    metodos = multiprocessing.get_all_start_methods()
+    for metodo in ('forkserver', 'spawn'):
+        if metodo in metodos:
+            try:
+                return _pool_procesos(trabajadores, multiprocessing.get_context(metodo))
+            except (OSError, ValueError, NotImplementedError, BrokenProcessPool):
+                break
+    return ThreadPoolExecutor(max_workers=trabajadores)
+
+
+# Tarea de cada proceso: parsear (y tipar) una sola hoja de un libro
+def _parsear_hoja(fuente, hoja, preparar):
+    df = pd.read_excel(abrir_fuente(fuente), sheet_name=hoja)
+    return preparar(hoja, df) if preparar is not None else df
+
+
+# Parsea (y tipa) varias hojas de un libro, repartidas en el pool si hay uno.
+# Devuelve {hoja: DataFrame}; si el pool se rompe, las hojas se parsean aquí.
+def parsear_hojas(fuente, hojas, preparar=None, ejecutor=None):
+    if ejecutor is not None and len(hojas) > 1:
+        try:
+            tareas = {hoja: ejecutor.submit(_parsear_hoja, fuente, hoja, preparar) for hoja in hojas}
+            return {hoja: tarea.result() for hoja, tarea in tareas.items()}
+        except BrokenProcessPool:
+            pass
+    return {hoja: _parsear_hoja(fuente, hoja, preparar) for hoja in hojas}
+
+
+# Parsea en paralelo las hojas que no estén en la caché y las guarda en ella.
+# `pedidos` es una lista de (origen, hojas); con hojas=None se parsea el libro
+# completo. Las hojas que fallan se omiten: la carga secuencial posterior
+# informa el error de cada archivo como siempre.
+def precargar_libros(cache, pedidos, preparar=None, ejecutor=None):
+    pendientes = []
+    for origen, hojas in pedidos:
+        try:
+            clave, fuente = identificar_origen(origen, preparar, cache)
+            nombres = cache.nombres_hojas(clave, fuente)
+        except Exception:
+            continue
+        for hoja in nombres:
+            if (hojas is None or hoja in hojas) and cache.obtener(clave + (hoja,)) is None:
+                pendientes.append((clave, fuente, hoja))
+
+    # Con una sola hoja por parsear el pool no aporta nada
+    if ejecutor is None or len(pendientes) < 2:
+        return
+
+    try:
+        tareas = [
+            (clave, hoja, ejecutor.submit(_parsear_hoja, fuente, hoja, preparar))
+            for clave, fuente, hoja in pendientes
+        ]
+        for clave, hoja, tarea in tareas:
+            try:
+                cache.guardar(clave + (hoja,), {hoja: tarea.result()})
+            except BrokenProcessPool:
+                raise
+            except Exception:
+                continue
+    except BrokenProcessPool:
+        # Si el pool se rompe, la carga sigue de forma secuencial
+        return
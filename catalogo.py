@@ -0,0 +1,212 @@
+# Catálogo de las hojas disponibles (del almacén por defecto y de los archivos
+# subidos) con una ficha por hoja: cantidad de filas, tipo, nulos, mínimo y
+# máximo de cada columna y unas filas de vista previa. Cada ficha se guarda
+# junto con la firma de la versión de la hoja y se recalcula solo cuando esa
+# firma cambia; las fichas persisten en data/catalogo.json, así que listar las
+# hojas no vuelve a leerlas aunque la app se reinicie. Las hojas con un archivo
+# Parquet al día se describen con los metadatos del archivo (esquema y
+# estadísticas de los row groups), sin leer sus datos.
+#
+# También define qué fuente gana cuando varias tienen una hoja con el mismo
+# nombre (ver prioridad y registro.RegistroDatos.resolver).
+import json
+import os
+import threading
+
+import pandas as pd
+
+from almacenamiento import importar_pyarrow
+from bloqueos import reemplazo_atomico
+
+RUTA_CATALOGO = 'data/catalogo.json'
+FILAS_VISTA_PREVIA = 5
+MAXIMO_FICHAS = 500
+
+# Precedencias entre data/db.xlsx y los archivos subidos
+ALMACEN = 'almacen'
+SUBIDOS = 'subidos'
+
+
+# CANNABIS_PRECEDENCIA: 'almacen' (por defecto) o 'subidos'
+def precedencia():
+    valor = os.environ.get('CANNABIS_PRECEDENCIA', ALMACEN).strip().lower()
+    return valor if valor in (ALMACEN, SUBIDOS) else ALMACEN
+
+
+# Prioridad de una fuente al resolver una hoja por su nombre (gana la mayor).
+# `posicion` es el orden del archivo subido (None para el almacén por defecto).
+# Con 'almacen' las hojas de data/db.xlsx ganan y, entre los archivos subidos,
+# gana el primero; con 'subidos' los archivos ganan sobre data/db.xlsx y, entre
+# ellos, gana el último subido.
+def prioridad(posicion=None, modo=None):
+    if posicion is None:
+        return 0
+    if (modo or precedencia()) == SUBIDOS:
+        return posicion + 1
+    return -(posicion + 1)
+
+
+def _firma_json(firma):
+    # Las firmas se comparan después de pasar por JSON (las tuplas pasan a listas)
+    return json.loads(json.dumps(firma, default=str))
+
+
+def _valor_json(valor):
+    if valor is None or (not isinstance(valor, (list, tuple)) and pd.isna(valor)):
+        return None
+    if hasattr(valor, 'isoformat'):
+        return valor.isoformat()
+    if hasattr(valor, 'item'):
+        return valor.item()
+    return valor
+
+
+# Columnas para las que se guarda el mínimo y el máximo
+def _con_rango(tipo):
+    return ((pd.api.types.is_numeric_dtype(tipo) and not pd.api.types.is_bool_dtype(tipo))
+            or pd.api.types.is_datetime64_any_dtype(tipo))
+
+
+def _vista_previa(df):
+    return json.loads(df.head(FILAS_VISTA_PREVIA).to_json(orient='split', index=False, date_format='iso'))
+
+
+# Ficha de una hoja ya cargada
+def ficha_df(df):
+    columnas = []
+    nulos = df.isna().sum()
+    for nombre in df.columns:
+        serie = df[nombre]
+        columna = {'nombre': str(nombre), 'tipo': str(serie.dtype), 'nulos': int(nulos[nombre]),
+                   'minimo': None, 'maximo': None}
+        if _con_rango(serie.dtype) and serie.notna().any():
+            columna['minimo'] = _valor_json(serie.min())
+            columna['maximo'] = _valor_json(serie.max())
+        columnas.append(columna)
+    return {'filas': len(df), 'columnas': columnas, 'vista_previa': _vista_previa(df)}
+
+
+# Ficha de un archivo Parquet a partir de sus metadatos: los nulos y el rango de
+# una columna quedan en None si algún row group no tiene estadísticas
+def ficha_parquet(ruta):
+    archivo = importar_pyarrow().ParquetFile(ruta)
+    metadatos = archivo.metadata
+    tipos = archivo.schema_arrow.empty_table().to_pandas().dtypes
+    columnas = []
+    for i, nombre in enumerate(archivo.schema_arrow.names):
+        estadisticas = [metadatos.row_group(g).column(i).statistics for g in range(metadatos.num_row_groups)]
+        completas = all(e is not None for e in estadisticas)
+        columna = {'nombre': nombre, 'tipo': str(tipos[nombre]), 'nulos': None, 'minimo': None, 'maximo': None}
+        if completas and all(e.has_null_count for e in estadisticas):
+            columna['nulos'] = int(sum(e.null_count for e in estadisticas))
+        if completas and _con_rango(tipos[nombre]):
+            # Un row group sin mínimo ni máximo solo se ignora si no tiene valores
+            con_rango = [e for e in estadisticas if e.has_min_max]
+            if con_rango and all(e.has_min_max or e.num_values == 0 for e in estadisticas):
+                columna['minimo'] = _valor_json(min(e.min for e in con_rango))
+                columna['maximo'] = _valor_json(max(e.max for e in con_rango))
+        columnas.append(columna)
+    if metadatos.num_row_groups:
+        previa = archivo.read_row_group(0).slice(0, FILAS_VISTA_PREVIA).to_pandas()
+    else:
+        previa = archivo.schema_arrow.empty_table().to_pandas()
+    return {'filas': metadatos.num_rows, 'columnas': columnas, 'vista_previa': _vista_previa(previa)}
+
+
+# Filas de vista previa de una ficha como DataFrame, con los tipos de la hoja
+# cuando se pueden reconstruir (en JSON las fechas quedaron como texto)
+def vista_previa(ficha):
+    previa = ficha['vista_previa']
+    df = pd.DataFrame(previa['data'], columns=previa['columns'])
+    for columna in ficha['columnas']:
+        if columna['nombre'] in df.columns:
+            try:
+                df[columna['nombre']] = df[columna['nombre']].astype(columna['tipo'])
+            except (TypeError, ValueError):
+                pass
+    return df
+
+
+# Tipo, nulos, mínimo y máximo de cada columna de una ficha. Los rangos se
+# muestran como texto: en una misma columna hay números y fechas.
+def columnas_ficha(ficha):
+    df = pd.DataFrame(ficha['columnas'], columns=['nombre', 'tipo', 'nulos', 'minimo', 'maximo'])
+    for columna in ['minimo', 'maximo']:
+        df[columna] = [None if valor is None else str(valor) for valor in df[columna]]
+    return df
+
+
+class CatalogoHojas:
+    def __init__(self, ruta=RUTA_CATALOGO):
+        self.ruta = ruta
+        # clave de la fuente (ver registro.py) -> ficha, con la firma de su versión
+        self.fichas = {}
+        self._lock = threading.RLock()
+        self._cargar()
+
+    # Fichas al día de `fuentes` (registro.FuenteDatos), en el mismo orden. Solo
+    # se calculan las que faltan o cambiaron de versión; `cargar(fuente)` lee la
+    # hoja cuando no hay un archivo Parquet al día (por defecto, fuente.cargar).
+    # Si no se puede calcular una ficha se pasa el error a `al_fallar(clave, error)`
+    # y en su lugar queda None.
+    def describir(self, fuentes, cargar=None, al_fallar=None):
+        resultado = []
+        cambios = False
+        for fuente in fuentes:
+            firma = _firma_json(fuente.firma()) if fuente.firma is not None else None
+            with self._lock:
+                ficha = self.fichas.get(fuente.clave)
+            if ficha is None or firma is None or ficha['firma'] != firma:
+                try:
+                    ficha = self._calcular(fuente, cargar)
+                except Exception as e:
+                    if al_fallar is None:
+                        raise
+                    al_fallar(fuente.clave, e)
+                    resultado.append(None)
+                    continue
+                ficha.update(clave=fuente.clave, hoja=fuente.hoja, firma=firma)
+                # Sin firma no se puede saber si sigue vigente: no se guarda
+                if firma is not None:
+                    with self._lock:
+                        self.fichas.pop(fuente.clave, None)
+                        self.fichas[fuente.clave] = ficha
+                    cambios = True
+            resultado.append(ficha)
+        if cambios:
+            self._guardar()
+        return resultado
+
+    def _calcular(self, fuente, cargar):
+        ruta = fuente.ruta_parquet() if fuente.ruta_parquet is not None else None
+        if ruta is not None and importar_pyarrow() is not None:
+            return ficha_parquet(ruta)
+        df = cargar(fuente) if cargar is not None else fuente.cargar(None, None)
+        if df is None:
+            raise ValueError(f"La hoja {fuente.hoja} no tiene datos")
+        return ficha_df(df)
+
+    def _cargar(self):
+        if not self.ruta or not os.path.exists(self.ruta):
+            return
+        try:
+            with open(self.ruta, encoding='utf-8') as f:
+                fichas = json.load(f)['fichas']
+        except (OSError, ValueError, KeyError):
+            # Un archivo dañado solo obliga a recalcular
+            return
+        self.fichas = {ficha['clave']: ficha for ficha in fichas}
+
+    def _guardar(self):
+        if not self.ruta:
+            return
+        with self._lock:
+            # Las más viejas (las primeras en el diccionario) se descartan primero
+            for clave in list(self.fichas)[:max(len(self.fichas) - MAXIMO_FICHAS, 0)]:
+                del self.fichas[clave]
+            texto = json.dumps({'fichas': list(self.fichas.values())}, ensure_ascii=False, default=str)
+
+        def escribir(temporal):
+            with open(temporal, 'w', encoding='utf-8') as f:
+                f.write(texto)
+        reemplazo_atomico(self.ruta, escribir)
@@ -0,0 +1,165 @@
+# Cola de escrituras en segundo plano.
+# Los guardados del editor no esperan a que se escriba el archivo: se encolan y
+# la sesión recibe enseguida un comprobante (Escritura) cuyo estado se consulta
+# después. Un hilo escritor toma todo lo pendiente de una vez y lo guarda en
+# lote. Los guardados sucesivos de una misma hoja que todavía no empezaron se
+# combinan en uno solo (los cambios se calculan desde la versión original de la
+# primera edición hasta la última), y mientras tanto la hoja pendiente se puede
+# leer de la cola, así el editor muestra lo que se acaba de guardar.
+import atexit
+import itertools
+import logging
+import threading
+import time
+from contextlib import nullcontext
+
+logger = logging.getLogger('cannabis.escrituras')
+
+PENDIENTE = 'pendiente'
+GUARDANDO = 'guardando'
+GUARDADA = 'guardada'
+ERROR = 'error'
+
+_numeros = itertools.count(1)
+
+
+# Comprobante de un guardado encolado
+class Escritura:
+    def __init__(self, hoja, editado, original, guardar):
+        self.numero = next(_numeros)
+        self.hoja = hoja
+        self.editado = editado
+        self.original = original
+        # guardar(original, editado): hace la escritura (se ejecuta en el hilo escritor)
+        self.guardar = guardar
+        self.estado = PENDIENTE
+        self.excepcion = None
+        self.combinadas = 1
+        self.enviada = time.time()
+        self.terminada = None
+        self._hecho = threading.Event()
+
+    def esperar(self, segundos=None):
+        return self._hecho.wait(segundos)
+
+    def _terminar(self, estado, excepcion=None):
+        self.estado = estado
+        self.excepcion = excepcion
+        self.terminada = time.time()
+        self._hecho.set()
+
+
+class ColaEscritura:
+    # `bloqueo` (opcional) se toma una vez por lote, para que las escrituras del
+    # lote no se intercalen con las de otros procesos. `al_terminar_lote(escrituras)`
+    # (opcional) se llama con el bloqueo todavía tomado después de cada lote con
+    # algún guardado exitoso (por ejemplo, para actualizar las alertas una sola vez)
+    # o después de un aviso (ver avisar).
+    def __init__(self, bloqueo=None, al_terminar_lote=None):
+        self.bloqueo = bloqueo
+        self.al_terminar_lote = al_terminar_lote
+        self._pendientes = []
+        self._en_curso = []
+        self._aviso = False
+        self._ocupado = False
+        self._condicion = threading.Condition()
+        self._hilo = threading.Thread(target=self._ejecutar, name='escritor', daemon=True)
+        self._hilo.start()
+        # Al cerrar el proceso se termina de escribir lo encolado
+        atexit.register(self.esperar)
+
+    # Encola un guardado de `hoja` y devuelve su comprobante. Si el último
+    # guardado pendiente de la hoja partió de la versión que se está editando
+    # (`original` es lo que ese guardado dejó), los dos se combinan.
+    def enviar(self, hoja, editado, original=None, guardar=None):
+        with self._condicion:
+            anterior = next((e for e in reversed(self._pendientes) if e.hoja == hoja), None)
+            if anterior is not None and original is not None and original is anterior.editado:
+                anterior.editado = editado
+                anterior.guardar = guardar
+                anterior.combinadas += 1
+                return anterior
+            escritura = Escritura(hoja, editado, original, guardar)
+            self._pendientes.append(escritura)
+            self._condicion.notify()
+            return escritura
+
+    # Pide al hilo escritor que llame a `al_terminar_lote` aunque no haya
+    # guardados (por ejemplo, porque una hoja cambió por otro camino). Los avisos
+    # que llegan antes de que empiece el lote se juntan en uno.
+    def avisar(self):
+        with self._condicion:
+            self._aviso = True
+            self._condicion.notify()
+
+    # Última versión encolada (y todavía no escrita) de una hoja, o None
+    def pendiente(self, hoja):
+        with self._condicion:
+            for escritura in reversed(self._en_curso + self._pendientes):
+                if escritura.hoja == hoja and escritura.estado != ERROR:
+                    return escritura.editado
+        return None
+
+    # Hojas con guardados encolados (incluidas las que todavía no existen)
+    def hojas_pendientes(self):
+        with self._condicion:
+            return list(dict.fromkeys(e.hoja for e in self._en_curso + self._pendientes if e.estado != ERROR))
+
+    def cantidad_pendientes(self):
+        with self._condicion:
+            return len(self._pendientes) + len(self._en_curso)
+
+    # Espera a que se escriba todo lo encolado hasta ahora
+    def esperar(self, segundos=None):
+        limite = None if segundos is None else time.monotonic() + segundos
+        with self._condicion:
+            while self._pendientes or self._aviso or self._ocupado:
+                restante = None if limite is None else limite - time.monotonic()
+                if restante is not None and restante <= 0:
+                    return False
+                self._condicion.wait(restante)
+        return True
+
+    def _ejecutar(self):
+        while True:
+            with self._condicion:
+                while not self._pendientes and not self._aviso:
+                    self._condicion.wait()
+                self._en_curso, self._pendientes = self._pendientes, []
+                aviso, self._aviso = self._aviso, False
+                self._ocupado = True
+            try:
+                with self.bloqueo if self.bloqueo is not None else nullcontext():
+                    for escritura in self._en_curso:
+                        self._escribir(escritura)
+                    self._terminar_lote(aviso)
+            except Exception as e:
+                # No se pudo tomar el bloqueo: falla todo el lote
+                for escritura in self._en_curso:
+                    if escritura.estado in (PENDIENTE, GUARDANDO):
+                        escritura._terminar(ERROR, e)
+            with self._condicion:
+                self._en_curso = []
+                self._ocupado = False
+                self._condicion.notify_all()
+
+    def _escribir(self, escritura):
+        escritura.estado = GUARDANDO
+        try:
+            escritura.guardar(escritura.original, escritura.editado)
+        except Exception as e:
+            logger.warning("No se pudo guardar %s: %s", escritura.hoja, e)
+            escritura._terminar(ERROR, e)
+        else:
+            escritura._terminar(GUARDADA)
+
+    def _terminar_lote(self, aviso=False):
+        guardadas = [e for e in self._en_curso if e.estado == GUARDADA]
+        if self.al_terminar_lote is None or not (guardadas or aviso):
+            return
+        try:
+            self.al_terminar_lote(guardadas)
+        except Exception as e:
+            # Los guardados ya están hechos: solo se informa
+            logger.warning("Error después de guardar %s: %s",
+                           ', '.join(g.hoja for g in guardadas) or 'sin guardados', e)
@@ -0,0 +1,161 @@
+# Motor de consultas SQL embebido sobre las hojas cargadas.
+# Con DuckDB las hojas se registran sin copiarlas (los DataFrames se leen en
+# columnas vía Arrow) y las hojas Parquet se consultan directo desde el archivo,
+# de modo que DuckDB lee solo las columnas y los row groups que la consulta
+# necesita. Sin DuckDB se usa SQLite (biblioteca estándar), que copia las hojas
+# a una base en memoria: más lento, pero con el mismo SQL.
+import numbers
+import sqlite3
+
+import pandas as pd
+
+from filtros import dividir_predicados, filtrar
+from metricas import tramo
+
+try:
+    import duckdb
+except ImportError:  # duckdb es opcional: sin él se usa SQLite
+    duckdb = None
+
+
+# Literal SQL de un valor de filtro (enteros, números, textos y fechas)
+def _literal_sql(valor):
+    if valor is None or (not isinstance(valor, (list, tuple)) and pd.isna(valor)):
+        return 'NULL'
+    if isinstance(valor, bool):
+        return 'TRUE' if valor else 'FALSE'
+    if isinstance(valor, numbers.Number):
+        return str(valor)
+    if isinstance(valor, pd.Timestamp):
+        return f"TIMESTAMP '{valor.isoformat(sep=' ')}'"
+    texto = str(valor).replace("'", "''")
+    return f"'{texto}'"
+
+
+def identificador(nombre):
+    return '"' + str(nombre).replace('"', '""') + '"'
+
+
+# Condición WHERE para predicados en formato pyarrow (ver filtros.py)
+def condicion_sql(predicados):
+    condiciones = []
+    for columna, operador, valor in predicados or []:
+        if operador == 'in':
+            if not valor:
+                condiciones.append('FALSE')
+                continue
+            valores = ', '.join(_literal_sql(v) for v in valor)
+            condiciones.append(f"{identificador(columna)} IN ({valores})")
+        elif operador in ('==', '!=', '<', '<=', '>', '>='):
+            operador_sql = {'==': '=', '!=': '<>'}.get(operador, operador)
+            condiciones.append(f"{identificador(columna)} {operador_sql} {_literal_sql(valor)}")
+        else:
+            raise ValueError(f"Operador de filtro desconocido: {operador}")
+    return ' AND '.join(condiciones) if condiciones else None
+
+
+class MotorConsultas:
+    def __init__(self):
+        self.tipo = 'duckdb' if duckdb is not None else 'sqlite'
+        if duckdb is not None:
+            self.conexion = duckdb.connect()
+        else:
+            self.conexion = sqlite3.connect(':memory:', check_same_thread=False)
+        self._columnas = {}
+        self._solo_lectura = False
+
+    # DuckDB puede leer archivos Parquet directamente
+    @property
+    def lee_parquet(self):
+        return self.tipo == 'duckdb'
+
+    def tablas(self):
+        return list(self._columnas.keys())
+
+    def columnas(self, tabla):
+        return self._columnas.get(tabla, [])
+
+    # True si `tabla` está registrada y tiene todas las `columnas`
+    def tiene(self, tabla, *columnas):
+        return tabla in self._columnas and all(c in self._columnas[tabla] for c in columnas)
+
+    # Registra un DataFrame como tabla, opcionalmente filtrado por `predicados`
+    def registrar(self, tabla, df, predicados=None):
+        if self.tipo == 'duckdb':
+            self.conexion.register(f"_df_{tabla}", df)
+            origen = identificador(f"_df_{tabla}")
+            condicion = self._condicion(tabla, predicados)
+            self.conexion.execute(
+                f"CREATE OR REPLACE VIEW {identificador(tabla)} AS SELECT * FROM {origen}"
+                + (f" WHERE {condicion}" if condicion else "")
+            )
+        else:
+            df = filtrar(df, predicados)
+            df.to_sql(tabla, self.conexion, index=False, if_exists='replace')
+        self._columnas[tabla] = [str(c) for c in df.columns]
+
+    # Registra un archivo Parquet como tabla sin leerlo: las consultas leen solo
+    # las columnas y row groups que necesitan (y los `predicados` se aplican al leer)
+    def registrar_parquet(self, tabla, ruta, predicados=None):
+        if self.tipo != 'duckdb':
+            self.registrar(tabla, pd.read_parquet(ruta), predicados)
+            return
+        ruta_sql = str(ruta).replace("'", "''")
+        condicion = self._condicion(tabla, predicados)
+        self.conexion.execute(
+            f"CREATE OR REPLACE VIEW {identificador(tabla)} AS SELECT * FROM read_parquet('{ruta_sql}')"
+            + (f" WHERE {condicion}" if condicion else "")
+        )
+        self._columnas[tabla] = [
+            fila[0] for fila in self.conexion.execute(f"DESCRIBE {identificador(tabla)}").fetchall()
+        ]
+
+    # Condición WHERE de la vista `tabla` (solo DuckDB). Los 'in' con muchos valores
+    # no van como literales: los valores se registran como una tabla y se filtra
+    # con un semi-join.
+    def _condicion(self, tabla, predicados):
+        al_leer, despues = dividir_predicados(predicados)
+        condiciones = [condicion_sql(al_leer)] if al_leer else []
+        for i, (columna, _, valores) in enumerate(despues or []):
+            relacion = f"_valores_{tabla}_{i}"
+            self.conexion.register(relacion, pd.DataFrame({'valor': list(valores)}))
+            condiciones.append(f"{identificador(columna)} IN (SELECT valor FROM {identificador(relacion)})")
+        return ' AND '.join(condiciones) if condiciones else None
+
+    # Desde aquí solo se permiten consultas de lectura sobre las tablas ya
+    # registradas (sin acceso a archivos del servidor). Para consultas escritas
+    # por el usuario.
+    def solo_lectura(self):
+        if self.tipo == 'duckdb':
+            self.conexion.execute("SET enable_external_access = false")
+            self.conexion.execute("SET lock_configuration = true")
+        else:
+            permitidas = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION}
+            self.conexion.set_authorizer(
+                lambda accion, *args: sqlite3.SQLITE_OK if accion in permitidas else sqlite3.SQLITE_DENY
+            )
+        self._solo_lectura = True
+
+    def consultar(self, sql, parametros=None):
+        with tramo("sql") as medicion:
+            if self.tipo == 'duckdb':
+                if self._solo_lectura:
+                    for sentencia in self.conexion.extract_statements(sql):
+                        if sentencia.type != duckdb.StatementType.SELECT:
+                            raise ValueError("Solo se permiten consultas SELECT")
+                resultado = self.conexion.execute(sql, parametros or []).df()
+            else:
+                resultado = pd.read_sql_query(sql, self.conexion, params=parametros or ())
+            medicion.agregar_filas(len(resultado))
+            return resultado
+
+    def cerrar(self):
+        self.conexion.close()
+
+    # `with MotorConsultas() as motor:` cierra la conexión (y suelta las vistas
+    # registradas) al terminar
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
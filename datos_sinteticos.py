@@ -0,0 +1,229 @@
+# Generador de datos sintéticos para medir el rendimiento con volúmenes grandes.
+# Genera las nueve hojas que usa el tablero con claves foráneas válidas (cada
+# venta apunta a un cliente y un dispensario existentes, cada detalle a una
+# venta y un producto, ...) y totales consistentes: el total de cada venta es
+# la suma de sus detalles. Con la misma semilla se obtienen los mismos datos.
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from almacenamiento import AlmacenParquet
+from esquemas import MAXIMO_FILAS_XLSX
+
+# Escalas predefinidas: cantidad de filas de Ventas
+ESCALAS = {'10k': 10_000, '1M': 1_000_000, '10M': 10_000_000}
+
+FECHA_INICIO = pd.Timestamp('2023-01-01')
+DIAS = 730
+
+_NOMBRES = ['Ana', 'Luis', 'Carmen', 'Roberto', 'María', 'Jorge', 'Lucía', 'Pedro', 'Sofía', 'Diego']
+_APELLIDOS = ['González', 'Martínez', 'Jiménez', 'Hernández', 'López', 'Pérez', 'Gómez', 'Díaz']
+_ZONAS = ['Centro', 'Norte', 'Sur', 'Este', 'Oeste']
+_TIPOS_PRODUCTO = [
+    # (tipo, categoría, unidad, precio base)
+    ('Flor', 'Flor', 'Gramo', 25.0),
+    ('Aceite', 'Aceite', 'Frasco', 45.0),
+    ('Extracto', 'Extracto', 'Gramo', 60.0),
+    ('Crema', 'Tópico', 'Unidad', 30.0),
+    ('Jabón', 'Tópico', 'Unidad', 12.0),
+]
+_METODOS_PAGO = ['Efectivo', 'Tarjeta', 'Transferencia']
+_TIPOS_ALERTA = ['Stock_Bajo', 'Caducidad_Proxima', 'Control_Calidad']
+_PRIORIDADES = ['Baja', 'Media', 'Alta', 'Critica']
+_RESULTADOS = ['Aprobado', 'Rechazado', 'Pendiente']
+
+
+def filas_escala(escala):
+    if escala in ESCALAS:
+        return ESCALAS[escala]
+    return int(escala)
+
+
+def _fechas(rng, n):
+    segundos = rng.integers(0, DIAS * 24 * 3600, n)
+    return FECHA_INICIO + pd.to_timedelta(segundos, unit='s')
+
+
+def _elegir(rng, opciones, n, p=None):
+    return np.asarray(opciones, dtype=object)[rng.choice(len(opciones), n, p=p)]
+
+
+# Genera las hojas del tablero para `ventas` filas de Ventas: {hoja: DataFrame}.
+# Las demás hojas crecen en proporción (los catálogos, con un tope).
+def generar(ventas, semilla=0):
+    rng = np.random.default_rng(semilla)
+    n_dispensarios = min(max(4, ventas // 50_000), 200)
+    n_productos = min(max(20, ventas // 1_000), 2_000)
+    n_clientes = max(50, ventas // 20)
+    n_alertas = max(10, ventas // 200)
+    n_controles = max(10, ventas // 500)
+
+    dispensarios = pd.DataFrame({
+        'id': np.arange(1, n_dispensarios + 1),
+        'nombre': [f"Dispensario {_ZONAS[i % len(_ZONAS)]} {i + 1}" for i in range(n_dispensarios)],
+        'direccion': [f"Calle {i + 1} #{100 + i}" for i in range(n_dispensarios)],
+        'telefono': [f"555-{2000 + i:04d}" for i in range(n_dispensarios)],
+        'encargado': _elegir(rng, _NOMBRES, n_dispensarios),
+        'fecha_apertura': FECHA_INICIO - pd.to_timedelta(rng.integers(30, 2000, n_dispensarios), unit='D'),
+        'activo': rng.random(n_dispensarios) < 0.95,
+    })
+
+    tipo = rng.integers(0, len(_TIPOS_PRODUCTO), n_productos)
+    precios = np.array([t[3] for t in _TIPOS_PRODUCTO])[tipo] * rng.uniform(0.7, 1.5, n_productos)
+    productos = pd.DataFrame({
+        'id': np.arange(1, n_productos + 1),
+        'nombre': [f"{_TIPOS_PRODUCTO[t][0]} {i + 1}" for i, t in enumerate(tipo)],
+        'descripcion': [f"Producto sintético {i + 1}" for i in range(n_productos)],
+        'precio_unitario': precios.round(2),
+        'unidad_medida': [_TIPOS_PRODUCTO[t][2] for t in tipo],
+        'categoria': [_TIPOS_PRODUCTO[t][1] for t in tipo],
+        'tipo_producto': [_TIPOS_PRODUCTO[t][0] for t in tipo],
+        'thc_porcentaje': rng.uniform(0, 30, n_productos).round(1),
+        'cbd_porcentaje': rng.uniform(0, 20, n_productos).round(1),
+        'fecha_caducidad': FECHA_INICIO + pd.to_timedelta(rng.integers(180, DIAS + 365, n_productos), unit='D'),
+        'lote': [f"LOT-{i + 1:06d}" for i in range(n_productos)],
+        'proveedor_cultivo': _elegir(rng, ['Cultivo Premium', 'Cultivo Andino', 'Cultivo Local'], n_productos),
+        'codigo_barras': 7_500_000_000_000 + np.arange(1, n_productos + 1),
+        'fecha_creacion': FECHA_INICIO - pd.to_timedelta(rng.integers(0, 365, n_productos), unit='D'),
+        'activo': rng.random(n_productos) < 0.97,
+    })
+
+    clientes = pd.DataFrame({
+        'id': np.arange(1, n_clientes + 1),
+        'nombre': _elegir(rng, _NOMBRES, n_clientes),
+        'apellido': _elegir(rng, _APELLIDOS, n_clientes),
+        'telefono': pd.Series(np.arange(n_clientes) % 10_000).map('555-{:04d}'.format),
+        'email': pd.Series(np.arange(1, n_clientes + 1)).map('cliente{}@email.com'.format),
+        'direccion': pd.Series(np.arange(1, n_clientes + 1)).map('Calle {} #1'.format),
+        'fecha_registro': _fechas(rng, n_clientes) - pd.Timedelta(days=DIAS),
+        'activo': rng.random(n_clientes) < 0.9,
+    })
+
+    inventario_deposito = pd.DataFrame({
+        'id': np.arange(1, n_productos + 1),
+        'producto_id': productos['id'].to_numpy(),
+        'cantidad': rng.integers(0, 2_000, n_productos),
+        'stock_minimo': np.full(n_productos, 100),
+        'stock_maximo': np.full(n_productos, 2_000),
+        'ultima_actualizacion': _fechas(rng, n_productos),
+    })
+
+    # Un registro por producto y dispensario
+    n_inventario = n_productos * n_dispensarios
+    inventario_dispensario = pd.DataFrame({
+        'id': np.arange(1, n_inventario + 1),
+        'producto_id': np.tile(productos['id'].to_numpy(), n_dispensarios),
+        'dispensario_id': np.repeat(dispensarios['id'].to_numpy(), n_productos),
+        'cantidad': rng.integers(0, 100, n_inventario),
+        'stock_minimo': rng.integers(5, 20, n_inventario),
+        'ultima_actualizacion': _fechas(rng, n_inventario),
+    })
+
+    # Entre una y cinco líneas por venta (1,5 en promedio)
+    lineas = np.minimum(1 + rng.poisson(0.5, ventas), 5)
+    n_detalle = int(lineas.sum())
+    venta_de_linea = np.repeat(np.arange(ventas), lineas)
+    producto_idx = rng.integers(0, n_productos, n_detalle)
+    cantidad = rng.integers(1, 6, n_detalle)
+    precio_unitario = productos['precio_unitario'].to_numpy()[producto_idx]
+    subtotal = (cantidad * precio_unitario).round(2)
+    detalle_venta = pd.DataFrame({
+        'id': np.arange(1, n_detalle + 1),
+        'venta_id': venta_de_linea + 1,
+        'producto_id': producto_idx + 1,
+        'cantidad': cantidad,
+        'precio_unitario': precio_unitario,
+        'subtotal': subtotal,
+    })
+
+    # Ventas en orden cronológico, como se registrarían
+    fechas_venta = _fechas(rng, ventas).sort_values()
+    ventas_df = pd.DataFrame({
+        'id': np.arange(1, ventas + 1),
+        'cliente_id': rng.integers(1, n_clientes + 1, ventas),
+        'dispensario_id': rng.integers(1, n_dispensarios + 1, ventas),
+        'fecha_venta': fechas_venta,
+        'total': np.bincount(venta_de_linea, weights=subtotal, minlength=ventas).round(2),
+        'metodo_pago': _elegir(rng, _METODOS_PAGO, ventas, p=[0.5, 0.4, 0.1]),
+        'estado': _elegir(rng, ['Completada', 'Anulada'], ventas, p=[0.98, 0.02]),
+        'vendedor': _elegir(rng, _NOMBRES, ventas),
+    })
+
+    # Alertas del depósito (sin dispensario) o de un dispensario
+    dispensario_alerta = rng.integers(1, n_dispensarios + 1, n_alertas).astype('float64')
+    dispensario_alerta[rng.random(n_alertas) < 0.2] = np.nan
+    alertas = pd.DataFrame({
+        'id': np.arange(1, n_alertas + 1),
+        'tipo_alerta': _elegir(rng, _TIPOS_ALERTA, n_alertas),
+        'producto_id': rng.integers(1, n_productos + 1, n_alertas),
+        'dispensario_id': dispensario_alerta,
+        'mensaje': _elegir(rng, ['Stock crítico', 'Producto próximo a vencer', 'Control pendiente'], n_alertas),
+        'fecha_creacion': _fechas(rng, n_alertas),
+        'fecha_vencimiento': pd.NaT,
+        'estado': _elegir(rng, ['Activa', 'Resuelta'], n_alertas, p=[0.3, 0.7]),
+        'prioridad': _elegir(rng, _PRIORIDADES, n_alertas),
+    })
+
+    control_calidad = pd.DataFrame({
+        'id': np.arange(1, n_controles + 1),
+        'producto_id': rng.integers(1, n_productos + 1, n_controles),
+        'fecha_control': _fechas(rng, n_controles),
+        'tipo_control': _elegir(rng, [t[0] for t in _TIPOS_PRODUCTO], n_controles),
+        'humedad_porcentaje': rng.uniform(5, 15, n_controles).round(1),
+        'potencia_thc': rng.uniform(0, 30, n_controles).round(1),
+        'potencia_cbd': rng.uniform(0, 20, n_controles).round(1),
+        'presencia_hongos': (rng.random(n_controles) < 0.05).astype('float64'),
+        'sellos_sanitarios': rng.random(n_controles) < 0.95,
+        'estado_envase': _elegir(rng, ['Perfecto', 'Dañado'], n_controles, p=[0.95, 0.05]),
+        'resultado': _elegir(rng, _RESULTADOS, n_controles, p=[0.8, 0.1, 0.1]),
+        'observaciones': '',
+        'responsable': _elegir(rng, _NOMBRES, n_controles),
+    })
+
+    return {
+        'Dispensarios': dispensarios,
+        'Productos': productos,
+        'Clientes': clientes,
+        'Inventario_Deposito': inventario_deposito,
+        'Inventario_Dispensario': inventario_dispensario,
+        'Ventas': ventas_df,
+        'Detalle_Venta': detalle_venta,
+        'Alertas': alertas,
+        'Control_Calidad': control_calidad,
+    }
+
+
+# Escribe las hojas como data/db.xlsx (backend xlsx) o como almacén Parquet
+def escribir(datos, destino, backend='xlsx'):
+    if backend == 'parquet':
+        almacen = AlmacenParquet(destino)
+        for hoja, df in datos.items():
+            almacen.escribir(hoja, df)
+        return
+    excedidas = [hoja for hoja, df in datos.items() if len(df) > MAXIMO_FILAS_XLSX]
+    if excedidas:
+        raise ValueError(f"Hojas con más filas de las que admite un .xlsx: {', '.join(excedidas)}; "
+                         "use el backend parquet")
+    directorio = os.path.dirname(destino)
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+    with pd.ExcelWriter(destino, engine='xlsxwriter') as writer:
+        for hoja, df in datos.items():
+            df.to_excel(writer, sheet_name=hoja, index=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Genera datos sintéticos para el tablero")
+    parser.add_argument('escala', help=f"{', '.join(ESCALAS)} o cantidad de filas de Ventas")
+    parser.add_argument('--backend', choices=['xlsx', 'parquet'], default='xlsx')
+    parser.add_argument('--destino', help="Archivo .xlsx o directorio Parquet")
+    parser.add_argument('--semilla', type=int, default=0)
+    args = parser.parse_args()
+
+    destino = args.destino or (f"sinteticos_{args.escala}.xlsx" if args.backend == 'xlsx'
+                               else f"sinteticos_{args.escala}")
+    datos = generar(filas_escala(args.escala), args.semilla)
+    escribir(datos, destino, args.backend)
+    print(f"{destino}: " + ", ".join(f"{hoja} {len(df)}" for hoja, df in datos.items()))
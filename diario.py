@@ -0,0 +1,505 @@
+# Escritura incremental por filas con diario (write-ahead journal).
+# Al guardar desde el editor se calculan las filas insertadas, modificadas y
+# eliminadas respecto a los datos originales y solo esas filas se agregan al
+# diario. Las lecturas aplican el diario sobre la hoja base, y la compactación
+# reescribe las hojas afectadas y vacía el diario.
+# Antes de reescribir una hoja base se agrega al diario una marca con el sello
+# del archivo base (inodo, fecha y tamaño). Si el proceso se corta después de
+# reescribirla y antes de vaciar el diario, el sello ya no coincide y los
+# registros anteriores de esa hoja, que ya están en la base (con las filas
+# renumeradas), no se vuelven a aplicar.
+import json
+import os
+import threading
+
+import pandas as pd
+
+from bloqueos import VersionObsoleta
+from filtros import filtrar
+
+# Cantidad de registros en el diario a partir de la cual se compacta
+# (configurable con CANNABIS_DIARIO_MAX)
+MAXIMO_REGISTROS_POR_DEFECTO = 200
+
+# Columna auxiliar con la etiqueta de fila dentro del diario
+COLUMNA_FILA = '_fila'
+
+# Clave de las marcas de reescritura de una hoja base dentro del diario
+CLAVE_REESCRITURA = 'reescritura'
+
+
+# Función para calcular las diferencias fila a fila entre dos versiones de una hoja.
+# Devuelve None si cambiaron las columnas (en ese caso hay que reescribir la hoja).
+def calcular_cambios(original, editado):
+    if list(original.columns) != list(editado.columns):
+        return None
+
+    etiquetas_originales = original.index
+    # Filas nuevas: etiqueta vacía o que no existía en la versión original
+    es_nueva = editado.index.isna() | ~editado.index.isin(etiquetas_originales)
+    insertados = editado[es_nueva]
+    conservados = editado[~es_nueva]
+    if conservados.index.has_duplicates:
+        return None
+
+    eliminados = etiquetas_originales.difference(conservados.index)
+
+    anteriores = original.loc[conservados.index]
+    distintos = pd.Series(False, index=conservados.index)
+    for columna in conservados.columns:
+        distintos |= _valores_distintos(anteriores[columna], conservados[columna])
+    actualizados = conservados[distintos]
+
+    return {
+        'insertados': insertados,
+        'actualizados': actualizados,
+        'eliminados': list(eliminados),
+    }
+
+
+# Dos versiones de una hoja con las mismas filas y valores. Los tipos pueden no
+# coincidir (por ejemplo, una columna categórica con otras categorías).
+def mismos_datos(original, editado):
+    if original.equals(editado):
+        return True
+    cambios = calcular_cambios(original, editado)
+    return (cambios is not None and cambios['insertados'].empty and cambios['actualizados'].empty
+            and not cambios['eliminados'])
+
+
+# Compara dos columnas celda a celda; dos vacíos se consideran iguales
+def _valores_distintos(anterior, nuevo):
+    if isinstance(anterior.dtype, pd.CategoricalDtype) or isinstance(nuevo.dtype, pd.CategoricalDtype):
+        anterior = anterior.astype(object)
+        nuevo = nuevo.astype(object)
+    try:
+        distintos = anterior.ne(nuevo)
+    except TypeError:
+        distintos = anterior.astype(object).ne(nuevo.astype(object))
+    return distintos & ~(anterior.isna() & nuevo.isna())
+
+
+# Las etiquetas numpy (np.int64, ...) se guardan como valores nativos de Python
+def _etiqueta_json(etiqueta):
+    return etiqueta.item() if hasattr(etiqueta, 'item') else etiqueta
+
+
+def _filas_a_json(df):
+    if df.empty:
+        return []
+    df = df.copy(deep=False)
+    df.insert(0, COLUMNA_FILA, df.index)
+    return json.loads(df.to_json(orient='records', date_format='iso', date_unit='ns'))
+
+
+# Convierte una columna reconstruida desde JSON al tipo que tiene en la hoja.
+# Las categorías nuevas se agregan a las de la hoja; si un valor no encaja en
+# el tipo, la columna queda como vino.
+def _con_tipo(serie, tipo):
+    if serie.dtype == tipo:
+        return serie
+    try:
+        if isinstance(tipo, pd.CategoricalDtype):
+            nuevas = [v for v in serie.dropna().unique() if v not in tipo.categories]
+            tipo = pd.CategoricalDtype(list(tipo.categories) + nuevas, ordered=tipo.ordered)
+        elif pd.api.types.is_datetime64_any_dtype(tipo):
+            serie = pd.to_datetime(serie, errors='coerce')
+        return serie.astype(tipo)
+    except (TypeError, ValueError):
+        return serie
+
+
+# Reconstruye las filas del diario con los tipos de la hoja de referencia, así
+# una hoja se lee con el mismo esquema antes y después de compactar
+def _filas_desde_json(filas, referencia):
+    df = pd.DataFrame(filas)
+    df = df.set_index(COLUMNA_FILA)
+    df.index.name = referencia.index.name
+    df = df.reindex(columns=referencia.columns)
+    for columna in df.columns:
+        df[columna] = _con_tipo(df[columna], referencia[columna].dtype)
+    return df
+
+
+# pd.concat pasa a object las columnas categóricas con categorías distintas:
+# se vuelven categóricas con la unión de las categorías
+def _concatenar(partes, referencia):
+    df = pd.concat(partes)
+    for columna in referencia.columns:
+        tipo = referencia[columna].dtype
+        if isinstance(tipo, pd.CategoricalDtype) and df[columna].dtype != tipo:
+            categorias = dict.fromkeys(
+                c for parte in partes if isinstance(parte[columna].dtype, pd.CategoricalDtype)
+                for c in parte[columna].cat.categories)
+            df[columna] = _con_tipo(df[columna], pd.CategoricalDtype(list(categorias), ordered=tipo.ordered))
+    return df
+
+
+# Aplica un registro del diario sobre una hoja, conservando el orden de las filas
+def aplicar_registro(df, registro):
+    eliminados = [e for e in registro.get('eliminados', []) if e in df.index]
+    if eliminados:
+        df = df.drop(index=eliminados)
+
+    actualizados = registro.get('actualizados', [])
+    if actualizados:
+        filas = _filas_desde_json(actualizados, df)
+        filas = filas[filas.index.isin(df.index)]
+        orden = df.index
+        df = _concatenar([df.drop(index=filas.index), filas], df).reindex(orden)
+
+    insertados = registro.get('insertados', [])
+    if insertados:
+        df = _concatenar([df, _filas_desde_json(insertados, df)], df)
+    return df
+
+
+class AlmacenConDiario:
+    def __init__(self, base, ruta_diario, maximo_registros=None):
+        self.base = base
+        self.ruta_diario = ruta_diario
+        if maximo_registros is None:
+            maximo_registros = int(os.environ.get('CANNABIS_DIARIO_MAX', MAXIMO_REGISTROS_POR_DEFECTO))
+        self.maximo_registros = maximo_registros
+        # Bloqueo de escritura del almacén base (entre hilos y procesos); las
+        # lecturas no lo toman
+        self._bloqueo = base.bloqueo
+        # Registros ya leídos del diario: al agregarse líneas solo se leen las
+        # nuevas, desde `_posicion` (el diario se identifica por dispositivo e inodo,
+        # que cambian cuando se compacta o se reescribe)
+        self._lectura = threading.Lock()
+        self._identidad = None
+        self._posicion = 0
+        self._registros = []
+        # hoja -> cantidad de registros pendientes / mayor etiqueta insertada
+        self._pendientes = {}
+        self._etiquetas = {}
+        # Marcas de reescritura leídas: (registros anteriores, hoja, sello)
+        self._marcas = []
+        # hoja -> (firma base, identidad del diario, registros aplicados, DataFrame)
+        self._hojas_cache = {}
+
+    # El resto de la interfaz (tipo, cache, importar/exportar, ...) es la del almacén base
+    def __getattr__(self, nombre):
+        return getattr(self.base, nombre)
+
+    def existe(self):
+        return self.base.existe()
+
+    def hojas(self):
+        hojas = list(self.base.hojas())
+        for registro in self.registros():
+            if registro['hoja'] not in hojas:
+                hojas.append(registro['hoja'])
+        return hojas
+
+    # Firma de una hoja: la del archivo base más sus cambios pendientes en el diario
+    def firma(self, hoja):
+        return (self.base.firma(hoja), self.pendientes(hoja))
+
+    # Cantidad de registros del diario con cambios de la hoja
+    def pendientes(self, hoja):
+        return self._estado()[2].get(hoja, 0)
+
+    def leer_todas(self):
+        return {hoja: self.leer(hoja) for hoja in self.hojas()}
+
+    # El archivo Parquet de la hoja solo está al día si no hay cambios pendientes
+    def ruta_parquet(self, hoja):
+        if self.pendientes(hoja):
+            return None
+        return self.base.ruta_parquet(hoja)
+
+    def leer(self, hoja, columnas=None, filtros=None):
+        registros, identidad, pendientes, _, _ = self._estado()
+        cantidad = pendientes.get(hoja, 0)
+        firma_base = self.base.firma(hoja)
+        if not cantidad:
+            df = self.base.leer(hoja, columnas, filtros)
+        else:
+            # Las hojas con cambios pendientes se reconstruyen una vez por versión
+            # del diario; si solo se agregaron registros, se aplican solo esos
+            guardada = self._hojas_cache.get(hoja)
+            if (guardada is not None and guardada[:2] == (firma_base, identidad)
+                    and guardada[2] <= cantidad):
+                aplicados, df = guardada[2], guardada[3]
+            else:
+                aplicados, df = 0, None
+            if aplicados < cantidad:
+                de_la_hoja = [r for r in registros if r['hoja'] == hoja]
+                nueva = False
+                if df is None:
+                    df = self.base.leer(hoja)
+                    if df is None:
+                        df = pd.DataFrame(columns=de_la_hoja[0].get('columnas', []))
+                        nueva = True
+                for registro in de_la_hoja[aplicados:]:
+                    df = aplicar_registro(df, registro)
+                # Una hoja que solo existe en el diario toma los tipos del esquema;
+                # las demás filas ya se reconstruyen con los tipos de la hoja
+                if nueva and getattr(self.base, 'preparar', None) is not None:
+                    df = self.base.preparar(hoja, df)
+                self._hojas_cache[hoja] = (firma_base, identidad, cantidad, df)
+            df = df.copy(deep=False)
+            df.attrs['version'] = (hoja, firma_base, identidad, cantidad)
+            df = filtrar(df, filtros)
+            if columnas is not None:
+                df = df[[c for c in columnas if c in df.columns]]
+        if df is not None:
+            # Identifica la versión de la hoja base sobre la que se editan las filas
+            df.attrs['firma_base'] = firma_base
+            df.attrs['firma'] = (firma_base, cantidad)
+        return df
+
+    # Cantidad de filas y filas [inicio, fin) de una hoja, para mostrarla por
+    # páginas: sin cambios pendientes se leen del almacén base sin cargar la hoja
+    def contar_filas(self, hoja):
+        if not self.pendientes(hoja):
+            return self.base.contar_filas(hoja)
+        df = self.leer(hoja)
+        return None if df is None else len(df)
+
+    def leer_filas(self, hoja, inicio, fin):
+        firma_base = self.base.firma(hoja)
+        if self.pendientes(hoja):
+            df = self.leer(hoja)
+            return None if df is None else df.iloc[inicio:fin]
+        df = self.base.leer_filas(hoja, inicio, fin)
+        if df is not None:
+            df.attrs['firma_base'] = firma_base
+            df.attrs['firma'] = (firma_base, 0)
+        return df
+
+    # Reescritura completa de una hoja: descarta los cambios pendientes de esa hoja
+    def escribir(self, hoja, df):
+        with self._bloqueo:
+            restantes = [r for r in self.registros() if r['hoja'] != hoja]
+            self._reescribir_diario(restantes + [self._marca_reescritura(hoja)])
+            self.base.escribir(hoja, df.reset_index(drop=True))
+            self._reescribir_diario(restantes)
+
+    # Guarda solo las filas que cambiaron entre `original` y `editado`. Si la
+    # hoja cambió desde que se leyó `original`, los cambios se rechazan con
+    # VersionObsoleta en lugar de pisar los de otro usuario.
+    def guardar_cambios(self, hoja, original, editado):
+        with self._bloqueo:
+            self.verificar_version(hoja, original)
+            cambios = calcular_cambios(original, editado)
+            # Sin diferencias por filas posibles se reescribe la hoja completa
+            if cambios is None:
+                self.escribir(hoja, editado)
+                return
+
+            insertados = cambios['insertados']
+            if not insertados.empty:
+                # Etiquetas nuevas que no choquen con las existentes
+                inicio = int(max(original.index.max() if len(original.index) else -1,
+                                 self._ultima_etiqueta(hoja))) + 1
+                insertados = insertados.copy(deep=False)
+                insertados.index = range(inicio, inicio + len(insertados))
+
+            if insertados.empty and cambios['actualizados'].empty and not cambios['eliminados']:
+                return
+
+            registro = {
+                'hoja': hoja,
+                'columnas': [str(c) for c in editado.columns],
+                'insertados': _filas_a_json(insertados),
+                'actualizados': _filas_a_json(cambios['actualizados']),
+                'eliminados': [_etiqueta_json(e) for e in cambios['eliminados']],
+            }
+            self._agregar_al_diario(registro)
+
+            if len(self.registros()) >= self.maximo_registros:
+                self.compactar()
+
+    # Control optimista de versiones: `original` tiene que ser la versión vigente
+    # de la hoja. Si la firma cambió (por ejemplo, otro usuario guardó otra hoja
+    # del mismo libro) se comparan los datos, y solo si la hoja es otra se rechaza.
+    def verificar_version(self, hoja, original):
+        self.base.actualizar_version()
+        if original.attrs.get('firma') is not None and original.attrs.get('firma') == self.firma(hoja):
+            return
+        actual = self.leer(hoja)
+        if actual is None or not mismos_datos(actual, original):
+            raise VersionObsoleta(hoja)
+
+    # Importar reemplaza los datos base, por lo que los cambios pendientes se
+    # descartan (antes de importar, para no aplicarlos sobre los datos nuevos)
+    def importar_xlsx(self, *args, **kwargs):
+        with self._bloqueo:
+            self._reescribir_diario([])
+            self.base.importar_xlsx(*args, **kwargs)
+
+    # Antes de exportar se aplican los cambios pendientes
+    def exportar_xlsx(self, *args, **kwargs):
+        with self._bloqueo:
+            self.compactar()
+            self.base.exportar_xlsx(*args, **kwargs)
+
+    # Aplica los cambios pendientes a las hojas base y vacía el diario. Cada hoja
+    # se reescribe después de marcarla en el diario, así una compactación
+    # interrumpida se puede repetir sin aplicar dos veces los mismos cambios.
+    def compactar(self):
+        with self._bloqueo:
+            registros = self.registros()
+            if self._estado()[4]:
+                # Marcas de una compactación interrumpida: se dejan solo los registros vigentes
+                self._reescribir_diario(registros)
+            for hoja in dict.fromkeys(r['hoja'] for r in registros):
+                df = self.leer(hoja).reset_index(drop=True)
+                self._agregar_al_diario(self._marca_reescritura(hoja))
+                self.base.escribir(hoja, df)
+            self._reescribir_diario([])
+
+    # Registros del diario, en orden
+    def registros(self):
+        return self._estado()[0]
+
+    # (registros, identidad del diario, pendientes por hoja, mayor etiqueta por
+    # hoja, marcas de reescritura), consistentes entre sí. No se modifican: al
+    # leer registros nuevos se reemplazan por otros.
+    def _estado(self):
+        with self._lectura:
+            try:
+                info = os.stat(self.ruta_diario)
+            except FileNotFoundError:
+                self._reiniciar_lectura(None)
+            else:
+                if (info.st_dev, info.st_ino) != self._identidad or info.st_size != self._posicion:
+                    self._leer_nuevos()
+            registros, pendientes, marcas = self._registros, self._pendientes, self._marcas
+        if marcas:
+            registros, pendientes = self._vigentes(registros, marcas)
+        return registros, self._identidad, pendientes, self._etiquetas, marcas
+
+    # Descarta los registros que ya están en la hoja base: los anteriores a una
+    # marca de reescritura de su hoja cuyo sello ya no es el del archivo base.
+    # Se evalúa en cada lectura, porque el archivo base cambia sin que cambie el diario.
+    def _vigentes(self, registros, marcas):
+        hasta = {}
+        for cantidad, hoja, sello in marcas:
+            if self._sello(hoja) != sello:
+                hasta[hoja] = cantidad
+        if not hasta:
+            return registros, self._pendientes
+        vigentes = [r for i, r in enumerate(registros) if i >= hasta.get(r['hoja'], 0)]
+        pendientes = {}
+        for registro in vigentes:
+            pendientes[registro['hoja']] = pendientes.get(registro['hoja'], 0) + 1
+        return vigentes, pendientes
+
+    # Sello del archivo base de una hoja: cambia cada vez que se reescribe
+    def _sello(self, hoja):
+        try:
+            info = os.stat(self.base.ruta_hoja(hoja))
+        except FileNotFoundError:
+            return None
+        return [info.st_ino, info.st_mtime_ns, info.st_size]
+
+    def _marca_reescritura(self, hoja):
+        return {'hoja': hoja, CLAVE_REESCRITURA: self._sello(hoja)}
+
+    def _reiniciar_lectura(self, identidad):
+        self._identidad = identidad
+        self._posicion = 0
+        self._registros = []
+        self._pendientes = {}
+        self._etiquetas = {}
+        self._marcas = []
+
+    def _leer_nuevos(self):
+        try:
+            f = open(self.ruta_diario, 'rb')
+        except FileNotFoundError:
+            self._reiniciar_lectura(None)
+            return
+        with f:
+            info = os.fstat(f.fileno())
+            identidad = (info.st_dev, info.st_ino)
+            if identidad != self._identidad or info.st_size < self._posicion:
+                self._reiniciar_lectura(identidad)
+            elif self._posicion:
+                # Lo ya leído termina en un salto de línea; si no, es otro archivo
+                f.seek(self._posicion - 1)
+                if f.read(1) != b'\n':
+                    self._reiniciar_lectura(identidad)
+            f.seek(self._posicion)
+            datos = f.read()
+        # Una línea sin terminar es un guardado en curso (o interrumpido): se lee
+        # cuando esté completa
+        fin = datos.rfind(b'\n') + 1
+        nuevos = [json.loads(linea) for linea in datos[:fin].split(b'\n') if linea.strip()]
+        self._posicion += fin
+        if not nuevos:
+            return
+        registros, marcas = list(self._registros), list(self._marcas)
+        pendientes, etiquetas = dict(self._pendientes), dict(self._etiquetas)
+        for registro in nuevos:
+            hoja = registro['hoja']
+            if CLAVE_REESCRITURA in registro:
+                marcas.append((len(registros), hoja, registro[CLAVE_REESCRITURA]))
+                continue
+            registros.append(registro)
+            pendientes[hoja] = pendientes.get(hoja, 0) + 1
+            insertadas = [fila[COLUMNA_FILA] for fila in registro.get('insertados', [])]
+            etiquetas[hoja] = max(insertadas + [etiquetas.get(hoja, -1)])
+        self._registros, self._marcas = registros, marcas
+        self._pendientes, self._etiquetas = pendientes, etiquetas
+
+    def _ultima_etiqueta(self, hoja):
+        return self._estado()[3].get(hoja, -1)
+
+    # Un guardado interrumpido puede dejar una línea sin terminar al final del
+    # diario: se descarta antes de agregar la siguiente. Solo se lee desde el
+    # final hacia atrás hasta el último salto de línea.
+    def _descartar_linea_incompleta(self):
+        if not os.path.exists(self.ruta_diario):
+            return
+        with open(self.ruta_diario, 'rb+') as f:
+            fin = f.seek(0, os.SEEK_END)
+            if fin == 0:
+                return
+            f.seek(fin - 1)
+            if f.read(1) == b'\n':
+                return
+            posicion = fin
+            while posicion > 0:
+                inicio = max(posicion - 64 * 1024, 0)
+                f.seek(inicio)
+                bloque = f.read(posicion - inicio)
+                salto = bloque.rfind(b'\n')
+                if salto >= 0:
+                    f.truncate(inicio + salto + 1)
+                    return
+                posicion = inicio
+            f.truncate(0)
+
+    # Agrega un registro al final del diario y lo pasa a disco
+    def _agregar_al_diario(self, registro):
+        directorio = os.path.dirname(self.ruta_diario)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self._descartar_linea_incompleta()
+        with open(self.ruta_diario, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(registro, ensure_ascii=False, default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _reescribir_diario(self, registros):
+        with self._lectura:
+            self._reiniciar_lectura(None)
+        if not registros:
+            if os.path.exists(self.ruta_diario):
+                os.remove(self.ruta_diario)
+            return
+        directorio = os.path.dirname(self.ruta_diario)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        temporal = self.ruta_diario + '.tmp'
+        with open(temporal, 'w', encoding='utf-8') as f:
+            for registro in registros:
+                f.write(json.dumps(registro, ensure_ascii=False, default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, self.ruta_diario)
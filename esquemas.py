@@ -0,0 +1,163 @@
+# Esquema tipado de cada hoja lógica del sistema.
+# Los tipos se aplican una sola vez al leer la hoja (y quedan en la caché o en
+# el almacén Parquet), de modo que las pestañas no tienen que volver a convertir
+# columnas con pd.to_numeric / pd.to_datetime en cada rerun.
+import numpy as np
+import pandas as pd
+
+# Tipos lógicos:
+#   id        -> entero con nulos (Int32 o Int64 según el rango)
+#   entero    -> entero con nulos; si hay decimales se conserva como float
+#   decimal   -> float64
+#   fecha     -> datetime64
+#   categoria -> category
+#   booleano  -> boolean con nulos
+ESQUEMAS = {
+    'Alertas': {
+        'id': 'id', 'tipo_alerta': 'categoria', 'producto_id': 'id', 'dispensario_id': 'id',
+        'fecha_creacion': 'fecha', 'fecha_vencimiento': 'fecha',
+        'estado': 'categoria', 'prioridad': 'categoria', 'origen': 'categoria',
+    },
+    'Control_Calidad': {
+        'id': 'id', 'producto_id': 'id', 'fecha_control': 'fecha', 'tipo_control': 'categoria',
+        'humedad_porcentaje': 'decimal', 'potencia_thc': 'decimal', 'potencia_cbd': 'decimal',
+        'presencia_hongos': 'booleano', 'sellos_sanitarios': 'booleano',
+        'estado_envase': 'categoria', 'resultado': 'categoria',
+    },
+    'Pedidos': {
+        'id': 'id', 'proveedor_id': 'id', 'fecha_pedido': 'fecha',
+        'fecha_entrega_esperada': 'fecha', 'fecha_entrega_real': 'fecha',
+        'estado': 'categoria', 'total': 'decimal',
+    },
+    'Ventas': {
+        'id': 'id', 'cliente_id': 'id', 'dispensario_id': 'id', 'fecha_venta': 'fecha',
+        'total': 'decimal', 'metodo_pago': 'categoria', 'estado': 'categoria',
+    },
+    'Clientes': {
+        'id': 'id', 'fecha_registro': 'fecha', 'activo': 'booleano',
+    },
+    'Detalle_Distribucion': {
+        'id': 'id', 'distribucion_id': 'id', 'producto_id': 'id',
+        'cantidad': 'entero', 'cantidad_recibida': 'entero',
+    },
+    'Detalle_Venta': {
+        'id': 'id', 'venta_id': 'id', 'producto_id': 'id', 'cantidad': 'entero',
+        'precio_unitario': 'decimal', 'subtotal': 'decimal',
+    },
+    'Distribuciones': {
+        'id': 'id', 'dispensario_id': 'id', 'fecha_distribucion': 'fecha', 'estado': 'categoria',
+    },
+    'Inventario_Dispensario': {
+        'id': 'id', 'producto_id': 'id', 'dispensario_id': 'id',
+        'cantidad': 'entero', 'stock_minimo': 'entero', 'stock_maximo': 'entero',
+        'ultima_actualizacion': 'fecha',
+    },
+    'Proveedores': {
+        'id': 'id', 'fecha_registro': 'fecha', 'activo': 'booleano',
+    },
+    'Productos': {
+        'id': 'id', 'precio_unitario': 'decimal', 'unidad_medida': 'categoria',
+        'categoria': 'categoria', 'tipo_producto': 'categoria',
+        'thc_porcentaje': 'decimal', 'cbd_porcentaje': 'decimal',
+        'fecha_caducidad': 'fecha', 'fecha_creacion': 'fecha', 'activo': 'booleano',
+    },
+    'Dispensarios': {
+        'id': 'id', 'fecha_apertura': 'fecha', 'activo': 'booleano',
+    },
+    'Inventario_Deposito': {
+        'id': 'id', 'producto_id': 'id', 'cantidad': 'entero', 'stock_minimo': 'entero',
+        'stock_maximo': 'entero', 'ultima_actualizacion': 'fecha',
+    },
+    'Detalle_Pedido': {
+        'id': 'id', 'pedido_id': 'id', 'producto_id': 'id', 'cantidad': 'entero',
+        'precio_unitario': 'decimal', 'subtotal': 'decimal',
+    },
+}
+
+_LIMITE_INT32 = np.iinfo(np.int32).max
+
+# Filas máximas por hoja de un archivo .xlsx (sin contar el encabezado)
+MAXIMO_FILAS_XLSX = 1_048_575
+
+
+def _a_entero(serie, permitir_decimales):
+    numeros = pd.to_numeric(serie, errors='coerce')
+    validos = numeros.dropna()
+    if permitir_decimales and not (validos == validos.round()).all():
+        return numeros.astype('float64')
+    numeros = numeros.round()
+    if validos.empty or validos.abs().max() <= _LIMITE_INT32:
+        return numeros.astype('Int32')
+    return numeros.astype('Int64')
+
+
+def _a_fecha(serie):
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie
+    # Celdas guardadas como número de serie de Excel
+    if pd.api.types.is_numeric_dtype(serie):
+        return pd.to_datetime(serie, unit='D', origin='1899-12-30', errors='coerce')
+    return pd.to_datetime(serie, errors='coerce')
+
+
+def _a_booleano(serie):
+    if serie.dtype == 'boolean':
+        return serie
+    valores = serie.map(lambda v: v.strip().lower() if isinstance(v, str) else v)
+    valores = valores.replace({'true': True, 'false': False, 'si': True, 'sí': True, 'no': False,
+                               '1': True, '0': False})
+    try:
+        return valores.astype('boolean')
+    except (TypeError, ValueError):
+        return serie
+
+
+def _a_categoria(serie):
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        return serie
+    return serie.map(lambda v: v if pd.isna(v) else str(v)).astype('category')
+
+
+_CONVERSORES = {
+    'id': lambda s: _a_entero(s, permitir_decimales=False) if not s.dtype.name.startswith('Int') else s,
+    'entero': lambda s: _a_entero(s, permitir_decimales=True) if not s.dtype.name.startswith('Int') else s,
+    'decimal': lambda s: s if s.dtype == 'float64' else pd.to_numeric(s, errors='coerce').astype('float64'),
+    'fecha': _a_fecha,
+    'categoria': _a_categoria,
+    'booleano': _a_booleano,
+}
+
+
+# Función para aplicar el esquema de una hoja lógica a un DataFrame.
+# Las columnas sin esquema se dejan como están.
+def aplicar_esquema(df, hoja_logica):
+    esquema = ESQUEMAS.get(hoja_logica)
+    if not esquema or df is None:
+        return df
+    df = df.copy(deep=False)
+    for columna, tipo in esquema.items():
+        if columna in df.columns:
+            df[columna] = _CONVERSORES[tipo](df[columna])
+    return df
+
+
+# Convierte las hojas al leerlas. `alias` relaciona el nombre real de una hoja
+# con su hoja lógica (por ejemplo, si la hoja de ventas se llama distinto).
+class Tipado:
+    def __init__(self, alias=None):
+        self.alias = dict(alias or {})
+        # Parte de la clave de caché: la misma hoja tipada con otros alias es otra entrada
+        self.clave = ('tipado', tuple(sorted(self.alias.items())))
+
+    def hoja_logica(self, hoja):
+        return self.alias.get(hoja, hoja)
+
+    def __call__(self, hoja, df):
+        return aplicar_esquema(df, self.hoja_logica(hoja))
+
+
+# Prepara un DataFrame tipado para escribirlo con openpyxl, que no admite
+# pd.NA / NaT ni tipos extendidos de pandas
+def a_valores_excel(df):
+    df = df.astype(object)
+    return df.where(df.notna(), None)
@@ -0,0 +1,163 @@
+# Exportación de hojas, vistas filtradas y agregados sin armar el archivo en memoria.
+# Los datos se recorren en bloques de filas y cada bloque se escribe apenas
+# llega: CSV por partes, Excel con xlsxwriter en modo `constant_memory` (cada
+# fila pasa a disco antes de escribir la siguiente) y Parquet con un row group
+# por bloque. El archivo se escribe en disco; la app lo genera recién cuando se
+# pide la descarga. Desde la línea de comandos, con el backend Parquet, la hoja
+# se lee del archivo por lotes, así que tampoco hace falta tenerla cargada.
+import argparse
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+
+import pandas as pd
+
+from almacenamiento import crear_almacen, escribir_parquet_bloques, importar_pyarrow
+from bloqueos import reemplazo_atomico
+from esquemas import MAXIMO_FILAS_XLSX, Tipado, a_valores_excel
+
+
+FILAS_POR_BLOQUE = 50_000
+
+# formato -> (extensión, tipo MIME)
+FORMATOS = {
+    'xlsx': ('.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'csv': ('.csv', 'text/csv'),
+    'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+}
+
+
+def nombre_archivo(nombre, formato):
+    return f"{nombre}{FORMATOS[formato][0]}"
+
+
+# Origen de una exportación: (columnas, iterador de bloques de filas)
+def desde_df(df, filas=FILAS_POR_BLOQUE):
+    bloques = (df.iloc[inicio:inicio + filas] for inicio in range(0, len(df), filas))
+    return list(df.columns), bloques
+
+
+# Origen que lee un archivo Parquet por lotes. `filtros` son predicados
+# [(columna, operador, valor), ...] como los de filtros.py.
+def desde_parquet(ruta, columnas=None, filtros=None, filas=FILAS_POR_BLOQUE):
+    import pyarrow.dataset as ds
+
+    conjunto = ds.dataset(ruta, format='parquet')
+    columnas = [c for c in columnas if c in conjunto.schema.names] if columnas is not None else conjunto.schema.names
+    condicion = importar_pyarrow().filters_to_expression(filtros) if filtros else None
+    lotes = conjunto.to_batches(columns=columnas, filter=condicion, batch_size=filas)
+    return list(columnas), (lote.to_pandas() for lote in lotes)
+
+
+def escribir_csv(destino, columnas, bloques):
+    with open(destino, 'w', encoding='utf-8', newline='') as f:
+        pd.DataFrame(columns=columnas).to_csv(f, index=False)
+        for bloque in bloques:
+            bloque.to_csv(f, index=False, header=False)
+
+
+# Nombre de hoja válido en Excel (máximo 31 caracteres, sin []:*?/\)
+def _nombre_hoja(nombre, numero=1):
+    nombre = re.sub(r'[\[\]:*?/\\]', '_', str(nombre)) or 'Datos'
+    sufijo = f" ({numero})" if numero > 1 else ''
+    return nombre[:31 - len(sufijo)] + sufijo
+
+
+# Las filas que no entran en una hoja de Excel siguen en otra ("Ventas (2)", ...)
+def escribir_xlsx(destino, columnas, bloques, hoja='Datos'):
+    import xlsxwriter
+
+    libro = xlsxwriter.Workbook(destino, {
+        'constant_memory': True,
+        'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+        'remove_timezone': True,
+        'strings_to_formulas': False,
+        'strings_to_urls': False,
+    })
+    encabezados = [str(c) for c in columnas]
+    try:
+        numero = 1
+        actual = libro.add_worksheet(_nombre_hoja(hoja))
+        actual.write_row(0, 0, encabezados)
+        fila = 1
+        for bloque in bloques:
+            for valores in a_valores_excel(bloque).itertuples(index=False, name=None):
+                if fila > MAXIMO_FILAS_XLSX:
+                    numero += 1
+                    actual = libro.add_worksheet(_nombre_hoja(hoja, numero))
+                    actual.write_row(0, 0, encabezados)
+                    fila = 1
+                actual.write_row(fila, 0, valores)
+                fila += 1
+    finally:
+        libro.close()
+
+
+def escribir_parquet(destino, columnas, bloques):
+    if importar_pyarrow() is None:
+        raise RuntimeError("Exportar a Parquet requiere el paquete 'pyarrow'")
+    escribir_parquet_bloques(destino, bloques, columnas)
+
+
+# Escribe el `origen` en `destino` con el formato pedido
+def exportar(origen, formato, destino, hoja='Datos'):
+    columnas, bloques = origen
+    if formato == 'xlsx':
+        escribir_xlsx(destino, columnas, bloques, hoja)
+    elif formato == 'csv':
+        escribir_csv(destino, columnas, bloques)
+    elif formato == 'parquet':
+        escribir_parquet(destino, columnas, bloques)
+    else:
+        raise ValueError(f"Formato de exportación desconocido: {formato}")
+
+
+# Exportación en un archivo temporal, abierto para leer desde el principio:
+# `with archivo_exportado(...) as archivo`. Al salir del bloque el archivo se
+# cierra y recién entonces se borra (Windows no permite borrar uno abierto).
+@contextmanager
+def archivo_exportado(origen, formato, hoja='Datos'):
+    descriptor, ruta = tempfile.mkstemp(prefix='cannabis_', suffix=FORMATOS[formato][0])
+    os.close(descriptor)
+    try:
+        exportar(origen, formato, ruta, hoja)
+        with open(ruta, 'rb') as archivo:
+            yield archivo
+    finally:
+        os.remove(ruta)
+
+
+# Contenido de la exportación, para st.download_button (que de todos modos
+# lee el archivo completo). El temporal no queda en disco.
+def contenido_exportado(origen, formato, hoja='Datos'):
+    with archivo_exportado(origen, formato, hoja) as archivo:
+        return archivo.read()
+
+
+# Origen de una hoja del almacén: el archivo Parquet por lotes si está al día,
+# o la hoja leída completa (también sin pyarrow)
+def desde_almacen(almacen, hoja, columnas=None, filtros=None):
+    ruta = almacen.ruta_parquet(hoja)
+    if ruta is not None and importar_pyarrow() is not None:
+        return desde_parquet(ruta, columnas, filtros)
+    df = almacen.leer(hoja, columnas, filtros)
+    if df is None:
+        raise ValueError(f"La hoja '{hoja}' no existe")
+    return desde_df(df)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Exporta una hoja del almacén por bloques")
+    parser.add_argument('hoja')
+    parser.add_argument('--formato', choices=list(FORMATOS), default='csv')
+    parser.add_argument('--salida', help="Archivo de salida (por defecto, <hoja>.<formato>)")
+    parser.add_argument('--backend', choices=['xlsx', 'parquet'])
+    parser.add_argument('--columnas', nargs='+')
+    args = parser.parse_args()
+
+    almacen = crear_almacen(backend=args.backend, preparar=Tipado())
+    salida = args.salida or nombre_archivo(args.hoja, args.formato)
+    origen = desde_almacen(almacen, args.hoja, args.columnas)
+    reemplazo_atomico(salida, lambda temporal: exportar(origen, args.formato, temporal, args.hoja))
+    print(f"{args.hoja} exportada a {salida}")
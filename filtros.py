@@ -0,0 +1,114 @@
+# Filtros de la barra lateral (dispensario y rango de fechas) expresados como
+# predicados sobre las columnas de cada hoja. Los predicados siguen el formato
+# de pyarrow ([(columna, operador, valor), ...], unidos con AND), así el almacén
+# Parquet los aplica al leer y descarta los row groups que no coinciden; los
+# demás orígenes los aplican con una máscara vectorizada (filtrar). Un predicado
+# 'in' con demasiados valores no se empuja al leer (ver dividir_predicados).
+from datetime import timedelta
+
+import pandas as pd
+
+# Columnas por las que se filtra cada hoja lógica
+COLUMNAS_FILTRO = {
+    'Ventas': {'dispensario': 'dispensario_id', 'fecha': 'fecha_venta'},
+    'Alertas': {'dispensario': 'dispensario_id', 'fecha': 'fecha_creacion'},
+    'Inventario_Dispensario': {'dispensario': 'dispensario_id'},
+    'Control_Calidad': {'fecha': 'fecha_control'},
+}
+
+# Hojas sin columnas de filtro propias que se filtran por las filas ya
+# filtradas de otra hoja: hoja -> (columna, hoja de referencia, columna de referencia)
+FILTROS_POR_REFERENCIA = {
+    'Detalle_Venta': ('venta_id', 'Ventas', 'id'),
+}
+
+# Máximo de valores de un predicado 'in' que se aplica al leer. Con más valores
+# (por ejemplo, las ventas de un rango de fechas largo) el filtro de pyarrow o el
+# literal SQL crecerían sin límite: la hoja se lee sin ese predicado y se filtra
+# después, en memoria o con un semi-join en el motor SQL.
+MAXIMO_VALORES_IN = 1000
+
+
+class FiltroDatos:
+    # `desde` y `hasta` son fechas incluidas en el rango (None = sin límite)
+    def __init__(self, dispensario_id=None, desde=None, hasta=None):
+        self.dispensario_id = dispensario_id
+        self.desde = pd.Timestamp(desde) if desde is not None else None
+        self.hasta = pd.Timestamp(hasta) if hasta is not None else None
+
+    @property
+    def clave(self):
+        return (self.dispensario_id, self.desde, self.hasta)
+
+    def vacio(self):
+        return self.dispensario_id is None and self.desde is None and self.hasta is None
+
+    # Predicados para las columnas propias de `hoja_logica` (None si no se filtra)
+    def predicados(self, hoja_logica):
+        columnas = COLUMNAS_FILTRO.get(hoja_logica, {})
+        predicados = []
+        if self.dispensario_id is not None and 'dispensario' in columnas:
+            predicados.append((columnas['dispensario'], '==', self.dispensario_id))
+        if 'fecha' in columnas:
+            if self.desde is not None:
+                predicados.append((columnas['fecha'], '>=', self.desde))
+            if self.hasta is not None:
+                predicados.append((columnas['fecha'], '<', self.hasta + timedelta(days=1)))
+        return predicados or None
+
+    # Predicados de `hoja_logica` incluyendo los filtros por referencia.
+    # `leer(hoja_logica, columnas, predicados)` devuelve la hoja de referencia filtrada.
+    def predicados_con_referencias(self, hoja_logica, leer):
+        if hoja_logica not in FILTROS_POR_REFERENCIA or self.vacio():
+            return self.predicados(hoja_logica)
+        columna, hoja_referencia, columna_referencia = FILTROS_POR_REFERENCIA[hoja_logica]
+        predicados_referencia = self.predicados(hoja_referencia)
+        if predicados_referencia is None:
+            return None
+        referencia = leer(hoja_referencia, [columna_referencia], predicados_referencia)
+        if referencia is None or columna_referencia not in referencia.columns:
+            return None
+        valores = tuple(sorted(referencia[columna_referencia].dropna().unique().tolist()))
+        return [(columna, 'in', valores)]
+
+
+# Separa los predicados que se aplican al leer de los 'in' con más de
+# MAXIMO_VALORES_IN valores, que se aplican después. Devuelve (al leer, después),
+# cada uno None si queda vacío.
+def dividir_predicados(predicados):
+    al_leer, despues = [], []
+    for predicado in predicados or []:
+        grande = predicado[1] == 'in' and len(predicado[2]) > MAXIMO_VALORES_IN
+        (despues if grande else al_leer).append(predicado)
+    return al_leer or None, despues or None
+
+
+# Aplica `predicados` a un DataFrame ya cargado. Los predicados sobre columnas
+# que la hoja no tiene se ignoran.
+def filtrar(df, predicados):
+    if df is None or not predicados:
+        return df
+    mascara = pd.Series(True, index=df.index)
+    for columna, operador, valor in predicados:
+        if columna not in df.columns:
+            continue
+        serie = df[columna]
+        if operador == '==':
+            coincide = serie == valor
+        elif operador == '!=':
+            coincide = serie != valor
+        elif operador == '<':
+            coincide = serie < valor
+        elif operador == '<=':
+            coincide = serie <= valor
+        elif operador == '>':
+            coincide = serie > valor
+        elif operador == '>=':
+            coincide = serie >= valor
+        elif operador == 'in':
+            coincide = serie.isin(valor)
+        else:
+            raise ValueError(f"Operador de filtro desconocido: {operador}")
+        # Los vacíos no cumplen ningún predicado
+        mascara &= coincide.fillna(False).astype(bool)
+    return df[mascara]
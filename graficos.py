@@ -0,0 +1,202 @@
+# Gráficos Plotly con la cantidad de datos acotada.
+# Antes de armar la figura los datos se reducen en el servidor, según el tipo
+# de gráfico: las líneas con eje de fechas se agrupan en intervalos de tiempo
+# (sumando si la serie es un total, como las ventas por día, y promediando si
+# es un nivel o una tasa) y las demás series se reducen con LTTB (Largest-Triangle-Three-Buckets, que
+# conserva los picos); las barras y tortas suman por categoría y muestran las
+# principales, con el resto agrupado en "Otros"; la dispersión usa WebGL y, con
+# demasiados puntos, una muestra. Con pocos datos la figura es la misma que la
+# de plotly.express, que se importa recién al armar el primer gráfico (es la
+# importación más pesada del arranque y la pestaña Editor no la necesita).
+import os
+
+import numpy as np
+import pandas as pd
+
+from metricas import tramo
+
+# Puntos por gráfico (configurable con CANNABIS_PUNTOS_GRAFICO)
+PUNTOS_POR_DEFECTO = 5000
+
+# Categorías que se muestran en barras y tortas; el resto va a "Otros"
+MAX_CATEGORIAS = 30
+ETIQUETA_OTROS = 'Otros'
+
+# A partir de esta cantidad de puntos la dispersión se dibuja con WebGL
+UMBRAL_WEBGL = 1000
+
+# Intervalos para agrupar fechas, de menor a mayor
+_INTERVALOS = [
+    ('s', pd.Timedelta(seconds=1)),
+    ('min', pd.Timedelta(minutes=1)),
+    ('5min', pd.Timedelta(minutes=5)),
+    ('15min', pd.Timedelta(minutes=15)),
+    ('h', pd.Timedelta(hours=1)),
+    ('6h', pd.Timedelta(hours=6)),
+    ('D', pd.Timedelta(days=1)),
+    ('W', pd.Timedelta(days=7)),
+    ('MS', pd.Timedelta(days=31)),
+    ('QS', pd.Timedelta(days=92)),
+    ('YS', pd.Timedelta(days=366)),
+]
+
+
+def _plotly_express():
+    import plotly.express as px
+    return px
+
+
+def puntos_maximos():
+    return int(os.environ.get('CANNABIS_PUNTOS_GRAFICO', PUNTOS_POR_DEFECTO))
+
+
+# Índices (posiciones) de los `n` puntos que LTTB conserva de la serie (x, y)
+def lttb(x, y, n):
+    total = len(y)
+    if n >= total or n < 3:
+        return np.arange(total)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # El primer y el último punto se conservan; el resto se reparte en n - 2 grupos
+    limites = np.linspace(1, total - 1, n - 1).astype(int)
+    elegidos = np.empty(n, dtype=int)
+    elegidos[0] = 0
+    elegidos[-1] = total - 1
+    anterior = 0
+    for i in range(n - 2):
+        inicio, fin = limites[i], limites[i + 1]
+        # Promedio del grupo siguiente (o el último punto, para el último grupo)
+        if i + 2 < len(limites):
+            siguiente = slice(limites[i + 1], limites[i + 2])
+            x_siguiente, y_siguiente = x[siguiente].mean(), y[siguiente].mean()
+        else:
+            x_siguiente, y_siguiente = x[-1], y[-1]
+        # Punto del grupo que forma el triángulo de mayor área con el anterior
+        areas = np.abs(
+            (x[anterior] - x_siguiente) * (y[inicio:fin] - y[anterior])
+            - (x[anterior] - x[inicio:fin]) * (y_siguiente - y[anterior])
+        )
+        anterior = inicio + int(np.nanargmax(areas)) if np.isfinite(areas).any() else inicio
+        elegidos[i + 1] = anterior
+    return elegidos
+
+
+# Una de cada k filas, para columnas en las que no se puede agregar
+def _espaciar(df, n):
+    if len(df) <= n:
+        return df
+    return df.iloc[np.linspace(0, len(df) - 1, n).astype(int)]
+
+
+def _es_numerica(serie):
+    return pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie)
+
+
+# Serie de una línea reducida a `n` puntos: fechas por intervalos, el resto con LTTB.
+# `agregacion` ('sum' o 'mean') es cómo se combinan los valores de un intervalo.
+def _reducir_serie(df, x, y, n, agregacion='mean'):
+    if len(df) <= n:
+        return df
+    if not _es_numerica(df[y]) or x == y:
+        return _espaciar(df, n)
+    if pd.api.types.is_datetime64_any_dtype(df[x]):
+        fechas = df[x].dropna()
+        if fechas.empty:
+            return _espaciar(df, n)
+        rango = fechas.max() - fechas.min()
+        frecuencia = next((alias for alias, paso in _INTERVALOS if rango / paso <= n), _INTERVALOS[-1][0])
+        grupos = df.groupby(pd.Grouper(key=x, freq=frecuencia))[y]
+        # min_count=1: los intervalos sin datos quedan vacíos y no en cero
+        agrupado = grupos.sum(min_count=1) if agregacion == 'sum' else grupos.mean()
+        return agrupado.dropna().reset_index()
+    # Eje x numérico en orden: se usa como tal; si no, la posición de cada fila
+    valores = df[y].to_numpy(dtype=float, na_value=np.nan)
+    if _es_numerica(df[x]) and df[x].is_monotonic_increasing:
+        eje = df[x].to_numpy(dtype=float, na_value=np.nan)
+    else:
+        eje = np.arange(len(df), dtype=float)
+    validos = ~np.isnan(valores) & ~np.isnan(eje)
+    df, valores, eje = df[validos], valores[validos], eje[validos]
+    return df.iloc[lttb(eje, valores, n)]
+
+
+# Deja las `maximo` categorías de `columna` con mayor `valores` y agrupa el resto en "Otros"
+def _principales(df, columna, valores, maximo):
+    if df[columna].nunique() <= maximo:
+        return df
+    totales = df.groupby(columna, observed=True)[valores].sum().sort_values(ascending=False)
+    principales = set(totales.index[:maximo])
+    df = df.copy()
+    etiquetas = df[columna].astype(object)
+    df[columna] = etiquetas.where(etiquetas.isin(principales), ETIQUETA_OTROS)
+    return df
+
+
+# Suma `valores` por las columnas de agrupación, dejando las principales categorías
+def _agregar_categorias(df, categorias, valores, maximo=MAX_CATEGORIAS):
+    categorias = [c for c in categorias if c is not None]
+    for columna in categorias:
+        df = _principales(df, columna, valores, maximo)
+    return df.groupby(categorias, observed=True, sort=False)[valores].sum().reset_index()
+
+
+# `agregacion`: 'sum' para series que son totales (ventas, cantidades) y 'mean'
+# para niveles o tasas, al agrupar fechas en intervalos
+def grafico_lineas(df, x, y, color=None, agregacion='mean', **kwargs):
+    if agregacion not in ('sum', 'mean'):
+        raise ValueError(f"Agregación no soportada: {agregacion}")
+    with tramo("grafico/lineas") as medicion:
+        medicion.agregar_filas(len(df))
+        n = puntos_maximos()
+        if len(df) > n:
+            if color is not None and color in df.columns:
+                grupos = df.groupby(color, observed=True, sort=False)
+                por_grupo = max(n // max(grupos.ngroups, 1), 3)
+                partes = []
+                for nombre, grupo in grupos:
+                    parte = _reducir_serie(grupo.drop(columns=[color]), x, y, por_grupo, agregacion)
+                    partes.append(parte.assign(**{color: nombre}))
+                df = pd.concat(partes, ignore_index=True) if partes else df
+            else:
+                df = _reducir_serie(df, x, y, n, agregacion)
+        return _plotly_express().line(df, x=x, y=y, color=color, **kwargs)
+
+
+def grafico_barras(df, x, y, color=None, **kwargs):
+    with tramo("grafico/barras") as medicion:
+        medicion.agregar_filas(len(df))
+        if y is not None and x != y and y in df.columns and _es_numerica(df[y]):
+            numerico = color is not None and color in df.columns and _es_numerica(df[color])
+            categorias = [x] if numerico or color is None else [x, color]
+            if len(df) > puntos_maximos() or any(df[c].nunique() > MAX_CATEGORIAS for c in categorias):
+                # Una barra por categoría: la suma es el alto de las barras apiladas
+                if numerico:
+                    # Color continuo (por ejemplo, un porcentaje): promedio por barra
+                    df = _principales(df, x, y, MAX_CATEGORIAS)
+                    df = df.groupby(x, observed=True, sort=False).agg({y: 'sum', color: 'mean'}).reset_index()
+                else:
+                    df = _agregar_categorias(df, categorias, y)
+        elif len(df) > puntos_maximos():
+            df = _espaciar(df, puntos_maximos())
+        return _plotly_express().bar(df, x=x, y=y, color=color, **kwargs)
+
+
+def grafico_pastel(df, values, names, **kwargs):
+    with tramo("grafico/pastel") as medicion:
+        medicion.agregar_filas(len(df))
+        if values in df.columns and names in df.columns and values != names and _es_numerica(df[values]):
+            if len(df) > puntos_maximos() or df[names].nunique() > MAX_CATEGORIAS:
+                df = _agregar_categorias(df, [names], values)
+        return _plotly_express().pie(df, values=values, names=names, **kwargs)
+
+
+def grafico_dispersion(df, x, y, **kwargs):
+    with tramo("grafico/dispersion") as medicion:
+        medicion.agregar_filas(len(df))
+        n = puntos_maximos()
+        if len(df) > n:
+            # Muestra fija (misma semilla) para que el gráfico no cambie entre reruns
+            df = df.sample(n=n, random_state=0).sort_index()
+        if len(df) > UMBRAL_WEBGL:
+            kwargs.setdefault('render_mode', 'webgl')
+        return _plotly_express().scatter(df, x=x, y=y, **kwargs)
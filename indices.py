@@ -0,0 +1,45 @@
+# Índices de las hojas de dimensión (Productos, Dispensarios, Clientes).
+# Se construyen una vez por versión de los datos y permiten resolver nombres a
+# partir de producto_id / dispensario_id / cliente_id con una búsqueda
+# vectorizada, en lugar de hacer un pd.merge contra la hoja completa.
+import pandas as pd
+from pandas.api.extensions import take
+
+
+class IndiceDimension:
+    def __init__(self, df, clave='id'):
+        self.clave = clave
+        # Si un id está repetido gana la primera fila, como en una búsqueda manual
+        filas = df[df[clave].notna()].drop_duplicates(clave)
+        self.filas = filas.reset_index(drop=True)
+        self.posiciones = pd.Index(self.filas[clave])
+
+    def __len__(self):
+        return len(self.filas)
+
+    # Posición de cada id en la dimensión (-1 si no existe)
+    def posiciones_de(self, ids):
+        return self.posiciones.get_indexer(pd.Index(ids))
+
+    # Valores de `columna` para cada id, alineados con `ids` (nulo si no existe)
+    def valores(self, ids, columna):
+        posiciones = self.posiciones_de(ids)
+        valores = take(self.filas[columna].array, posiciones, allow_fill=True)
+        indice = ids.index if isinstance(ids, pd.Series) else None
+        return pd.Series(valores, index=indice, name=columna)
+
+    # Agrega columnas de la dimensión a `df` usando la clave foránea.
+    # `columnas` es {columna_dimension: nombre_en_resultado}. Con how='inner' se
+    # descartan las filas cuyo id no existe en la dimensión (como pd.merge).
+    def anexar(self, df, clave_foranea, columnas, how='inner'):
+        posiciones = self.posiciones_de(df[clave_foranea])
+        if how == 'inner':
+            encontradas = posiciones >= 0
+            df = df[encontradas]
+            posiciones = posiciones[encontradas]
+        nuevas = {
+            destino: take(self.filas[origen].array, posiciones, allow_fill=True)
+            for origen, destino in columnas.items()
+        }
+        return df.assign(**nuevas)
+
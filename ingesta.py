@@ -0,0 +1,160 @@
+# Ingesta por bloques de libros Excel muy grandes.
+# En lugar de pd.read_excel(..., sheet_name=None), que materializa todas las
+# hojas a la vez, se recorre cada hoja fila por fila con openpyxl en modo
+# read-only y se vuelca en bloques de tamaño acotado a un almacén Parquet
+# (un archivo de volcado por libro). La memoria pico depende del tamaño del
+# bloque, no del tamaño del archivo.
+import os
+import shutil
+
+import pandas as pd
+
+from almacenamiento import AlmacenParquet
+from cache_libros import huella_archivo
+
+DIRECTORIO_INGESTA = 'data/ingesta'
+
+# Filas por bloque (configurable con CANNABIS_BLOQUE_FILAS)
+FILAS_POR_BLOQUE_POR_DEFECTO = 50_000
+
+# Los archivos subidos de al menos este tamaño se ingieren por bloques
+# (configurable con CANNABIS_STREAMING_MB)
+UMBRAL_STREAMING_MB_POR_DEFECTO = 20
+
+# Volcados que se conservan en DIRECTORIO_INGESTA, los de uso más reciente
+# (configurable con CANNABIS_INGESTAS_CONSERVADAS)
+INGESTAS_CONSERVADAS_POR_DEFECTO = 5
+
+# Marca de volcado completo: si el proceso se corta a mitad, se vuelve a ingerir
+_MARCA_COMPLETO = '_completo'
+
+
+def filas_por_bloque():
+    return int(os.environ.get('CANNABIS_BLOQUE_FILAS', FILAS_POR_BLOQUE_POR_DEFECTO))
+
+
+def umbral_streaming_bytes():
+    return int(float(os.environ.get('CANNABIS_STREAMING_MB', UMBRAL_STREAMING_MB_POR_DEFECTO)) * 1024 * 1024)
+
+
+def ingestas_conservadas():
+    return int(os.environ.get('CANNABIS_INGESTAS_CONSERVADAS', INGESTAS_CONSERVADAS_POR_DEFECTO))
+
+
+# Nombres de columna como los genera pandas: vacíos -> "Unnamed: i",
+# repetidos -> "col.1", "col.2", ...
+def _nombres_columnas(encabezado):
+    nombres = []
+    vistos = {}
+    for i, valor in enumerate(encabezado):
+        nombre = f"Unnamed: {i}" if valor is None else str(valor)
+        if nombre in vistos:
+            vistos[nombre] += 1
+            nombre = f"{nombre}.{vistos[nombre]}"
+        else:
+            vistos[nombre] = 0
+        nombres.append(nombre)
+    return nombres
+
+
+# Generador de bloques (DataFrames) de una hoja de openpyxl en modo read-only
+def iterar_bloques(hoja, tamano_bloque, al_avanzar=None):
+    filas = hoja.iter_rows(values_only=True)
+    encabezado = next(filas, None)
+    if encabezado is None:
+        return
+    columnas = _nombres_columnas(encabezado)
+    ancho = len(columnas)
+    bloque = []
+    leidas = 0
+    for fila in filas:
+        # Las filas completamente vacías se ignoran, como en pd.read_excel
+        if all(valor is None for valor in fila):
+            continue
+        if len(fila) != ancho:
+            fila = tuple(fila[:ancho]) + (None,) * (ancho - len(fila))
+        bloque.append(fila)
+        if len(bloque) >= tamano_bloque:
+            leidas += len(bloque)
+            yield pd.DataFrame(bloque, columns=columnas)
+            bloque = []
+            if al_avanzar is not None:
+                al_avanzar(leidas)
+    if bloque or leidas == 0:
+        leidas += len(bloque)
+        yield pd.DataFrame(bloque, columns=columnas)
+        if al_avanzar is not None:
+            al_avanzar(leidas)
+
+
+# Función para ingerir un libro completo a un almacén Parquet por bloques.
+# `progreso(fraccion, texto)` recibe el avance entre 0 y 1.
+def ingerir_libro(origen, directorio, preparar=None, cache=None, tamano_bloque=None, progreso=None):
+    from openpyxl import load_workbook
+
+    tamano_bloque = tamano_bloque or filas_por_bloque()
+    almacen = AlmacenParquet(directorio, cache=cache, preparar=preparar)
+    marca = os.path.join(directorio, _MARCA_COMPLETO)
+    if os.path.exists(marca):
+        return almacen
+
+    libro = load_workbook(origen, read_only=True, data_only=True)
+    try:
+        nombres = libro.sheetnames
+        for i, nombre in enumerate(nombres):
+            hoja = libro[nombre]
+            # max_row sale de la dimensión declarada en el archivo y puede faltar
+            total = hoja.max_row if hoja.max_row and hoja.max_row > 1 else None
+
+            def al_avanzar(leidas, i=i, nombre=nombre, total=total):
+                if progreso is None:
+                    return
+                avance = min(leidas / total, 1.0) if total else 0.0
+                progreso((i + avance) / len(nombres), f"{nombre}: {leidas:,} filas")
+
+            bloques = iterar_bloques(hoja, tamano_bloque, al_avanzar)
+            if preparar is not None:
+                bloques = (preparar(nombre, bloque) for bloque in bloques)
+            # Una columna entera puede traer decimales en un bloque posterior; el
+            # tipado al leer devuelve a entero las columnas declaradas como tales
+            almacen.escribir_bloques(nombre, bloques, enteros_como_decimales=True)
+    finally:
+        libro.close()
+
+    with open(marca, 'w', encoding='utf-8'):
+        pass
+    if progreso is not None:
+        progreso(1.0, "Ingesta completa")
+    return almacen
+
+
+# Ingiere un archivo subido en un directorio propio identificado por el hash
+# de su contenido, de modo que los reruns reutilizan el volcado ya hecho.
+# `huella` es ese hash si ya se calculó (ver cache_libros.huella_archivo).
+# Después se borran los volcados que ya no se usan.
+def ingerir_archivo_subido(archivo, preparar=None, cache=None, progreso=None, directorio_base=DIRECTORIO_INGESTA,
+                           huella=None):
+    huella = huella or huella_archivo(archivo)
+    directorio = os.path.join(directorio_base, huella[:32])
+    almacen = ingerir_libro(archivo, directorio, preparar=preparar, cache=cache, progreso=progreso)
+    # La fecha del directorio indica su último uso
+    os.utime(directorio)
+    podar_ingestas(directorio_base, conservar=[directorio])
+    return almacen
+
+
+# Borra los volcados de DIRECTORIO_INGESTA salvo los `ingestas_conservadas()`
+# usados más recientemente y los de `conservar`. Un volcado borrado que se
+# vuelve a pedir se ingiere de nuevo.
+def podar_ingestas(directorio_base=DIRECTORIO_INGESTA, cantidad=None, conservar=()):
+    cantidad = ingestas_conservadas() if cantidad is None else cantidad
+    conservar = {os.path.abspath(d) for d in conservar}
+    try:
+        with os.scandir(directorio_base) as entradas:
+            directorios = [e for e in entradas if e.is_dir()]
+    except FileNotFoundError:
+        return
+    directorios.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    for entrada in directorios[cantidad:]:
+        if os.path.abspath(entrada.path) not in conservar:
+            shutil.rmtree(entrada.path, ignore_errors=True)
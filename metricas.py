@@ -0,0 +1,350 @@
+# Instrumentación de rendimiento por ejecución (rerun) de la app.
+# Cada rerun activa un Perfil; el código instrumentado abre tramos con
+# `tramo(nombre)`, que registran duración, filas procesadas y memoria máxima del
+# proceso. Sin un perfil activo (por ejemplo, desde scripts o el benchmark) los
+# tramos no hacen nada. Los perfiles terminados se acumulan en MetricasAcumuladas,
+# que los exporta como logs estructurados (JSON por línea) o como métricas en el
+# formato de texto de Prometheus. El primer rerun del proceso (arranque en frío:
+# importaciones y cachés vacías) y los siguientes se comparan con un
+# presupuesto de tiempo para poder seguirlos a lo largo de las versiones.
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # resource no existe en Windows: sin dato de memoria
+    resource = None
+
+logger = logging.getLogger('cannabis.rendimiento')
+
+# Perfil del rerun en curso (cada sesión de Streamlit ejecuta su script en su propio hilo)
+_perfil_actual = contextvars.ContextVar('perfil_actual', default=None)
+
+# Perfiles recientes que se conservan para el panel
+MAXIMO_PERFILES = 20
+
+# Presupuestos por defecto, en segundos (CANNABIS_PRESUPUESTO_ARRANQUE y
+# CANNABIS_PRESUPUESTO_RERUN)
+PRESUPUESTO_ARRANQUE = 5.0
+PRESUPUESTO_RERUN = 1.0
+
+# Valores posibles de la etiqueta `tramo` en Prometheus. Cada valor es una serie
+# aparte, así que no puede depender de los datos: los tramos con nombre variable
+# (hoja, título del gráfico, fuente) se agrupan bajo su prefijo y cualquier otro
+# nombre queda como "otros". El detalle por nombre sigue en los logs JSON.
+TRAMOS_PROMETHEUS = (
+    'importaciones', 'load_data', 'agregados', 'sql', 'movimientos/stock', 'carga/paralela',
+    'grafico/lineas', 'grafico/barras', 'grafico/pastel', 'grafico/dispersion',
+    'pestaña/Resumen', 'pestaña/Inventario', 'pestaña/Ventas', 'pestaña/Calidad y Alertas',
+    'pestaña/Vistas Personalizadas', 'pestaña/Editor de Datos',
+)
+TRAMOS_VARIABLES = ('guardado/encolar', 'grafico/enviar', 'carga')
+
+# El primer perfil del proceso es el del arranque en frío
+_arranque_pendiente = True
+_lock_arranque = threading.Lock()
+
+
+def _segundos_entorno(variable, por_defecto):
+    try:
+        return float(os.environ.get(variable, por_defecto))
+    except ValueError:
+        return por_defecto
+
+
+# (presupuesto del arranque, presupuesto de cada rerun) en segundos
+def presupuestos():
+    return (_segundos_entorno('CANNABIS_PRESUPUESTO_ARRANQUE', PRESUPUESTO_ARRANQUE),
+            _segundos_entorno('CANNABIS_PRESUPUESTO_RERUN', PRESUPUESTO_RERUN))
+
+
+# Memoria máxima usada por el proceso hasta ahora (None si no se puede saber)
+def memoria_pico_bytes():
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa en KB; macOS, en bytes
+    return pico if sys.platform == 'darwin' else pico * 1024
+
+
+class Tramo:
+    def __init__(self, nombre, nivel):
+        self.nombre = nombre
+        self.nivel = nivel
+        self.inicio = time.perf_counter()
+        self.segundos = None
+        self.filas = None
+        self.memoria_pico = None
+        self.error = None
+
+    def agregar_filas(self, filas):
+        self.filas = (self.filas or 0) + int(filas)
+
+    def como_dict(self):
+        return {
+            'tramo': self.nombre,
+            'nivel': self.nivel,
+            'segundos': self.segundos,
+            'filas': self.filas,
+            'memoria_pico_bytes': self.memoria_pico,
+            'error': self.error,
+        }
+
+
+# Tramo que no registra nada (sin perfil activo)
+class _TramoInactivo:
+    def agregar_filas(self, filas):
+        pass
+
+
+_INACTIVO = _TramoInactivo()
+
+
+class Perfil:
+    # `inicio` (perf_counter) permite contar desde antes de crear el perfil, por
+    # ejemplo desde la primera importación del script
+    def __init__(self, inicio=None, arranque=False):
+        self.fecha = time.time()
+        self.tramos = []
+        self._abiertos = []
+        self._inicio = time.perf_counter() if inicio is None else inicio
+        self._fin_ultimo_tramo = self._inicio
+        self.segundos = None
+        self.interrumpido = False
+        self.arranque = arranque
+
+    @contextmanager
+    def tramo(self, nombre):
+        actual = Tramo(nombre, len(self._abiertos))
+        # Se agrega al abrir, así los tramos anidados quedan debajo de su padre
+        self.tramos.append(actual)
+        self._abiertos.append(actual)
+        try:
+            yield actual
+        except BaseException as e:
+            actual.error = type(e).__name__
+            raise
+        finally:
+            self._fin_ultimo_tramo = time.perf_counter()
+            actual.segundos = self._fin_ultimo_tramo - actual.inicio
+            actual.memoria_pico = memoria_pico_bytes()
+            self._abiertos.pop()
+
+    # Tramo ya terminado que empezó en `inicio` (perf_counter) y termina ahora
+    def registrar_tramo(self, nombre, inicio):
+        actual = Tramo(nombre, len(self._abiertos))
+        actual.inicio = inicio
+        self._fin_ultimo_tramo = time.perf_counter()
+        actual.segundos = self._fin_ultimo_tramo - inicio
+        actual.memoria_pico = memoria_pico_bytes()
+        self.tramos.append(actual)
+
+    def terminado(self):
+        return self.segundos is not None
+
+    # Un rerun interrumpido (st.rerun, st.stop) no llega al final del script: su
+    # duración se cuenta hasta el último tramo cerrado
+    def terminar(self, interrumpido=False):
+        fin = self._fin_ultimo_tramo if interrumpido else time.perf_counter()
+        self.segundos = fin - self._inicio
+        self.interrumpido = interrumpido
+        return self
+
+    def como_dict(self):
+        return {
+            'fecha': self.fecha,
+            'segundos': self.segundos,
+            'interrumpido': self.interrumpido,
+            'arranque': self.arranque,
+            'memoria_pico_bytes': memoria_pico_bytes(),
+            'tramos': [t.como_dict() for t in self.tramos],
+        }
+
+
+# Activa un perfil nuevo para el rerun en curso y lo devuelve. Con `inicio`, lo
+# que pasó desde entonces hasta ahora queda como el tramo "importaciones".
+def iniciar_perfil(inicio=None):
+    global _arranque_pendiente
+    with _lock_arranque:
+        arranque, _arranque_pendiente = _arranque_pendiente, False
+    perfil = Perfil(inicio, arranque)
+    if inicio is not None:
+        perfil.registrar_tramo("importaciones", inicio)
+    _perfil_actual.set(perfil)
+    return perfil
+
+
+def perfil_actual():
+    return _perfil_actual.get()
+
+
+# Tramo del perfil activo. `activo=False` (por ejemplo, una pestaña cerrada) no registra nada.
+@contextmanager
+def tramo(nombre, activo=True):
+    perfil = _perfil_actual.get()
+    if perfil is None or not activo:
+        yield _INACTIVO
+        return
+    with perfil.tramo(nombre) as actual:
+        yield actual
+
+
+def _etiqueta_prometheus(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Valor de la etiqueta `tramo` para un nombre de tramo (ver TRAMOS_PROMETHEUS)
+def tramo_prometheus(nombre):
+    if nombre in TRAMOS_PROMETHEUS:
+        return nombre
+    for prefijo in TRAMOS_VARIABLES:
+        if nombre.startswith(prefijo + '/'):
+            return prefijo
+    return 'otros'
+
+
+class MetricasAcumuladas:
+    def __init__(self, maximo_perfiles=MAXIMO_PERFILES, ruta_log=None, ruta_prometheus=None,
+                 presupuesto_arranque=PRESUPUESTO_ARRANQUE, presupuesto_rerun=PRESUPUESTO_RERUN):
+        self._lock = threading.RLock()
+        self.perfiles = deque(maxlen=maximo_perfiles)
+        # tramo -> {'cantidad', 'segundos', 'maximo', 'filas', 'errores'}
+        self.por_tramo = {}
+        self.reruns = 0
+        self.segundos_reruns = 0.0
+        self.ruta_log = ruta_log
+        self.ruta_prometheus = ruta_prometheus
+        self.presupuesto_arranque = presupuesto_arranque
+        self.presupuesto_rerun = presupuesto_rerun
+        # Duración del arranque en frío (None hasta registrarlo) y reruns que
+        # superaron su presupuesto
+        self.segundos_arranque = None
+        self.excedidos = 0
+
+    # Rutas de exportación desde CANNABIS_METRICAS_LOG y CANNABIS_METRICAS_PROM
+    # y presupuestos desde CANNABIS_PRESUPUESTO_ARRANQUE y CANNABIS_PRESUPUESTO_RERUN
+    @classmethod
+    def desde_entorno(cls):
+        presupuesto_arranque, presupuesto_rerun = presupuestos()
+        return cls(
+            ruta_log=os.environ.get('CANNABIS_METRICAS_LOG') or None,
+            ruta_prometheus=os.environ.get('CANNABIS_METRICAS_PROM') or None,
+            presupuesto_arranque=presupuesto_arranque,
+            presupuesto_rerun=presupuesto_rerun,
+        )
+
+    def presupuesto(self, perfil):
+        return self.presupuesto_arranque if perfil.arranque else self.presupuesto_rerun
+
+    def registrar(self, perfil):
+        datos = perfil.como_dict()
+        presupuesto = self.presupuesto(perfil)
+        datos['presupuesto'] = presupuesto
+        excedido = (datos['segundos'] or 0.0) > presupuesto
+        with self._lock:
+            self.perfiles.append(datos)
+            self.reruns += 1
+            self.segundos_reruns += datos['segundos'] or 0.0
+            if perfil.arranque:
+                self.segundos_arranque = datos['segundos']
+            if excedido:
+                self.excedidos += 1
+            for t in datos['tramos']:
+                acumulado = self.por_tramo.setdefault(
+                    t['tramo'], {'cantidad': 0, 'segundos': 0.0, 'maximo': 0.0, 'filas': 0, 'errores': 0})
+                acumulado['cantidad'] += 1
+                acumulado['segundos'] += t['segundos'] or 0.0
+                acumulado['maximo'] = max(acumulado['maximo'], t['segundos'] or 0.0)
+                acumulado['filas'] += t['filas'] or 0
+                acumulado['errores'] += 1 if t['error'] else 0
+            texto_prometheus = self.a_prometheus() if self.ruta_prometheus else None
+        linea = json.dumps(datos, ensure_ascii=False)
+        logger.info(linea)
+        if excedido:
+            logger.warning("%s de %.3f s, sobre el presupuesto de %.3f s",
+                           "Arranque" if perfil.arranque else "Rerun", datos['segundos'], presupuesto)
+        if self.ruta_log:
+            with open(self.ruta_log, 'a', encoding='utf-8') as f:
+                f.write(linea + '\n')
+        if texto_prometheus is not None:
+            # Reemplazo atómico: el recolector nunca lee un archivo a medias
+            temporal = self.ruta_prometheus + '.tmp'
+            with open(temporal, 'w', encoding='utf-8') as f:
+                f.write(texto_prometheus)
+            os.replace(temporal, self.ruta_prometheus)
+
+    # Perfiles recientes, uno por línea en JSON
+    def a_json_lineas(self):
+        with self._lock:
+            return ''.join(json.dumps(p, ensure_ascii=False) + '\n' for p in self.perfiles)
+
+    # Métricas en el formato de texto de Prometheus
+    def a_prometheus(self):
+        with self._lock:
+            return self._texto_prometheus()
+
+    # Acumulados por valor de la etiqueta `tramo`, ordenados por nombre
+    def _por_etiqueta(self):
+        agrupados = {}
+        for nombre, a in self.por_tramo.items():
+            grupo = agrupados.setdefault(tramo_prometheus(nombre),
+                                         {'cantidad': 0, 'segundos': 0.0, 'maximo': 0.0, 'filas': 0, 'errores': 0})
+            grupo['cantidad'] += a['cantidad']
+            grupo['segundos'] += a['segundos']
+            grupo['maximo'] = max(grupo['maximo'], a['maximo'])
+            grupo['filas'] += a['filas']
+            grupo['errores'] += a['errores']
+        return sorted(agrupados.items())
+
+    def _texto_prometheus(self):
+        lineas = [
+            '# HELP cannabis_reruns_total Ejecuciones completas de la app',
+            '# TYPE cannabis_reruns_total counter',
+            f'cannabis_reruns_total {self.reruns}',
+            '# HELP cannabis_rerun_segundos_total Tiempo total de las ejecuciones',
+            '# TYPE cannabis_rerun_segundos_total counter',
+            f'cannabis_rerun_segundos_total {self.segundos_reruns:.6f}',
+            '# HELP cannabis_reruns_sobre_presupuesto_total Ejecuciones que superaron su presupuesto de tiempo',
+            '# TYPE cannabis_reruns_sobre_presupuesto_total counter',
+            f'cannabis_reruns_sobre_presupuesto_total {self.excedidos}',
+            '# HELP cannabis_presupuesto_segundos Presupuesto de tiempo del arranque y de cada rerun',
+            '# TYPE cannabis_presupuesto_segundos gauge',
+            f'cannabis_presupuesto_segundos{{tipo="arranque"}} {self.presupuesto_arranque:.6f}',
+            f'cannabis_presupuesto_segundos{{tipo="rerun"}} {self.presupuesto_rerun:.6f}',
+            '# HELP cannabis_tramo_segundos Duración de los tramos instrumentados',
+            '# TYPE cannabis_tramo_segundos summary',
+        ]
+        por_etiqueta = self._por_etiqueta()
+        for nombre, a in por_etiqueta:
+            etiqueta = f'tramo="{_etiqueta_prometheus(nombre)}"'
+            lineas.append(f'cannabis_tramo_segundos_count{{{etiqueta}}} {a["cantidad"]}')
+            lineas.append(f'cannabis_tramo_segundos_sum{{{etiqueta}}} {a["segundos"]:.6f}')
+        lineas += ['# HELP cannabis_tramo_segundos_max Duración máxima de cada tramo',
+                   '# TYPE cannabis_tramo_segundos_max gauge']
+        for nombre, a in por_etiqueta:
+            lineas.append(f'cannabis_tramo_segundos_max{{tramo="{_etiqueta_prometheus(nombre)}"}} {a["maximo"]:.6f}')
+        lineas += ['# HELP cannabis_tramo_filas_total Filas procesadas por cada tramo',
+                   '# TYPE cannabis_tramo_filas_total counter']
+        for nombre, a in por_etiqueta:
+            lineas.append(f'cannabis_tramo_filas_total{{tramo="{_etiqueta_prometheus(nombre)}"}} {a["filas"]}')
+        lineas += ['# HELP cannabis_tramo_errores_total Tramos terminados con una excepción',
+                   '# TYPE cannabis_tramo_errores_total counter']
+        for nombre, a in por_etiqueta:
+            lineas.append(f'cannabis_tramo_errores_total{{tramo="{_etiqueta_prometheus(nombre)}"}} {a["errores"]}')
+        if self.segundos_arranque is not None:
+            lineas += ['# HELP cannabis_arranque_segundos Duración del primer rerun del proceso (arranque en frío)',
+                       '# TYPE cannabis_arranque_segundos gauge',
+                       f'cannabis_arranque_segundos {self.segundos_arranque:.6f}']
+        memoria = memoria_pico_bytes()
+        if memoria is not None:
+            lineas += ['# HELP cannabis_memoria_pico_bytes Memoria máxima usada por el proceso',
+                       '# TYPE cannabis_memoria_pico_bytes gauge',
+                       f'cannabis_memoria_pico_bytes {memoria}']
+        return '\n'.join(lineas) + '\n'
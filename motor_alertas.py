@@ -0,0 +1,312 @@
+# Generación automática de alertas a partir del inventario y del control de calidad.
+# Cada regla es una pasada vectorizada sobre una hoja (stock bajo el mínimo,
+# stock sobre el máximo, control de calidad rechazado o pendiente) que devuelve
+# las alertas que deberían estar activas, identificadas por su tipo y su clave
+# (producto, o producto y dispensario). Los guardados marcan las claves de las
+# filas que cambiaron y solo esas se vuelven a evaluar; una hoja que cambió por
+# otro camino (otro proceso, una importación) se evalúa completa. El resultado se
+# concilia con la hoja Alertas en un solo paso: se crean las alertas nuevas, se
+# actualizan las activas cuyo mensaje o prioridad cambió y se resuelven las que
+# ya no se cumplen. Las alertas que genera el motor llevan origen 'Automatica' y
+# son las únicas que se modifican; las cargadas a mano no se tocan, aunque sean
+# del mismo tipo, y mientras estén activas no se genera otra igual.
+#
+# La evaluación escribe en el almacén: se hace en el hilo escritor (ver
+# cola_escritura.py), nunca durante una ejecución de la app.
+import os
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+from diario import calcular_cambios
+
+ACTIVA = 'Activa'
+RESUELTA = 'Resuelta'
+AUTOMATICA = 'Automatica'
+
+
+# Generación automática activada (CANNABIS_ALERTAS_AUTOMATICAS=0 la desactiva)
+def alertas_automaticas():
+    return os.environ.get('CANNABIS_ALERTAS_AUTOMATICAS', '1').strip().lower() not in ('0', 'no', 'false')
+
+
+COLUMNAS_ALERTAS = [
+    'id', 'tipo_alerta', 'producto_id', 'dispensario_id', 'mensaje',
+    'fecha_creacion', 'fecha_vencimiento', 'estado', 'prioridad', 'origen',
+]
+
+
+def _enteros(serie):
+    return serie.astype('int64').astype(str)
+
+
+# Funciones de evaluación: reciben las filas de la hoja (ya sin claves vacías) y
+# devuelven las filas que generan alerta con las columnas `mensaje` y `prioridad`
+
+def _stock_bajo(df):
+    if 'cantidad' not in df.columns or 'stock_minimo' not in df.columns:
+        return None
+    bajo = df[df['cantidad'].notna() & df['stock_minimo'].notna() & (df['cantidad'] <= df['stock_minimo'])]
+    critico = bajo['cantidad'] * 2 <= bajo['stock_minimo']
+    return bajo.assign(
+        mensaje=('Stock ' + critico.map({True: 'crítico', False: 'bajo'}) + ': quedan '
+                 + _enteros(bajo['cantidad']) + ' (mínimo ' + _enteros(bajo['stock_minimo']) + ')'),
+        prioridad=critico.map({True: 'Critica', False: 'Alta'}),
+    )
+
+
+def _stock_excedido(df):
+    if 'cantidad' not in df.columns or 'stock_maximo' not in df.columns:
+        return None
+    excedido = df[df['cantidad'].notna() & df['stock_maximo'].notna() & (df['cantidad'] > df['stock_maximo'])]
+    return excedido.assign(
+        mensaje=('Stock excedido: ' + _enteros(excedido['cantidad'])
+                 + ' (máximo ' + _enteros(excedido['stock_maximo']) + ')'),
+        prioridad='Media',
+    )
+
+
+# Solo cuenta el último control de cada producto
+def _control_calidad(df):
+    if 'resultado' not in df.columns:
+        return None
+    if 'fecha_control' in df.columns:
+        df = df.sort_values('fecha_control', kind='stable')
+    ultimos = df.drop_duplicates('producto_id', keep='last')
+    resultado = ultimos['resultado'].astype(object)
+    rechazado = resultado == 'Rechazado'
+    ultimos = ultimos[rechazado | (resultado == 'Pendiente')]
+    rechazado = rechazado[ultimos.index]
+    motivo = 'Control de calidad rechazado'
+    if 'observaciones' in ultimos.columns:
+        observaciones = ultimos['observaciones'].astype(object).fillna('').astype(str)
+        motivo = (motivo + ': ' + observaciones).where(observaciones != '', motivo)
+    return ultimos.assign(
+        mensaje=pd.Series('Producto pendiente de aprobación de calidad', index=ultimos.index,
+                          dtype=object).where(~rechazado, motivo),
+        prioridad=rechazado.map({True: 'Critica', False: 'Media'}),
+    )
+
+
+class Regla:
+    # `claves` son las columnas de la hoja que identifican la alerta (y que se
+    # guardan en Alertas); las alertas de reglas sin dispensario no lo tienen
+    def __init__(self, nombre, tipo_alerta, hoja, claves, evaluar):
+        self.nombre = nombre
+        self.tipo_alerta = tipo_alerta
+        self.hoja = hoja
+        self.claves = list(claves)
+        self.evaluar = evaluar
+
+    # Alertas de la hoja Alertas que corresponden a esta regla
+    def alcance(self, alertas):
+        mascara = alertas['tipo_alerta'].astype(object) == self.tipo_alerta
+        con_dispensario = alertas['dispensario_id'].notna()
+        return mascara & (con_dispensario if 'dispensario_id' in self.claves else ~con_dispensario)
+
+
+REGLAS = [
+    Regla('stock_bajo_deposito', 'Stock_Bajo', 'Inventario_Deposito', ['producto_id'], _stock_bajo),
+    Regla('stock_bajo_dispensario', 'Stock_Bajo', 'Inventario_Dispensario',
+          ['producto_id', 'dispensario_id'], _stock_bajo),
+    Regla('stock_excedido_deposito', 'Stock_Excedido', 'Inventario_Deposito', ['producto_id'], _stock_excedido),
+    Regla('stock_excedido_dispensario', 'Stock_Excedido', 'Inventario_Dispensario',
+          ['producto_id', 'dispensario_id'], _stock_excedido),
+    Regla('control_calidad', 'Control_Calidad', 'Control_Calidad', ['producto_id'], _control_calidad),
+]
+
+
+# Índice de claves de un DataFrame (las filas con claves vacías se descartan antes)
+def _indice_claves(df, claves):
+    if len(claves) == 1:
+        return pd.Index(df[claves[0]].astype('int64'), name=claves[0])
+    return pd.MultiIndex.from_frame(df[claves].astype('int64'))
+
+
+def _sin_claves_vacias(df, claves):
+    if any(c not in df.columns for c in claves):
+        return df.iloc[0:0]
+    return df.dropna(subset=claves)
+
+
+class MotorAlertas:
+    def __init__(self, reglas=None):
+        self.reglas = list(reglas if reglas is not None else REGLAS)
+        # hoja lógica -> firma de la versión ya evaluada
+        self.firmas = {}
+        # hoja lógica -> filas marcadas para evaluar (DataFrames), o None si hay que evaluar toda la hoja
+        self._marcadas = {}
+        # hoja lógica -> cantidad de veces que se marcó, para no desmarcar lo marcado durante aplicar
+        self._versiones = {}
+        self._lock = threading.RLock()
+        self.estado = {'evaluaciones': 0, 'filas_evaluadas': 0, 'creadas': 0, 'actualizadas': 0, 'resueltas': 0}
+
+    def hojas(self):
+        return list(dict.fromkeys(regla.hoja for regla in self.reglas))
+
+    def pendiente(self):
+        with self._lock:
+            return bool(self._marcadas)
+
+    # Si las hojas ya se evaluaron en la versión de `firmas` (sin marcar nada)
+    def al_dia(self, firmas):
+        with self._lock:
+            return not self._marcadas and all(
+                firma is not None and self.firmas.get(hoja) == firma
+                for hoja, firma in firmas.items() if hoja in self.hojas())
+
+    # Las hojas cuya firma no es la evaluada se marcan completas. `firmas` es
+    # {hoja lógica: firma}.
+    def sincronizar(self, firmas):
+        with self._lock:
+            for hoja, firma in firmas.items():
+                if hoja not in self.hojas() or (firma is not None and self.firmas.get(hoja) == firma):
+                    continue
+                self._marcar(hoja, None)
+                self.firmas[hoja] = firma
+
+    # Se llama después de guardar `hoja` con los cambios entre `original` y
+    # `editado`: se marcan las filas anteriores y nuevas de los cambios. Si la
+    # versión evaluada no era la de `original`, se marca la hoja completa.
+    def registrar_cambios(self, hoja, original, editado, firma_antes, firma_despues):
+        if hoja not in self.hojas():
+            return
+        with self._lock:
+            cambios = None
+            if original is not None and editado is not None and self.firmas.get(hoja) == firma_antes:
+                cambios = calcular_cambios(original, editado)
+            if cambios is None:
+                self._marcar(hoja, None)
+            elif hoja not in self._marcadas or self._marcadas[hoja] is not None:
+                actualizados = cambios['actualizados'].index
+                filas = [
+                    original.loc[list(cambios['eliminados']) + list(actualizados)],
+                    cambios['actualizados'],
+                    cambios['insertados'],
+                ]
+                filas = [f for f in filas if not f.empty]
+                if filas:
+                    self._marcar(hoja, self._marcadas.get(hoja, []) + filas)
+            self.firmas[hoja] = firma_despues
+
+    def _marcar(self, hoja, filas):
+        self._marcadas[hoja] = filas
+        self._versiones[hoja] = self._versiones.get(hoja, 0) + 1
+
+    # Evalúa las filas marcadas y concilia el resultado con `alertas` (la hoja
+    # Alertas vigente, o None si no existe). `leer(hoja)` devuelve la hoja
+    # completa. Devuelve la nueva versión de Alertas, o None si no hay cambios.
+    # Con `guardar`, la nueva versión se guarda con guardar(nuevas) antes de
+    # desmarcar las filas: si algo falla (al leer, al evaluar o al guardar) las
+    # marcas quedan y la próxima llamada las vuelve a evaluar.
+    def aplicar(self, alertas, leer, ahora=None, guardar=None):
+        with self._lock:
+            marcadas, versiones = dict(self._marcadas), dict(self._versiones)
+        if not marcadas:
+            return None
+        nuevas = self._conciliar(marcadas, alertas, leer, ahora)
+        if nuevas is not None and guardar is not None:
+            guardar(nuevas)
+        with self._lock:
+            # Las hojas marcadas otra vez mientras tanto quedan para la próxima
+            for hoja in marcadas:
+                if self._versiones.get(hoja) == versiones.get(hoja):
+                    self._marcadas.pop(hoja, None)
+        return nuevas
+
+    def _conciliar(self, marcadas, alertas, leer, ahora):
+        ahora = pd.Timestamp(ahora or datetime.now()).floor('s')
+        if alertas is None:
+            alertas = pd.DataFrame(columns=COLUMNAS_ALERTAS)
+        nuevas = alertas.copy()
+        for columna in ('tipo_alerta', 'mensaje', 'estado', 'prioridad', 'origen'):
+            if columna not in nuevas.columns:
+                nuevas[columna] = pd.Series(dtype=object, index=nuevas.index)
+            # Las columnas categóricas no admiten valores nuevos
+            nuevas[columna] = nuevas[columna].astype(object)
+        for columna in ('producto_id', 'dispensario_id'):
+            if columna not in nuevas.columns:
+                nuevas[columna] = pd.Series(pd.NA, index=nuevas.index, dtype='Int64')
+        agregadas = []
+        hubo_cambios = False
+
+        datos = {hoja: leer(hoja) for hoja in marcadas}
+        for regla in self.reglas:
+            if regla.hoja not in marcadas or datos[regla.hoja] is None:
+                continue
+            df = _sin_claves_vacias(datos[regla.hoja], regla.claves)
+            vigentes = regla.alcance(nuevas) & nuevas['producto_id'].notna() & (nuevas['estado'] == ACTIVA)
+            automaticas = nuevas['origen'] == AUTOMATICA
+            activas = nuevas[vigentes & automaticas]
+            claves_activas = _indice_claves(activas, regla.claves)
+            claves_manuales = _indice_claves(nuevas[vigentes & ~automaticas], regla.claves)
+            if marcadas[regla.hoja] is not None:
+                # Solo las claves de las filas marcadas (con sus valores antes y después del cambio)
+                filas = _sin_claves_vacias(pd.concat(marcadas[regla.hoja]), regla.claves)
+                claves = _indice_claves(filas, regla.claves).unique()
+                df = df[_indice_claves(df, regla.claves).isin(claves)]
+                dentro = claves_activas.isin(claves)
+                activas, claves_activas = activas[dentro], claves_activas[dentro]
+            self.estado['evaluaciones'] += 1
+            self.estado['filas_evaluadas'] += len(df)
+            deseadas = regla.evaluar(df)
+            if deseadas is None:
+                deseadas = df.iloc[0:0].assign(mensaje=pd.Series(dtype=object), prioridad=pd.Series(dtype=object))
+            deseadas = deseadas.drop_duplicates(regla.claves)
+            claves_deseadas = _indice_claves(deseadas, regla.claves)
+
+            # Activas que ya no se cumplen
+            resolver = activas.index[~claves_activas.isin(claves_deseadas)]
+            nuevas.loc[resolver, 'estado'] = RESUELTA
+
+            # Activas que siguen: mensaje y prioridad al día
+            siguen = activas[claves_activas.isin(claves_deseadas)]
+            if not siguen.empty:
+                actuales = deseadas.set_index(claves_deseadas).reindex(claves_activas[claves_activas.isin(claves_deseadas)])
+                mensaje = pd.Series(actuales['mensaje'].to_numpy(), index=siguen.index)
+                prioridad = pd.Series(actuales['prioridad'].to_numpy(), index=siguen.index)
+                distintas = siguen.index[(siguen['mensaje'] != mensaje) | (siguen['prioridad'] != prioridad)]
+                nuevas.loc[distintas, 'mensaje'] = mensaje[distintas]
+                nuevas.loc[distintas, 'prioridad'] = prioridad[distintas]
+                self.estado['actualizadas'] += len(distintas)
+                hubo_cambios |= len(distintas) > 0
+
+            # Alertas nuevas
+            crear = deseadas[~claves_deseadas.isin(claves_activas) & ~claves_deseadas.isin(claves_manuales)]
+            if not crear.empty:
+                agregadas.append(pd.DataFrame({
+                    'tipo_alerta': regla.tipo_alerta,
+                    'producto_id': crear['producto_id'].to_numpy(),
+                    'dispensario_id': (crear['dispensario_id'].to_numpy() if 'dispensario_id' in regla.claves
+                                       else pd.NA),
+                    'mensaje': crear['mensaje'].to_numpy(),
+                    'fecha_creacion': ahora,
+                    'estado': ACTIVA,
+                    'prioridad': crear['prioridad'].to_numpy(),
+                    'origen': AUTOMATICA,
+                }))
+            self.estado['resueltas'] += len(resolver)
+            self.estado['creadas'] += len(crear)
+            hubo_cambios |= len(resolver) > 0 or not crear.empty
+
+        if not hubo_cambios:
+            return None
+        if agregadas:
+            agregadas = pd.concat(agregadas, ignore_index=True)
+            ultimo = pd.to_numeric(nuevas['id'], errors='coerce').max() if 'id' in nuevas.columns else None
+            inicio = 1 if ultimo is None or pd.isna(ultimo) else int(ultimo) + 1
+            agregadas.insert(0, 'id', range(inicio, inicio + len(agregadas)))
+            # Etiquetas nuevas: el diario las registra como filas insertadas
+            primera = int(nuevas.index.max()) + 1 if len(nuevas.index) else 0
+            agregadas.index = range(primera, primera + len(agregadas))
+            tipos = nuevas.dtypes
+            nuevas = pd.concat([nuevas, agregadas.reindex(columns=nuevas.columns)])
+            # Las filas nuevas no tienen todas las columnas: se conservan los tipos de la hoja
+            for columna, tipo in tipos.items():
+                if nuevas[columna].dtype != tipo:
+                    try:
+                        nuevas[columna] = nuevas[columna].astype(tipo)
+                    except (TypeError, ValueError):
+                        pass
+        return nuevas
@@ -0,0 +1,409 @@
+# Libro de movimientos de inventario (event sourcing).
+# Cada ingreso, venta, traslado depósito→dispensario o ajuste se agrega como una
+# línea JSON a data/movimientos/movimientos.jsonl, que nunca se reescribe: es el
+# historial auditable del stock. Cada cierta cantidad de movimientos se guarda un
+# snapshot con el stock acumulado y la posición del archivo hasta la que llega.
+# El stock actual (o a una fecha) se calcula desde el último snapshot que sirve
+# más los movimientos posteriores, así que una consulta lee solo los movimientos
+# recientes; en el proceso, además, el stock vigente se mantiene y cada consulta
+# lee solo las líneas nuevas. Las hojas de inventario no se modifican.
+import argparse
+import json
+import os
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+from bloqueos import BloqueoArchivo, reemplazo_atomico
+
+RUTA_MOVIMIENTOS = 'data/movimientos'
+
+# Movimientos entre snapshots (configurable con CANNABIS_MOVIMIENTOS_SNAPSHOT)
+MOVIMIENTOS_POR_SNAPSHOT = 1000
+
+DEPOSITO = 'deposito'
+INGRESO = 'ingreso'
+VENTA = 'venta'
+TRASLADO = 'traslado'
+AJUSTE = 'ajuste'
+TIPOS = (INGRESO, VENTA, TRASLADO, AJUSTE)
+
+# Ventas que no descuentan stock
+ESTADOS_VENTA_ANULADA = ('Cancelada', 'Anulada')
+
+_CLAVES = ['producto_id', 'dispensario_id']
+
+
+def movimientos_por_snapshot():
+    try:
+        return max(1, int(os.environ.get('CANNABIS_MOVIMIENTOS_SNAPSHOT', MOVIMIENTOS_POR_SNAPSHOT)))
+    except ValueError:
+        return MOVIMIENTOS_POR_SNAPSHOT
+
+
+class MovimientoInvalido(ValueError):
+    pass
+
+
+# Ubicación de un movimiento: el depósito o el id de un dispensario (None: fuera del sistema)
+def _ubicacion(valor, campo):
+    if valor is None or (not isinstance(valor, str) and pd.isna(valor)):
+        return None
+    if isinstance(valor, str) and valor.strip().lower() == DEPOSITO:
+        return DEPOSITO
+    try:
+        dispensario = int(valor)
+    except (TypeError, ValueError):
+        raise MovimientoInvalido(f"{campo}: ubicación desconocida {valor!r}")
+    if dispensario != float(valor) or dispensario < 1:
+        raise MovimientoInvalido(f"{campo}: ubicación desconocida {valor!r}")
+    return dispensario
+
+
+# Valida un movimiento y lo devuelve con el formato del libro. Las ubicaciones
+# que cada tipo admite:
+#   ingreso   hacia (depósito o dispensario), cantidad positiva
+#   venta     desde un dispensario (o el depósito), cantidad positiva
+#   traslado  desde y hacia ubicaciones distintas, cantidad positiva
+#   ajuste    hacia, cantidad con signo (corrección de un conteo)
+def validar(movimiento):
+    tipo = movimiento.get('tipo')
+    if tipo not in TIPOS:
+        raise MovimientoInvalido(f"Tipo de movimiento desconocido: {tipo!r}")
+    try:
+        producto_id = int(movimiento['producto_id'])
+        cantidad = float(movimiento['cantidad'])
+    except (KeyError, TypeError, ValueError):
+        raise MovimientoInvalido("El movimiento necesita producto_id y cantidad numéricos")
+    if pd.isna(cantidad):
+        raise MovimientoInvalido("La cantidad no puede estar vacía")
+    desde = _ubicacion(movimiento.get('desde'), 'desde')
+    hacia = _ubicacion(movimiento.get('hacia'), 'hacia')
+
+    if tipo == INGRESO and (desde is not None or hacia is None):
+        raise MovimientoInvalido("Un ingreso solo tiene destino (hacia)")
+    if tipo == VENTA and (desde is None or hacia is not None):
+        raise MovimientoInvalido("Una venta solo tiene origen (desde)")
+    if tipo == TRASLADO and (desde is None or hacia is None or desde == hacia):
+        raise MovimientoInvalido("Un traslado necesita origen y destino distintos")
+    if tipo == AJUSTE and (desde is not None or hacia is None):
+        raise MovimientoInvalido("Un ajuste solo tiene la ubicación ajustada (hacia)")
+    if tipo == AJUSTE and cantidad == 0:
+        raise MovimientoInvalido("Un ajuste no puede ser de cantidad 0")
+    if tipo != AJUSTE and cantidad <= 0:
+        raise MovimientoInvalido("La cantidad tiene que ser positiva")
+
+    fecha = pd.Timestamp(movimiento.get('fecha') or datetime.now())
+    return {
+        'fecha': fecha.isoformat(),
+        'tipo': tipo,
+        'producto_id': producto_id,
+        'desde': desde,
+        'hacia': hacia,
+        'cantidad': int(cantidad) if cantidad == int(cantidad) else cantidad,
+        'referencia': movimiento.get('referencia'),
+    }
+
+
+# Ubicación del libro -> dispensario_id (vacío para el depósito)
+def _dispensario(ubicaciones):
+    return pd.to_numeric(ubicaciones.where(ubicaciones != DEPOSITO), errors='coerce').astype('Int64')
+
+
+def _stock_vacio():
+    return pd.DataFrame({
+        'producto_id': pd.Series(dtype='int64'),
+        'dispensario_id': pd.Series(dtype='Int64'),
+        'cantidad': pd.Series(dtype='float64'),
+    })
+
+
+# Cambio de stock por producto y ubicación que producen los movimientos
+def _deltas(movimientos):
+    if movimientos.empty:
+        return _stock_vacio()
+    salidas = movimientos[movimientos['desde'].notna()]
+    entradas = movimientos[movimientos['hacia'].notna()]
+    cambios = pd.concat([
+        pd.DataFrame({'producto_id': salidas['producto_id'], 'dispensario_id': _dispensario(salidas['desde']),
+                      'cantidad': -salidas['cantidad'].astype('float64')}),
+        pd.DataFrame({'producto_id': entradas['producto_id'], 'dispensario_id': _dispensario(entradas['hacia']),
+                      'cantidad': entradas['cantidad'].astype('float64')}),
+    ], ignore_index=True)
+    return cambios.groupby(_CLAVES, dropna=False, as_index=False)['cantidad'].sum()
+
+
+def _sumar(stock, deltas):
+    if deltas.empty:
+        return stock
+    if stock.empty:
+        return deltas
+    combinado = pd.concat([stock, deltas], ignore_index=True)
+    return combinado.groupby(_CLAVES, dropna=False, as_index=False)['cantidad'].sum()
+
+
+def _como_df(lineas):
+    df = pd.DataFrame(lineas, columns=['secuencia', 'fecha', 'tipo', 'producto_id', 'desde', 'hacia',
+                                       'cantidad', 'referencia'])
+    df['fecha'] = pd.to_datetime(df['fecha'], format='ISO8601')
+    # Las ubicaciones mezclan 'deposito' y números: se dejan como objetos
+    df['desde'] = df['desde'].astype(object)
+    df['hacia'] = df['hacia'].astype(object)
+    return df
+
+
+class LibroInventario:
+    def __init__(self, directorio=RUTA_MOVIMIENTOS, por_snapshot=None):
+        self.directorio = directorio
+        self.ruta = os.path.join(directorio, 'movimientos.jsonl')
+        self.ruta_snapshots = os.path.join(directorio, 'snapshots')
+        self.ruta_indice = os.path.join(self.ruta_snapshots, 'indice.json')
+        self.por_snapshot = por_snapshot or movimientos_por_snapshot()
+        self.bloqueo = BloqueoArchivo(os.path.join(directorio, '_movimientos.lock'))
+        self._lock = threading.RLock()
+        # Stock vigente: {'posicion', 'secuencia', 'fecha_maxima', 'stock'} hasta la posición leída
+        self._vigente = None
+        self._snapshots_cache = {}
+        self._referencias = (0, set())
+
+    def existe(self):
+        return os.path.exists(self.ruta) and os.path.getsize(self.ruta) > 0
+
+    # Agrega movimientos al libro (validados) y devuelve sus números de secuencia
+    def registrar(self, movimientos):
+        validados = [validar(m) for m in movimientos]
+        if not validados:
+            return []
+        with self.bloqueo, self._lock:
+            vigente = self._actualizar()
+            os.makedirs(self.directorio, exist_ok=True)
+            # Con el bloqueo tomado, lo que queda después de la última línea leída
+            # es un registro interrumpido: se descarta
+            if os.path.exists(self.ruta) and os.path.getsize(self.ruta) > vigente['posicion']:
+                with open(self.ruta, 'rb+') as f:
+                    f.truncate(vigente['posicion'])
+            inicio = vigente['secuencia'] + 1
+            with open(self.ruta, 'a', encoding='utf-8') as f:
+                for secuencia, movimiento in enumerate(validados, start=inicio):
+                    f.write(json.dumps({'secuencia': secuencia, **movimiento}, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            vigente = self._actualizar()
+            indice = self._indice()
+            ultimo = indice[-1]['secuencia'] if indice else 0
+            if vigente['secuencia'] - ultimo >= self.por_snapshot:
+                self._guardar_snapshot(vigente)
+        return list(range(inicio, inicio + len(validados)))
+
+    # Stock por producto y ubicación (dispensario_id vacío: depósito), actual o a
+    # una fecha (incluye los movimientos de ese momento)
+    def stock(self, fecha=None):
+        with self._lock:
+            if fecha is None:
+                return self._actualizar()['stock'].copy()
+            fecha = pd.Timestamp(fecha)
+            # El último snapshot cuyos movimientos son todos anteriores a la fecha
+            base = None
+            for snapshot in self._indice():
+                if snapshot['fecha_maxima'] is None or pd.Timestamp(snapshot['fecha_maxima']) <= fecha:
+                    base = snapshot
+            stock = self._leer_snapshot(base) if base is not None else _stock_vacio()
+            movimientos = self._leer_desde(base['posicion'] if base is not None else 0)[0]
+            return _sumar(stock, _deltas(movimientos[movimientos['fecha'] <= fecha]))
+
+    # Movimientos registrados (todo el libro: es la consulta de auditoría)
+    def historial(self, producto_id=None, desde_fecha=None, hasta_fecha=None):
+        movimientos = self._leer_desde(0)[0]
+        if producto_id is not None:
+            movimientos = movimientos[movimientos['producto_id'] == int(producto_id)]
+        if desde_fecha is not None:
+            movimientos = movimientos[movimientos['fecha'] >= pd.Timestamp(desde_fecha)]
+        if hasta_fecha is not None:
+            movimientos = movimientos[movimientos['fecha'] <= pd.Timestamp(hasta_fecha)]
+        return movimientos.reset_index(drop=True)
+
+    # Referencias ya registradas (para no registrar dos veces la misma venta)
+    def referencias(self):
+        with self._lock:
+            posicion, referencias = self._referencias
+            movimientos, posicion = self._leer_desde(posicion)
+            referencias = referencias | set(movimientos['referencia'].dropna())
+            self._referencias = (posicion, referencias)
+            return referencias
+
+    # Fecha del primer movimiento (el inventario inicial), o None si el libro está vacío
+    def fecha_inicio(self):
+        if not self.existe():
+            return None
+        with open(self.ruta, encoding='utf-8') as f:
+            return pd.Timestamp(json.loads(f.readline())['fecha'])
+
+    def snapshots(self):
+        return list(self._indice())
+
+    def crear_snapshot(self):
+        with self.bloqueo, self._lock:
+            return self._guardar_snapshot(self._actualizar())
+
+    # Lee las líneas nuevas y actualiza el stock vigente
+    def _actualizar(self):
+        if self._vigente is None:
+            indice = self._indice()
+            if indice:
+                ultimo = indice[-1]
+                self._vigente = {'posicion': ultimo['posicion'], 'secuencia': ultimo['secuencia'],
+                                 'fecha_maxima': ultimo['fecha_maxima'], 'stock': self._leer_snapshot(ultimo)}
+            else:
+                self._vigente = {'posicion': 0, 'secuencia': 0, 'fecha_maxima': None, 'stock': _stock_vacio()}
+        vigente = self._vigente
+        movimientos, posicion = self._leer_desde(vigente['posicion'])
+        if not movimientos.empty:
+            fecha_maxima = movimientos['fecha'].max()
+            if vigente['fecha_maxima'] is not None:
+                fecha_maxima = max(fecha_maxima, pd.Timestamp(vigente['fecha_maxima']))
+            self._vigente = vigente = {
+                'posicion': posicion,
+                'secuencia': int(movimientos['secuencia'].max()),
+                'fecha_maxima': fecha_maxima.isoformat(),
+                'stock': _sumar(vigente['stock'], _deltas(movimientos)),
+            }
+        return vigente
+
+    # Movimientos completos a partir de una posición del archivo, y la posición
+    # hasta la que se leyó (una línea sin terminar es un registro en curso)
+    def _leer_desde(self, posicion):
+        lineas = []
+        if os.path.exists(self.ruta):
+            with open(self.ruta, 'rb') as f:
+                f.seek(posicion)
+                for linea in f:
+                    if not linea.endswith(b'\n'):
+                        break
+                    posicion += len(linea)
+                    if linea.strip():
+                        lineas.append(json.loads(linea))
+        return _como_df(lineas), posicion
+
+    def _indice(self):
+        if not os.path.exists(self.ruta_indice):
+            return []
+        with open(self.ruta_indice, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _leer_snapshot(self, snapshot):
+        guardado = self._snapshots_cache.get(snapshot['archivo'])
+        if guardado is None:
+            with open(os.path.join(self.ruta_snapshots, snapshot['archivo']), encoding='utf-8') as f:
+                datos = json.load(f)
+            guardado = pd.DataFrame({
+                'producto_id': pd.Series(datos['producto_id'], dtype='int64'),
+                'dispensario_id': pd.Series(datos['dispensario_id'], dtype='Int64'),
+                'cantidad': pd.Series(datos['cantidad'], dtype='float64'),
+            })
+            self._snapshots_cache = {snapshot['archivo']: guardado}
+        return guardado.copy()
+
+    def _guardar_snapshot(self, vigente):
+        indice = self._indice()
+        if indice and indice[-1]['secuencia'] == vigente['secuencia']:
+            return indice[-1]
+        stock = vigente['stock']
+        snapshot = {
+            'archivo': f"snapshot_{vigente['secuencia']:012d}.json",
+            'secuencia': vigente['secuencia'],
+            'posicion': vigente['posicion'],
+            'fecha_maxima': vigente['fecha_maxima'],
+            'creado': datetime.now().isoformat(timespec='seconds'),
+        }
+        datos = {
+            'producto_id': [int(v) for v in stock['producto_id']],
+            'dispensario_id': [None if pd.isna(v) else int(v) for v in stock['dispensario_id']],
+            'cantidad': [float(v) for v in stock['cantidad']],
+        }
+        os.makedirs(self.ruta_snapshots, exist_ok=True)
+        reemplazo_atomico(os.path.join(self.ruta_snapshots, snapshot['archivo']),
+                          lambda temporal: _escribir_json(temporal, datos))
+        reemplazo_atomico(self.ruta_indice, lambda temporal: _escribir_json(temporal, indice + [snapshot]))
+        return snapshot
+
+
+def _escribir_json(ruta, datos):
+    with open(ruta, 'w', encoding='utf-8') as f:
+        json.dump(datos, f, ensure_ascii=False)
+
+
+# Ajustes que llevan el libro vacío al stock de las hojas de inventario
+def movimientos_iniciales(deposito, dispensario, fecha=None):
+    movimientos = []
+    for df, con_dispensario in ((deposito, False), (dispensario, True)):
+        if df is None or 'producto_id' not in df.columns or 'cantidad' not in df.columns:
+            continue
+        columnas = ['producto_id', 'cantidad'] + (['dispensario_id'] if con_dispensario else [])
+        if any(c not in df.columns for c in columnas):
+            continue
+        filas = df[columnas].dropna()
+        filas = filas[filas['cantidad'] != 0]
+        for fila in filas.itertuples(index=False):
+            movimientos.append({
+                'fecha': fecha, 'tipo': AJUSTE, 'producto_id': fila.producto_id,
+                'hacia': fila.dispensario_id if con_dispensario else DEPOSITO,
+                'cantidad': fila.cantidad, 'referencia': 'Inventario inicial',
+            })
+    return movimientos
+
+
+# Movimientos de venta de las líneas de Detalle_Venta que todavía no están en
+# el libro (`registradas` son las referencias ya registradas). Las ventas hasta
+# `desde` ya están descontadas en el inventario inicial del libro.
+def movimientos_de_ventas(ventas, detalle, registradas=(), desde=None):
+    columnas = {'id', 'venta_id', 'producto_id', 'cantidad'}
+    if ventas is None or detalle is None or not columnas <= set(detalle.columns):
+        return []
+    cabeceras = ventas[[c for c in ('id', 'dispensario_id', 'fecha_venta', 'estado') if c in ventas.columns]]
+    if 'dispensario_id' not in cabeceras.columns:
+        return []
+    if 'estado' in cabeceras.columns:
+        cabeceras = cabeceras[~cabeceras['estado'].astype(object).isin(ESTADOS_VENTA_ANULADA)]
+    if desde is not None and 'fecha_venta' in cabeceras.columns:
+        cabeceras = cabeceras[cabeceras['fecha_venta'] > desde]
+    lineas = detalle[list(columnas)].merge(cabeceras, left_on='venta_id', right_on='id', suffixes=('', '_venta'))
+    lineas = lineas.dropna(subset=['producto_id', 'cantidad', 'dispensario_id'])
+    lineas = lineas[lineas['cantidad'] > 0]
+    referencias = 'Detalle_Venta:' + lineas['id'].astype('int64').astype(str)
+    nuevas = ~referencias.isin(set(registradas))
+    lineas, referencias = lineas[nuevas], referencias[nuevas]
+    fechas = lineas['fecha_venta'] if 'fecha_venta' in lineas.columns else pd.Series(None, index=lineas.index)
+    return [
+        {'fecha': None if pd.isna(fecha) else fecha, 'tipo': VENTA, 'producto_id': producto,
+         'desde': dispensario, 'cantidad': cantidad, 'referencia': referencia}
+        for producto, dispensario, cantidad, fecha, referencia in zip(
+            lineas['producto_id'], lineas['dispensario_id'], lineas['cantidad'], fechas, referencias)
+    ]
+
+
+if __name__ == '__main__':
+    from almacenamiento import crear_almacen
+    from esquemas import Tipado
+
+    parser = argparse.ArgumentParser(description="Libro de movimientos de inventario")
+    parser.add_argument('accion', choices=['inicializar', 'ventas', 'stock', 'snapshot'])
+    parser.add_argument('--fecha', help="Fecha del stock (por defecto, el actual)")
+    parser.add_argument('--directorio', default=RUTA_MOVIMIENTOS)
+    args = parser.parse_args()
+
+    libro = LibroInventario(args.directorio)
+    if args.accion == 'stock':
+        print(libro.stock(args.fecha).to_string(index=False))
+    elif args.accion == 'snapshot':
+        print(f"Snapshot hasta el movimiento {libro.crear_snapshot()['secuencia']}")
+    else:
+        almacen = crear_almacen(preparar=Tipado())
+        if args.accion == 'inicializar':
+            if libro.existe():
+                parser.error("El libro ya tiene movimientos")
+            nuevos = movimientos_iniciales(almacen.leer('Inventario_Deposito'), almacen.leer('Inventario_Dispensario'))
+        else:
+            nuevos = movimientos_de_ventas(almacen.leer('Ventas'), almacen.leer('Detalle_Venta'),
+                                           libro.referencias(), libro.fecha_inicio())
+        print(f"{len(libro.registrar(nuevos))} movimientos registrados")
@@ -0,0 +1,146 @@
+# Registro perezoso de los conjuntos de datos de la app.
+# Cada hoja disponible (del almacén por defecto o de un archivo subido) se
+# registra con una función que la carga, pero no se lee hasta que una pestaña
+# la pide. Lo ya cargado se conserva durante la ejecución; entre reruns lo
+# conserva la caché de libros / del almacén que usa cada función de carga.
+# Las hojas se resuelven por nombre con un índice {hoja: claves}; si varias
+# fuentes tienen una hoja con el mismo nombre gana la de mayor prioridad (ver
+# catalogo.prioridad) y, a igual prioridad, la registrada primero.
+from metricas import tramo
+
+
+class FuenteDatos:
+    def __init__(self, clave, hoja, cargar, firma=None, origen=None, ruta_parquet=None, prioridad=0):
+        self.clave = clave
+        self.hoja = hoja
+        self.prioridad = prioridad
+        # cargar(columnas, filtros) -> DataFrame (None para todas las columnas / filas)
+        self.cargar = cargar
+        # firma() -> identifica la versión de los datos sin cargarlos
+        self.firma = firma
+        # Libro Excel del que sale la hoja, para parsear varias en paralelo
+        self.origen = origen
+        # ruta_parquet() -> archivo Parquet con los datos vigentes, si lo hay
+        # (el motor SQL lo consulta sin cargarlo)
+        self.ruta_parquet = ruta_parquet
+
+
+class RegistroDatos:
+    # `precargar(fuentes)` se llama antes de cargar varias hojas a la vez
+    # (por ejemplo, para parsearlas en paralelo)
+    def __init__(self, precargar=None):
+        self.precargar = precargar
+        self._fuentes = {}
+        self._cargados = {}
+        # nombre de hoja -> claves con esa hoja, de mayor a menor prioridad
+        self._por_hoja = {}
+
+    def registrar(self, clave, hoja, cargar, firma=None, origen=None, ruta_parquet=None, prioridad=0):
+        anterior = self._fuentes.get(clave)
+        if anterior is not None:
+            self._por_hoja[anterior.hoja].remove(clave)
+        self._fuentes[clave] = FuenteDatos(clave, hoja, cargar, firma, origen, ruta_parquet, prioridad)
+        candidatas = self._por_hoja.setdefault(hoja, [])
+        candidatas.append(clave)
+        # El orden es estable: a igual prioridad queda primero la registrada antes
+        candidatas.sort(key=lambda c: -self._fuentes[c].prioridad)
+
+    def claves(self):
+        return list(self._fuentes.keys())
+
+    def fuente(self, clave):
+        return self._fuentes.get(clave)
+
+    # Clave del conjunto de datos de una hoja: la clave misma o, por el nombre
+    # de la hoja, la fuente que tiene precedencia
+    def resolver(self, nombre_hoja):
+        if nombre_hoja in self._fuentes:
+            return nombre_hoja
+        candidatas = self._por_hoja.get(nombre_hoja)
+        return candidatas[0] if candidatas else None
+
+    # Claves de todas las fuentes con una hoja de ese nombre, la que se usa primero
+    def candidatas(self, nombre_hoja):
+        return list(self._por_hoja.get(nombre_hoja, []))
+
+    def disponible(self, nombre_hoja):
+        return self.resolver(nombre_hoja) is not None
+
+    # Firma de la versión de una hoja sin cargarla (None si no se puede saber)
+    def firma(self, nombre_hoja):
+        clave = self.resolver(nombre_hoja)
+        if clave is None or self._fuentes[clave].firma is None:
+            return None
+        return self._fuentes[clave].firma()
+
+    # Carga (una sola vez por ejecución) el conjunto de datos `clave`.
+    # `filtros` son predicados [(columna, operador, valor), ...] que el origen
+    # aplica al leer (ver filtros.py).
+    def cargar(self, clave, columnas=None, filtros=None):
+        fuente = self._fuentes.get(clave)
+        if fuente is None:
+            return None
+        llave = _llave(clave, columnas, filtros)
+        if llave not in self._cargados:
+            # Si la hoja completa ya está cargada, no hace falta volver a leerla
+            completa = self._cargados.get(_llave(clave, None, filtros))
+            if completa is not None and columnas is not None:
+                self._cargados[llave] = completa[[c for c in columnas if c in completa.columns]]
+            else:
+                with tramo(f"carga/{clave}") as medicion:
+                    df = fuente.cargar(columnas, filtros)
+                    if df is not None:
+                        medicion.agregar_filas(len(df))
+                self._cargados[llave] = df
+        return self._cargados[llave]
+
+    def obtener(self, nombre_hoja, columnas=None, filtros=None):
+        clave = self.resolver(nombre_hoja)
+        if clave is None:
+            return None
+        return self.cargar(clave, columnas, filtros)
+
+    # Declara las hojas que necesita una pestaña y las carga todas juntas.
+    # `hojas` es {nombre_hoja: columnas} (columnas=None para todas); devuelve
+    # {nombre_hoja: DataFrame o None}. Si se pasa `al_fallar(nombre_hoja, error)`,
+    # una hoja que no se puede cargar queda en None en lugar de cortar la pestaña.
+    # `filtros` es {nombre_hoja: predicados} para las hojas que se leen filtradas.
+    def requerir(self, hojas, al_fallar=None, filtros=None):
+        filtros = filtros or {}
+        pedidos = [
+            (nombre_hoja, self.resolver(nombre_hoja), columnas, filtros.get(nombre_hoja))
+            for nombre_hoja, columnas in hojas.items()
+        ]
+        return self._cargar_juntas(pedidos, al_fallar)
+
+    # Carga todos los conjuntos de datos registrados: {clave: DataFrame o None}
+    def cargar_todas(self, al_fallar=None):
+        return self._cargar_juntas([(clave, clave, None, None) for clave in self._fuentes], al_fallar)
+
+    def _cargar_juntas(self, pedidos, al_fallar):
+        pendientes = [
+            self._fuentes[clave] for _, clave, columnas, filtros in pedidos
+            if clave is not None and _llave(clave, None, filtros) not in self._cargados
+            and _llave(clave, columnas, filtros) not in self._cargados
+        ]
+        if self.precargar is not None and len(pendientes) > 1:
+            with tramo("carga/paralela"):
+                self.precargar(pendientes)
+        datos = {}
+        for nombre, clave, columnas, filtros in pedidos:
+            try:
+                datos[nombre] = self.cargar(clave, columnas, filtros) if clave is not None else None
+            except Exception as e:
+                if al_fallar is None:
+                    raise
+                al_fallar(nombre, e)
+                datos[nombre] = None
+        return datos
+
+
+def _llave(clave, columnas, filtros):
+    return (
+        clave,
+        tuple(columnas) if columnas is not None else None,
+        tuple(filtros) if filtros else None,
+    )
@@ -0,0 +1,62 @@
+# Cálculos de los reportes que muestra el tablero (Resumen, Inventario y Ventas)
+# y que también expone la API (ver api.py). Reciben los agregados del resumen,
+# los índices de dimensiones o un MotorConsultas ya armado, así que no cargan
+# datos por su cuenta: cada quien los lee y los mantiene en memoria a su manera.
+
+# Hojas que cada consulta necesita registradas en el motor
+HOJAS_TOP_CLIENTES = ['Ventas', 'Clientes']
+HOJAS_STOCK_CRITICO = ['Inventario_Dispensario', 'Productos', 'Dispensarios']
+
+SQL_TOP_CLIENTES = """
+    SELECT c.nombre, c.apellido, c.nombre || ' ' || c.apellido AS nombre_completo,
+           SUM(v.total) AS total
+    FROM Ventas v
+    JOIN Clientes c ON c.id = v.cliente_id
+    WHERE c.nombre IS NOT NULL AND c.apellido IS NOT NULL
+    GROUP BY c.nombre, c.apellido
+    ORDER BY total DESC, c.nombre, c.apellido
+    LIMIT ?
+"""
+
+SQL_STOCK_CRITICO = """
+    SELECT d.nombre AS nombre_dispensario, p.nombre AS nombre_producto, i.cantidad, i.stock_minimo
+    FROM Inventario_Dispensario i
+    JOIN Productos p ON p.id = i.producto_id
+    JOIN Dispensarios d ON d.id = i.dispensario_id
+    WHERE i.cantidad <= i.stock_minimo
+    ORDER BY i.id
+"""
+
+
+def puede_top_clientes(motor):
+    return motor.tiene('Ventas', 'cliente_id') and motor.tiene('Clientes')
+
+
+def top_clientes(motor, cantidad=5):
+    return motor.consultar(SQL_TOP_CLIENTES, [int(cantidad)])
+
+
+def puede_stock_critico(motor):
+    return all(motor.tiene(hoja) for hoja in HOJAS_STOCK_CRITICO)
+
+
+def stock_critico(motor):
+    return motor.consultar(SQL_STOCK_CRITICO)
+
+
+# Total vendido por nombre de dispensario (los dispensarios con el mismo nombre se suman)
+def ventas_por_dispensario(agregados, indice_dispensarios):
+    total_por_dispensario = agregados.ventas_por_dispensario().reset_index()
+    ventas_dispensario = indice_dispensarios.anexar(
+        total_por_dispensario, 'dispensario_id', {'nombre': 'nombre'})
+    return ventas_dispensario.groupby('nombre')['total'].sum().reset_index()
+
+
+# Los productos más vendidos (por cantidad), con su nombre
+def top_productos(agregados, indice_productos, cantidad=5):
+    cantidad_por_producto = agregados.cantidad_por_producto()
+    nombres = indice_productos.valores(cantidad_por_producto.index, 'nombre')
+    conocidos = nombres.notna().to_numpy()
+    return (cantidad_por_producto[conocidos]
+            .groupby(nombres[conocidos].to_numpy()).sum()
+            .nlargest(cantidad).rename_axis('nombre').reset_index())
@@ -0,0 +1,81 @@
+# Tablas paginadas.
+# La búsqueda, el orden y el corte en páginas se hacen en el servidor sobre la
+# hoja completa, y al navegador solo se envía la página visible. El editor
+# también trabaja sobre una página, leída sola del almacén: sus cambios se
+# combinan con la hoja completa al guardar, y el diario guarda solo las filas
+# que cambiaron.
+import math
+
+import numpy as np
+import pandas as pd
+
+FILAS_POR_PAGINA = 50
+
+
+def cantidad_paginas(total_filas, filas_por_pagina=FILAS_POR_PAGINA):
+    return max(math.ceil(total_filas / filas_por_pagina), 1)
+
+
+# Filas con alguna celda que contiene `texto` (sin distinguir mayúsculas)
+def buscar(df, texto):
+    if not texto:
+        return df
+    coincide = np.zeros(len(df), dtype=bool)
+    for columna in df.columns:
+        valores = df[columna]
+        if isinstance(valores.dtype, pd.CategoricalDtype):
+            # Se busca en las categorías y se marca por código, sin convertir cada fila
+            en_categoria = valores.cat.categories.astype(str).str.contains(texto, case=False, regex=False)
+            codigos = valores.cat.codes.to_numpy()
+            coincide |= (codigos >= 0) & np.asarray(en_categoria)[codigos]
+        else:
+            coincide |= valores.astype(str).str.contains(texto, case=False, regex=False).to_numpy(dtype=bool, na_value=False)
+    return df[coincide]
+
+
+def ordenar(df, columna, ascendente=True):
+    if columna is None or columna not in df.columns:
+        return df
+    return df.sort_values(columna, ascending=ascendente, kind='stable', na_position='last')
+
+
+# Filas de la página `numero` (desde 1); fuera de rango se usa la última página
+def pagina(df, numero, filas_por_pagina=FILAS_POR_PAGINA):
+    numero = min(max(int(numero), 1), cantidad_paginas(len(df), filas_por_pagina))
+    inicio = (numero - 1) * filas_por_pagina
+    return df.iloc[inicio:inicio + filas_por_pagina]
+
+
+# Hoja completa con los cambios hechos en una página del editor.
+# `etiquetas_pagina` son las etiquetas de las filas que se mostraron; las que
+# faltan en `editado_pagina` se eliminaron y las que no estaban son filas nuevas.
+def combinar_pagina(completo, etiquetas_pagina, editado_pagina):
+    originales = completo.loc[etiquetas_pagina]
+    if editado_pagina.equals(originales):
+        resultado = completo.copy(deep=False)
+        resultado.attrs = {}
+        return resultado
+
+    es_nueva = editado_pagina.index.isna() | ~editado_pagina.index.isin(etiquetas_pagina)
+    conservadas = editado_pagina[~es_nueva]
+    nuevas = editado_pagina[es_nueva]
+    eliminadas = etiquetas_pagina.difference(conservadas.index)
+
+    # Columnas agregadas en la página: vacías en las demás filas
+    columnas = list(editado_pagina.columns)
+    resultado = completo.drop(index=eliminadas)
+    if list(resultado.columns) != columnas:
+        resultado = resultado.reindex(columns=columnas)
+    if not conservadas.empty:
+        orden = resultado.index
+        resultado = pd.concat([resultado.drop(index=conservadas.index), conservadas]).reindex(orden)
+    if not nuevas.empty:
+        # El editor numera las filas nuevas a partir de la página; se renumeran
+        # después de la última fila de la hoja para no chocar con otras páginas
+        inicio = int(completo.index.max()) + 1 if len(completo.index) else 0
+        nuevas = nuevas.copy(deep=False)
+        nuevas.index = pd.RangeIndex(inicio, inicio + len(nuevas))
+        resultado = pd.concat([resultado, nuevas])
+    # Es una versión nueva: no conserva la versión de caché de la hoja original
+    resultado.attrs = {}
+    return resultado
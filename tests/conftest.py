@@ -0,0 +1,20 @@
+# Configuración común de las pruebas: los módulos del sistema están en la raíz
+# del repositorio y se importan sin instalar nada.
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# Almacén Parquet con diario en un directorio temporal
+@pytest.fixture
+def almacen(tmp_path):
+    pytest.importorskip('pyarrow')
+    from almacenamiento import AlmacenParquet
+    from cache_libros import CacheLibros
+    from diario import AlmacenConDiario
+
+    base = AlmacenParquet(str(tmp_path / 'parquet'), cache=CacheLibros(10 ** 8))
+    return AlmacenConDiario(base, str(tmp_path / 'parquet' / '_diario.jsonl'), maximo_registros=100)
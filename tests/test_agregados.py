@@ -0,0 +1,155 @@
+import pandas as pd
+import pytest
+
+from agregados import AgregadosResumen
+
+
+def _ventas():
+    return pd.DataFrame({
+        'id': [1, 2, 3, 4],
+        'dispensario_id': pd.array([1, 2, 1, 1], dtype='Int64'),
+        'fecha_venta': pd.to_datetime(['2024-01-01 10:00', '2024-01-01 12:00', '2024-01-02 09:00',
+                                       '2024-01-02 15:00']),
+        'total': [100.0, 50.0, None, 25.0],
+    })
+
+
+def _detalle():
+    return pd.DataFrame({'id': [1, 2, 3], 'venta_id': [1, 1, 2], 'producto_id': [1, 2, 1],
+                         'cantidad': [2.0, 1.0, 3.0]})
+
+
+def _hojas():
+    return {
+        'ventas': _ventas(),
+        'productos': _detalle(),
+        'alertas': pd.DataFrame({'estado': ['Activa', 'Activa', 'Resuelta'],
+                                 'prioridad': ['Alta', 'Critica', 'Alta']}),
+        'stock': pd.DataFrame({'cantidad': [1, 10, 5], 'stock_minimo': [5, 5, 5]}),
+    }
+
+
+def _agregados(ruta=None, hojas=None):
+    hojas = hojas or _hojas()
+    leidas = []
+    agregados = AgregadosResumen(ruta)
+
+    def leer(parte):
+        leidas.append(parte)
+        return hojas[parte]
+    agregados.sincronizar({parte: ('v', 1) for parte in hojas}, leer)
+    return agregados, leidas
+
+
+def _ventas_por_dia(agregados):
+    return dict(zip(agregados.ventas_por_dia()['fecha_venta'].astype(str), agregados.ventas_por_dia()['total']))
+
+
+def test_calcula_las_partes_desde_las_hojas():
+    agregados, leidas = _agregados()
+
+    assert sorted(leidas) == ['alertas', 'productos', 'stock', 'ventas']
+    assert agregados.total_ventas() == 175.0
+    assert agregados.ventas_en_fecha('2024-01-02') == 2
+    assert _ventas_por_dia(agregados) == {'2024-01-01': 150.0, '2024-01-02': 25.0}
+    assert agregados.ventas_por_dispensario().to_dict() == {1: 125.0, 2: 50.0}
+    assert agregados.cantidad_por_producto().to_dict() == {1: 5.0, 2: 1.0}
+    assert agregados.alertas == {'por_estado': {'Activa': 2, 'Resuelta': 1},
+                                 'activas_por_prioridad': {'Alta': 1, 'Critica': 1}}
+    assert agregados.stock == 2
+
+
+def test_misma_firma_no_vuelve_a_leer():
+    agregados, leidas = _agregados()
+    agregados.sincronizar({'ventas': ('v', 1), 'stock': ('v', 2)}, lambda parte: leidas.append(parte) or _hojas()[parte])
+    assert leidas[4:] == ['stock']
+
+
+def test_delta_de_ventas_igual_al_recalculo():
+    agregados, _ = _agregados()
+    original = _ventas()
+    editado = original.drop(index=[1])
+    editado.loc[2, 'total'] = 40.0
+    editado.loc[3, 'fecha_venta'] = pd.Timestamp('2024-01-03')
+    editado = pd.concat([editado, pd.DataFrame({'id': [5], 'dispensario_id': pd.array([2], dtype='Int64'),
+                                                'fecha_venta': [pd.Timestamp('2024-01-01')],
+                                                'total': [5.0]}, index=[4])])
+
+    agregados.registrar_guardado('Ventas', {'ventas': ('v', 1)}, {'ventas': ('v', 2)}, original, editado)
+    recalculado, _ = _agregados(hojas={**_hojas(), 'ventas': editado})
+
+    assert agregados.firmas['ventas'] == ['v', 2]
+    assert agregados.total_ventas() == recalculado.total_ventas() == 170.0
+    assert _ventas_por_dia(agregados) == _ventas_por_dia(recalculado)
+    assert agregados.ventas_por_dispensario().to_dict() == recalculado.ventas_por_dispensario().to_dict()
+    assert agregados.ventas_en_fecha('2024-01-02') == recalculado.ventas_en_fecha('2024-01-02') == 1
+
+
+def test_delta_de_productos_igual_al_recalculo():
+    agregados, _ = _agregados()
+    original = _detalle()
+    editado = original.copy()
+    editado.loc[0, 'cantidad'] = 10.0
+    editado.loc[2, 'producto_id'] = 2
+
+    agregados.registrar_guardado('Detalle_Venta', {'productos': ('v', 1)}, {'productos': ('v', 2)},
+                                 original, editado)
+
+    assert agregados.cantidad_por_producto().to_dict() == {1: 10.0, 2: 4.0}
+
+
+def test_guardado_sobre_otra_version_obliga_a_recalcular():
+    agregados, _ = _agregados()
+    original = _ventas()
+    agregados.registrar_guardado('Ventas', {'ventas': ('v', 0)}, {'ventas': ('v', 2)}, original, original)
+    assert agregados.firmas['ventas'] == ['v', 1]
+
+    # Guardado sin filas (por ejemplo, columnas distintas): la parte se descarta
+    agregados.registrar_guardado('Ventas', {'ventas': ('v', 1)}, {'ventas': ('v', 2)},
+                                 original, original.drop(columns=['total']))
+    assert 'ventas' not in agregados.firmas
+
+
+def test_otras_hojas_solo_actualizan_la_firma():
+    agregados, _ = _agregados()
+    firmas_antes = {'ventas': ('v', 1), 'alertas': ('v', 1)}
+    agregados.registrar_guardado('Productos', firmas_antes, {'ventas': ('v', 5), 'alertas': ('v', 1)})
+    assert agregados.firmas['ventas'] == ['v', 5]
+    assert agregados.total_ventas() == 175.0
+
+
+def test_se_guardan_y_se_recuperan(tmp_path):
+    ruta = str(tmp_path / 'agregados.json')
+    agregados, _ = _agregados(ruta)
+
+    cargados = AgregadosResumen(ruta)
+
+    assert cargados.firmas == agregados.firmas
+    assert cargados.total_ventas() == 175.0
+    assert _ventas_por_dia(cargados) == _ventas_por_dia(agregados)
+    assert cargados.cantidad_por_producto().to_dict() == {1: 5.0, 2: 1.0}
+    assert cargados.stock == 2
+    leidas = []
+    cargados.sincronizar({parte: ('v', 1) for parte in _hojas()}, leidas.append)
+    assert leidas == []
+
+
+def test_archivo_danado_se_ignora(tmp_path):
+    ruta = tmp_path / 'agregados.json'
+    ruta.write_text('{"ventas": ', encoding='utf-8')
+    agregados = AgregadosResumen(str(ruta))
+    assert agregados.firmas == {}
+    assert agregados.total_ventas() == pytest.approx(0.0)
+
+
+def test_disponible_segun_las_columnas_de_la_hoja(tmp_path):
+    agregados = AgregadosResumen(str(tmp_path / 'agregados.json'))
+    assert not agregados.disponible('ventas')
+    hojas = {'ventas': pd.DataFrame({'fecha_venta': pd.to_datetime(['2024-01-01']), 'total': [10.0]}),
+             'stock': pd.DataFrame({'cantidad': [1]})}
+    agregados.sincronizar({'ventas': ['v', 1], 'stock': ['s', 1]}, hojas.get)
+    assert agregados.disponible('ventas')
+    assert not agregados.disponible('stock')
+
+    cargados = AgregadosResumen(str(tmp_path / 'agregados.json'))
+    assert cargados.disponible('ventas') and not cargados.disponible('stock')
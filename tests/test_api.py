@@ -0,0 +1,138 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pandas as pd
+import pytest
+
+from api import ErrorPedido, ServicioReportes, crear_servidor
+
+
+# Almacén en memoria: la firma de cada hoja cambia con cada guardado
+class AlmacenMemoria:
+    def __init__(self, hojas):
+        self.datos = dict(hojas)
+        self.versiones = {hoja: 1 for hoja in hojas}
+        self.lecturas = 0
+
+    def firma(self, hoja):
+        return (hoja, self.versiones[hoja]) if hoja in self.datos else None
+
+    def leer(self, hoja):
+        self.lecturas += 1
+        return self.datos.get(hoja)
+
+    def ruta_parquet(self, hoja):
+        return None
+
+    def guardar(self, hoja, df):
+        self.datos[hoja] = df
+        self.versiones[hoja] = self.versiones.get(hoja, 0) + 1
+
+
+def _hojas():
+    return {
+        'Ventas': pd.DataFrame({
+            'id': [1, 2, 3],
+            'cliente_id': [1, 2, 1],
+            'dispensario_id': [1, 2, 1],
+            'fecha_venta': pd.to_datetime(['2024-01-01', '2024-01-01', '2024-01-02']),
+            'total': [100.0, 50.0, 25.0],
+        }),
+        'Clientes': pd.DataFrame({'id': [1, 2], 'nombre': ['Ana', 'Luis'], 'apellido': ['Pérez', 'Gómez']}),
+        'Dispensarios': pd.DataFrame({'id': [1, 2], 'nombre': ['Centro', 'Norte']}),
+    }
+
+
+@pytest.fixture
+def servicio():
+    return ServicioReportes(AlmacenMemoria(_hojas()))
+
+
+def _json(cuerpo):
+    return json.loads(cuerpo.decode('utf-8'))
+
+
+def test_reportes_de_ventas(servicio):
+    assert _json(servicio.responder('/ventas/total')[1]) == {'total_ventas': 175.0}
+    assert _json(servicio.responder('/ventas/por_dia')[1]) == [
+        {'fecha_venta': '2024-01-01T00:00:00.000', 'total': 150.0},
+        {'fecha_venta': '2024-01-02T00:00:00.000', 'total': 25.0},
+    ]
+    por_dispensario = _json(servicio.responder('/ventas/por_dispensario')[1])
+    assert {d['nombre']: d['total'] for d in por_dispensario} == {'Centro': 125.0, 'Norte': 50.0}
+
+
+def test_top_clientes_con_parametro(servicio):
+    top = _json(servicio.responder('/clientes/top', 'n=1')[1])
+    assert [(c['nombre_completo'], c['total']) for c in top] == [('Ana Pérez', 125.0)]
+
+
+def test_etag_estable_y_respuesta_no_modificada(servicio):
+    etag, cuerpo = servicio.responder('/ventas/total')
+    lecturas = servicio.almacen.lecturas
+
+    assert servicio.responder('/ventas/total') == (etag, cuerpo)
+    assert servicio.responder('/ventas/total', si_no_coincide=etag) == (etag, None)
+    assert servicio.responder('/ventas/total', si_no_coincide=f'"otro", {etag}') == (etag, None)
+    # Ni la respuesta guardada ni el 304 vuelven a leer las hojas
+    assert servicio.almacen.lecturas == lecturas
+
+
+def test_etag_cambia_con_la_hoja(servicio):
+    etag, _ = servicio.responder('/ventas/total')
+    ventas = _hojas()['Ventas']
+    ventas.loc[0, 'total'] = 10.0
+    servicio.almacen.guardar('Ventas', ventas)
+
+    nuevo, cuerpo = servicio.responder('/ventas/total', si_no_coincide=etag)
+    assert nuevo != etag
+    assert _json(cuerpo) == {'total_ventas': 85.0}
+
+
+def test_etag_depende_de_los_parametros(servicio):
+    assert servicio.responder('/clientes/top', 'n=1')[0] != servicio.responder('/clientes/top', 'n=2')[0]
+    # Los parámetros no admitidos no cambian la respuesta
+    assert servicio.responder('/ventas/total', 'x=1')[0] == servicio.responder('/ventas/total')[0]
+
+
+@pytest.mark.parametrize('consulta', ['n=cero', 'n=0', 'n=1000'])
+def test_parametro_invalido_es_400(servicio, consulta):
+    with pytest.raises(ErrorPedido) as error:
+        servicio.responder('/clientes/top', consulta)
+    assert error.value.estado == 400
+
+
+def test_ruta_o_datos_inexistentes_es_404(servicio):
+    with pytest.raises(ErrorPedido) as error:
+        servicio.responder('/no/existe')
+    assert error.value.estado == 404
+    with pytest.raises(ErrorPedido) as error:
+        servicio.responder('/inventario/stock_critico')
+    assert error.value.estado == 404
+
+
+def test_servidor_http(servicio):
+    servidor = crear_servidor(servicio, puerto=0)
+    hilo = threading.Thread(target=servidor.serve_forever, daemon=True)
+    hilo.start()
+    base = f'http://127.0.0.1:{servidor.server_address[1]}'
+    try:
+        with urllib.request.urlopen(base + '/ventas/total/') as respuesta:
+            etag = respuesta.headers['ETag']
+            assert respuesta.status == 200
+            assert json.load(respuesta) == {'total_ventas': 175.0}
+
+        pedido = urllib.request.Request(base + '/ventas/total', headers={'If-None-Match': etag})
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(pedido)
+        assert error.value.code == 304
+
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(base + '/clientes/top?n=x')
+        assert error.value.code == 400
+        assert 'error' in json.load(error.value)
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
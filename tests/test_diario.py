@@ -0,0 +1,247 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from bloqueos import VersionObsoleta
+from diario import aplicar_registro, calcular_cambios, mismos_datos
+
+
+def _productos():
+    return pd.DataFrame({
+        'id': [1, 2, 3],
+        'nombre': ['Aceite', 'Flor', 'Crema'],
+        'categoria': pd.Categorical(['Aceites', 'Flores', 'Tópicos']),
+        'precio': [10.0, 20.0, 30.0],
+        'fecha_alta': pd.to_datetime(['2024-01-01', '2024-02-01', '2024-03-01']),
+    })
+
+
+def test_calcular_cambios_separa_insertadas_actualizadas_y_eliminadas():
+    original = _productos()
+    editado = original.drop(index=[0])
+    editado.loc[1, 'precio'] = 25.0
+    editado = pd.concat([editado, original.iloc[[2]].rename(index={2: None})])
+
+    cambios = calcular_cambios(original, editado)
+
+    assert cambios['eliminados'] == [0]
+    assert list(cambios['actualizados'].index) == [1]
+    assert len(cambios['insertados']) == 1
+
+
+def test_calcular_cambios_sin_diferencias_con_vacios():
+    original = _productos()
+    original.loc[1, 'precio'] = None
+    cambios = calcular_cambios(original, original.copy())
+    assert cambios['insertados'].empty and cambios['actualizados'].empty and not cambios['eliminados']
+
+
+def test_calcular_cambios_con_otras_columnas_devuelve_none():
+    original = _productos()
+    assert calcular_cambios(original, original.drop(columns=['precio'])) is None
+
+
+def test_mismos_datos_ignora_categorias_distintas():
+    original = _productos()
+    editado = original.copy()
+    editado['categoria'] = editado['categoria'].astype(object)
+    assert mismos_datos(original, editado)
+    editado.loc[0, 'nombre'] = 'Otro'
+    assert not mismos_datos(original, editado)
+
+
+def test_aplicar_registro_conserva_orden_y_tipos():
+    df = _productos()
+    registro = {
+        'eliminados': [0],
+        'actualizados': [{'_fila': 2, 'id': 3, 'nombre': 'Crema', 'categoria': 'Cremas',
+                          'precio': 35.0, 'fecha_alta': '2024-03-01T00:00:00.000000000'}],
+        'insertados': [{'_fila': 3, 'id': 4, 'nombre': 'Gotas', 'categoria': 'Aceites',
+                        'precio': 15.0, 'fecha_alta': '2024-04-01T00:00:00.000000000'}],
+    }
+
+    resultado = aplicar_registro(df, registro)
+
+    assert list(resultado.index) == [1, 2, 3]
+    assert resultado.loc[2, 'precio'] == 35.0
+    assert isinstance(resultado['categoria'].dtype, pd.CategoricalDtype)
+    assert 'Cremas' in resultado['categoria'].cat.categories
+    assert pd.api.types.is_datetime64_any_dtype(resultado['fecha_alta'])
+    assert resultado.loc[3, 'fecha_alta'] == pd.Timestamp('2024-04-01')
+
+
+def test_guardar_cambios_agrega_solo_las_filas_cambiadas(almacen):
+    almacen.escribir('Productos', _productos())
+    original = almacen.leer('Productos')
+    editado = original.copy()
+    editado.loc[1, 'precio'] = 22.0
+
+    almacen.guardar_cambios('Productos', original, editado)
+
+    registros = almacen.registros()
+    assert len(registros) == 1
+    assert [f['_fila'] for f in registros[0]['actualizados']] == [1]
+    assert registros[0]['insertados'] == [] and registros[0]['eliminados'] == []
+    assert almacen.pendientes('Productos') == 1
+    assert almacen.leer('Productos').loc[1, 'precio'] == 22.0
+
+
+def test_guardar_cambios_sin_diferencias_no_escribe(almacen):
+    almacen.escribir('Productos', _productos())
+    original = almacen.leer('Productos')
+    almacen.guardar_cambios('Productos', original, original.copy())
+    assert almacen.registros() == []
+
+
+def test_filas_insertadas_no_repiten_etiquetas(almacen):
+    almacen.escribir('Productos', _productos())
+    for numero in (4, 5):
+        original = almacen.leer('Productos')
+        nueva = pd.DataFrame({'id': [numero], 'nombre': [f'Nuevo {numero}'], 'categoria': ['Flores'],
+                              'precio': [1.0], 'fecha_alta': [pd.Timestamp('2024-05-01')]})
+        # El editor numera las filas nuevas desde 0: pueden chocar con las existentes
+        almacen.guardar_cambios('Productos', original, pd.concat([original, nueva]))
+
+    df = almacen.leer('Productos')
+    assert list(df.index) == [0, 1, 2, 3, 4]
+    assert list(df['id']) == [1, 2, 3, 4, 5]
+
+
+def test_version_obsoleta_si_la_hoja_cambio(almacen):
+    almacen.escribir('Productos', _productos())
+    original = almacen.leer('Productos')
+    otro = original.copy()
+    otro.loc[0, 'precio'] = 11.0
+    almacen.guardar_cambios('Productos', original, otro)
+
+    editado = original.copy()
+    editado.loc[2, 'precio'] = 33.0
+    with pytest.raises(VersionObsoleta):
+        almacen.guardar_cambios('Productos', original, editado)
+
+
+def test_compactar_conserva_datos_y_tipos(almacen):
+    almacen.escribir('Productos', _productos())
+    original = almacen.leer('Productos')
+    editado = original.drop(index=[0])
+    editado.loc[2, 'categoria'] = 'Flores'
+    almacen.guardar_cambios('Productos', original, editado)
+
+    antes = almacen.leer('Productos')
+    almacen.compactar()
+    despues = almacen.leer('Productos')
+
+    assert almacen.registros() == []
+    assert not os.path.exists(almacen.ruta_diario)
+    assert list(despues['id']) == [2, 3]
+    assert despues.dtypes.to_dict() == antes.dtypes.to_dict()
+    pd.testing.assert_frame_equal(despues, antes.reset_index(drop=True), check_categorical=False)
+
+
+def test_lee_solo_los_registros_nuevos(almacen):
+    almacen.escribir('Productos', _productos())
+    original = almacen.leer('Productos')
+    editado = original.copy()
+    editado.loc[0, 'precio'] = 12.0
+    almacen.guardar_cambios('Productos', original, editado)
+    primeros = almacen.registros()
+
+    siguiente = editado.copy()
+    siguiente.loc[1, 'precio'] = 21.0
+    almacen.guardar_cambios('Productos', almacen.leer('Productos'), siguiente)
+
+    registros = almacen.registros()
+    assert len(registros) == 2
+    # Los registros ya leídos no se vuelven a parsear
+    assert registros[0] is primeros[0]
+    assert list(almacen.leer('Productos')['precio']) == [12.0, 21.0, 30.0]
+
+
+def test_linea_incompleta_se_ignora_y_se_descarta(almacen):
+    almacen.escribir('Productos', _productos())
+    original = almacen.leer('Productos')
+    editado = original.copy()
+    editado.loc[0, 'precio'] = 12.0
+    almacen.guardar_cambios('Productos', original, editado)
+    # Un guardado interrumpido deja una línea sin terminar
+    with open(almacen.ruta_diario, 'a', encoding='utf-8') as f:
+        f.write('{"hoja": "Productos", "insert')
+    assert len(almacen.registros()) == 1
+
+    siguiente = almacen.leer('Productos')
+    cambiado = siguiente.copy()
+    cambiado.loc[1, 'precio'] = 21.0
+    almacen.guardar_cambios('Productos', siguiente, cambiado)
+
+    assert len(almacen.registros()) == 2
+    with open(almacen.ruta_diario, encoding='utf-8') as f:
+        lineas = f.read().split('\n')
+    assert lineas[-1] == ''
+    assert [json.loads(linea)['hoja'] for linea in lineas[:-1]] == ['Productos', 'Productos']
+
+
+def test_filas_y_cantidad_de_filas_por_pagina(almacen):
+    almacen.escribir('Productos', _productos())
+    assert almacen.contar_filas('Productos') == 3
+    pd.testing.assert_frame_equal(almacen.leer_filas('Productos', 1, 3), almacen.leer('Productos').iloc[1:3])
+
+    original = almacen.leer('Productos')
+    almacen.guardar_cambios('Productos', original, original.drop(index=[1]))
+    assert almacen.contar_filas('Productos') == 2
+    assert list(almacen.leer_filas('Productos', 1, 3)['id']) == [3]
+
+
+def _reabrir(almacen):
+    from almacenamiento import AlmacenParquet
+    from cache_libros import CacheLibros
+    from diario import AlmacenConDiario
+
+    base = AlmacenParquet(almacen.base.directorio, cache=CacheLibros(10 ** 8))
+    return AlmacenConDiario(base, almacen.ruta_diario, maximo_registros=100)
+
+
+def test_compactar_interrumpida_no_aplica_dos_veces_el_diario(almacen, monkeypatch):
+    almacen.escribir('Productos', _productos())
+    original = almacen.leer('Productos')
+    editado = original.drop(index=[0])
+    editado.loc[2, 'precio'] = 35.0
+    nueva = pd.DataFrame({'id': [4], 'nombre': ['Resina'], 'categoria': ['Flores'],
+                          'precio': [40.0], 'fecha_alta': [pd.Timestamp('2024-04-01')]}, index=[None])
+    almacen.guardar_cambios('Productos', original, pd.concat([editado, nueva]))
+    esperado = almacen.leer('Productos').reset_index(drop=True)
+
+    # El proceso se corta después de reescribir la base y antes de vaciar el diario
+    def cortar(registros):
+        raise SystemExit
+    monkeypatch.setattr(almacen, '_reescribir_diario', cortar)
+    with pytest.raises(SystemExit):
+        almacen.compactar()
+    monkeypatch.undo()
+
+    reabierto = _reabrir(almacen)
+    assert reabierto.registros() == []
+    pd.testing.assert_frame_equal(reabierto.leer('Productos').reset_index(drop=True), esperado,
+                                  check_categorical=False)
+
+    reabierto.compactar()
+    assert not os.path.exists(reabierto.ruta_diario)
+    assert list(reabierto.leer('Productos')['id']) == [2, 3, 4]
+
+
+def test_compactar_interrumpida_antes_de_reescribir_conserva_el_diario(almacen, monkeypatch):
+    almacen.escribir('Productos', _productos())
+    original = almacen.leer('Productos')
+    almacen.guardar_cambios('Productos', original, original.drop(index=[1]))
+
+    def cortar(hoja, df):
+        raise SystemExit
+    monkeypatch.setattr(almacen.base, 'escribir', cortar)
+    with pytest.raises(SystemExit):
+        almacen.compactar()
+    monkeypatch.undo()
+
+    reabierto = _reabrir(almacen)
+    assert len(reabierto.registros()) == 1
+    assert list(reabierto.leer('Productos')['id']) == [1, 3]
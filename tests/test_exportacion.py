@@ -0,0 +1,33 @@
+import os
+
+import pandas as pd
+import pytest
+
+from exportacion import archivo_exportado, contenido_exportado, desde_df
+
+
+def _ventas():
+    return pd.DataFrame({'id': [1, 2, 3], 'total': [10.0, 20.5, 30.0]})
+
+
+def test_archivo_exportado_se_cierra_y_se_borra_al_salir():
+    with archivo_exportado(desde_df(_ventas(), filas=2), 'csv') as archivo:
+        ruta = archivo.name
+        assert archivo.read().decode('utf-8').splitlines() == ['id,total', '1,10.0', '2,20.5', '3,30.0']
+    assert archivo.closed
+    assert not os.path.exists(ruta)
+
+
+def test_archivo_exportado_se_borra_si_falla_la_exportacion():
+    with pytest.raises(ValueError):
+        with archivo_exportado(desde_df(_ventas()), 'csv') as archivo:
+            ruta = archivo.name
+            raise ValueError
+    assert not os.path.exists(ruta)
+
+
+def test_contenido_exportado_no_deja_temporales(tmp_path, monkeypatch):
+    monkeypatch.setattr('tempfile.tempdir', str(tmp_path))
+    contenido = contenido_exportado(desde_df(_ventas()), 'csv')
+    assert contenido.startswith(b'id,total')
+    assert os.listdir(tmp_path) == []
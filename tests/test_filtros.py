@@ -0,0 +1,99 @@
+import pandas as pd
+import pytest
+
+from consultas import MotorConsultas
+from filtros import MAXIMO_VALORES_IN, FiltroDatos, dividir_predicados, filtrar
+
+
+def _ventas():
+    return pd.DataFrame({
+        'id': [1, 2, 3, 4],
+        'dispensario_id': pd.array([1, 2, 1, None], dtype='Int64'),
+        'fecha_venta': pd.to_datetime(['2024-01-01 09:00', '2024-01-02 18:30', '2024-01-03 00:00', None]),
+        'total': [10.0, 20.0, 30.0, 40.0],
+    })
+
+
+def _detalle():
+    return pd.DataFrame({'id': [10, 11, 12, 13], 'venta_id': [1, 2, 3, 4], 'cantidad': [1, 2, 3, 4]})
+
+
+def test_predicados_por_hoja():
+    filtro = FiltroDatos(1, '2024-01-01', '2024-01-02')
+    assert filtro.predicados('Ventas') == [
+        ('dispensario_id', '==', 1),
+        ('fecha_venta', '>=', pd.Timestamp('2024-01-01')),
+        ('fecha_venta', '<', pd.Timestamp('2024-01-03')),
+    ]
+    assert filtro.predicados('Inventario_Dispensario') == [('dispensario_id', '==', 1)]
+    assert filtro.predicados('Productos') is None
+    assert FiltroDatos().vacio() and FiltroDatos().predicados('Ventas') is None
+
+
+def test_filtrar_incluye_el_ultimo_dia_y_descarta_vacios():
+    filtro = FiltroDatos(desde='2024-01-01', hasta='2024-01-02')
+    assert list(filtrar(_ventas(), filtro.predicados('Ventas'))['id']) == [1, 2]
+    assert list(filtrar(_ventas(), [('dispensario_id', '!=', 1)])['id']) == [2]
+
+
+def test_filtrar_ignora_columnas_inexistentes():
+    df = _ventas()
+    assert len(filtrar(df, [('otra', '==', 1)])) == len(df)
+    assert filtrar(df, None) is df
+
+
+def test_filtrar_operador_desconocido():
+    with pytest.raises(ValueError):
+        filtrar(_ventas(), [('id', 'like', 1)])
+
+
+def test_predicados_por_referencia():
+    filtro = FiltroDatos(1)
+    leidas = []
+
+    def leer(hoja, columnas, predicados):
+        leidas.append((hoja, columnas))
+        return filtrar(_ventas(), predicados)[columnas]
+
+    predicados = filtro.predicados_con_referencias('Detalle_Venta', leer)
+    assert predicados == [('venta_id', 'in', (1, 3))]
+    assert leidas == [('Ventas', ['id'])]
+    assert list(filtrar(_detalle(), predicados)['id']) == [10, 12]
+    # Sin filtros no se lee la hoja de referencia
+    assert FiltroDatos().predicados_con_referencias('Detalle_Venta', leer) is None
+    assert len(leidas) == 1
+
+
+def test_dividir_predicados():
+    chico = ('venta_id', 'in', tuple(range(MAXIMO_VALORES_IN)))
+    grande = ('venta_id', 'in', tuple(range(MAXIMO_VALORES_IN + 1)))
+    fecha = ('fecha_venta', '>=', pd.Timestamp('2024-01-01'))
+
+    assert dividir_predicados([fecha, chico, grande]) == ([fecha, chico], [grande])
+    assert dividir_predicados([grande]) == (None, [grande])
+    assert dividir_predicados(None) == (None, None)
+
+
+def _detalle_grande():
+    return pd.DataFrame({'id': range(3000), 'venta_id': range(3000), 'cantidad': 1})
+
+
+@pytest.mark.parametrize('valores', [(5, 7, 2999), tuple(range(0, 3000, 2))])
+def test_almacen_parquet_aplica_in_al_leer_o_despues(almacen, valores):
+    almacen.escribir('Detalle_Venta', _detalle_grande())
+    predicados = [('venta_id', 'in', valores)]
+
+    df = almacen.leer('Detalle_Venta', ['id', 'cantidad'], predicados)
+
+    assert list(df.columns) == ['id', 'cantidad']
+    assert list(df['id']) == list(valores)
+    assert list(df.index) == list(range(len(valores)))
+
+
+@pytest.mark.parametrize('valores', [(5, 7, 2999), tuple(range(0, 3000, 2))])
+def test_motor_consultas_filtra_con_in_chico_o_grande(valores):
+    with MotorConsultas() as motor:
+        motor.registrar('Detalle_Venta', _detalle_grande(), [('venta_id', 'in', valores)])
+        total = motor.consultar('SELECT COUNT(*) AS filas, SUM(venta_id) AS suma FROM Detalle_Venta')
+    assert total.loc[0, 'filas'] == len(valores)
+    assert total.loc[0, 'suma'] == sum(valores)
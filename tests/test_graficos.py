@@ -0,0 +1,22 @@
+import numpy as np
+import pandas as pd
+
+from graficos import _reducir_serie
+
+
+def _ventas_por_hora():
+    fechas = pd.date_range('2024-01-01', periods=24 * 60, freq='h')
+    return pd.DataFrame({'fecha_venta': fechas, 'total': np.ones(len(fechas))})
+
+
+def test_reducir_serie_suma_los_totales_por_intervalo():
+    ventas = _ventas_por_hora()
+    reducida = _reducir_serie(ventas, 'fecha_venta', 'total', 100, agregacion='sum')
+    assert len(reducida) <= 100
+    assert reducida['total'].sum() == ventas['total'].sum()
+    assert (reducida['total'] == 24).all()
+
+
+def test_reducir_serie_promedia_los_niveles_por_intervalo():
+    reducida = _reducir_serie(_ventas_por_hora(), 'fecha_venta', 'total', 100)
+    assert (reducida['total'] == 1).all()
@@ -0,0 +1,60 @@
+import io
+import os
+
+import pytest
+
+pytest.importorskip('pyarrow')
+openpyxl = pytest.importorskip('openpyxl')
+
+from cache_libros import CacheLibros, huella_archivo
+from esquemas import Tipado
+from ingesta import ingerir_archivo_subido, ingerir_libro, podar_ingestas
+
+
+# Libro con una columna declarada ('cantidad') y otra sin esquema ('lote') que
+# son enteras en las primeras filas y traen decimales más adelante
+def _libro_con_decimales():
+    libro = openpyxl.Workbook()
+    hoja = libro.active
+    hoja.title = 'Inventario_Deposito'
+    hoja.append(['id', 'producto_id', 'cantidad', 'lote'])
+    for fila in [(1, 1, 10, 100), (2, 2, 20, 200), (3, 3, 2.5, 300.75), (4, 1, 40, 400)]:
+        hoja.append(fila)
+    archivo = io.BytesIO()
+    libro.save(archivo)
+    archivo.seek(0)
+    return archivo
+
+
+def test_ingesta_admite_decimales_en_bloques_posteriores(tmp_path):
+    almacen = ingerir_libro(_libro_con_decimales(), str(tmp_path / 'volcado'),
+                            cache=CacheLibros(10 ** 8), tamano_bloque=2)
+    df = almacen.leer('Inventario_Deposito')
+    assert df['cantidad'].tolist() == [10, 20, 2.5, 40]
+    assert df['lote'].tolist() == [100, 200, 300.75, 400]
+
+
+def test_ingesta_tipada_con_decimales_restaura_ids(tmp_path):
+    almacen = ingerir_libro(_libro_con_decimales(), str(tmp_path / 'volcado'), preparar=Tipado(),
+                            cache=CacheLibros(10 ** 8), tamano_bloque=2)
+    df = almacen.leer('Inventario_Deposito')
+    assert df['id'].dtype.name.startswith('Int')
+    assert df['cantidad'].dtype == 'float64'
+    assert df['cantidad'].tolist() == [10, 20, 2.5, 40]
+
+
+def test_ingesta_reutiliza_volcado_y_poda_los_viejos(tmp_path, monkeypatch):
+    monkeypatch.setenv('CANNABIS_INGESTAS_CONSERVADAS', '2')
+    base = tmp_path / 'ingesta'
+    for i, nombre in enumerate(['viejo', 'medio']):
+        (base / nombre).mkdir(parents=True)
+        os.utime(base / nombre, (1000 + i, 1000 + i))
+
+    archivo = _libro_con_decimales()
+    huella = huella_archivo(archivo)
+    assert archivo.tell() == 0
+    ingerir_archivo_subido(archivo, cache=CacheLibros(10 ** 8), directorio_base=str(base), huella=huella)
+    assert sorted(os.listdir(base)) == sorted(['medio', huella[:32]])
+
+    podar_ingestas(str(base), cantidad=0, conservar=[str(base / huella[:32])])
+    assert os.listdir(base) == [huella[:32]]
@@ -0,0 +1,27 @@
+import re
+
+from metricas import TRAMOS_PROMETHEUS, TRAMOS_VARIABLES, MetricasAcumuladas, Perfil
+
+
+def _perfil(*nombres):
+    perfil = Perfil()
+    for nombre in nombres:
+        with perfil.tramo(nombre) as actual:
+            actual.agregar_filas(10)
+    return perfil.terminar()
+
+
+def test_etiquetas_prometheus_no_dependen_de_los_datos():
+    metricas = MetricasAcumuladas()
+    metricas.registrar(_perfil('load_data', 'carga/paralela', 'carga/Ventas', 'carga/Productos',
+                               'guardado/encolar/Hoja "rara"', 'grafico/enviar/Ventas por mes'))
+    metricas.registrar(_perfil('carga/Ventas', 'tramo/nuevo'))
+
+    texto = metricas.a_prometheus()
+    etiquetas = set(re.findall(r'tramo="([^"]*)"', texto))
+    assert etiquetas == {'load_data', 'carga/paralela', 'carga', 'guardado/encolar', 'grafico/enviar', 'otros'}
+    assert etiquetas <= set(TRAMOS_PROMETHEUS) | set(TRAMOS_VARIABLES) | {'otros'}
+    assert 'cannabis_tramo_segundos_count{tramo="carga"} 3' in texto
+    assert 'cannabis_tramo_filas_total{tramo="carga"} 30' in texto
+    # El detalle por nombre se conserva fuera de Prometheus
+    assert {'carga/Ventas', 'carga/Productos'} <= set(metricas.por_tramo)
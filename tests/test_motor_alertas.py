@@ -0,0 +1,165 @@
+import pandas as pd
+import pytest
+
+from motor_alertas import ACTIVA, AUTOMATICA, RESUELTA, MotorAlertas
+
+AHORA = pd.Timestamp('2024-06-01 10:00:00')
+
+
+def _deposito():
+    return pd.DataFrame({
+        'id': [1, 2, 3],
+        'producto_id': [1, 2, 3],
+        'cantidad': [5, 50, 200],
+        'stock_minimo': [20, 10, 10],
+        'stock_maximo': [100, 100, 100],
+    })
+
+
+def _manual(producto_id, tipo='Stock_Bajo', mensaje='Revisar stock'):
+    return pd.DataFrame({
+        'id': [1],
+        'tipo_alerta': [tipo],
+        'producto_id': pd.array([producto_id], dtype='Int64'),
+        'dispensario_id': pd.array([pd.NA], dtype='Int64'),
+        'mensaje': [mensaje],
+        'fecha_creacion': [pd.Timestamp('2024-05-01')],
+        'fecha_vencimiento': [pd.NaT],
+        'estado': [ACTIVA],
+        'prioridad': ['Alta'],
+        'origen': [None],
+    })
+
+
+def _evaluar(motor, hojas, alertas=None, firma='v1'):
+    motor.sincronizar({hoja: firma for hoja in hojas})
+    return motor.aplicar(alertas, hojas.get, AHORA)
+
+
+def test_crea_alertas_de_stock_bajo_y_excedido():
+    alertas = _evaluar(MotorAlertas(), {'Inventario_Deposito': _deposito()})
+
+    assert list(alertas['tipo_alerta']) == ['Stock_Bajo', 'Stock_Excedido']
+    assert list(alertas['producto_id']) == [1, 3]
+    assert list(alertas['id']) == [1, 2]
+    assert alertas.loc[0, 'mensaje'] == 'Stock crítico: quedan 5 (mínimo 20)'
+    assert alertas.loc[0, 'prioridad'] == 'Critica'
+    assert (alertas['origen'] == AUTOMATICA).all()
+    assert (alertas['estado'] == ACTIVA).all()
+    assert (alertas['fecha_creacion'] == AHORA).all()
+
+
+def test_sin_cambios_devuelve_none():
+    motor = MotorAlertas()
+    hojas = {'Inventario_Deposito': _deposito()}
+    alertas = _evaluar(motor, hojas)
+    assert motor.al_dia({'Inventario_Deposito': 'v1'})
+    assert motor.aplicar(alertas, hojas.get, AHORA) is None
+    # La misma versión no se vuelve a evaluar
+    assert _evaluar(motor, hojas, alertas) is None
+    assert not motor.al_dia({'Inventario_Deposito': 'v2'})
+
+
+def test_no_modifica_alertas_cargadas_a_mano():
+    manual = _manual(1)
+    alertas = _evaluar(MotorAlertas(), {'Inventario_Deposito': _deposito()}, manual)
+
+    # La alerta manual sigue igual y no se crea otra para la misma clave
+    pd.testing.assert_series_equal(alertas.loc[0, manual.columns].astype(object),
+                                   manual.loc[0].astype(object), check_names=False)
+    assert (alertas['producto_id'] == 1).sum() == 1
+    nuevas = alertas.iloc[1:]
+    assert list(nuevas['tipo_alerta']) == ['Stock_Excedido']
+    assert list(nuevas['id']) == [2]
+
+
+def test_no_resuelve_alertas_manuales_que_ya_no_se_cumplen():
+    # El producto 2 no tiene stock bajo, pero la alerta es manual
+    alertas = _evaluar(MotorAlertas(), {'Inventario_Deposito': _deposito()}, _manual(2))
+    assert alertas.loc[0, 'estado'] == ACTIVA
+    assert alertas.loc[0, 'mensaje'] == 'Revisar stock'
+
+
+def test_cambios_actualizan_y_resuelven_solo_las_claves_marcadas():
+    motor = MotorAlertas()
+    original = _deposito()
+    alertas = _evaluar(motor, {'Inventario_Deposito': original})
+    evaluadas = motor.estado['filas_evaluadas']
+
+    editado = original.copy()
+    editado.loc[0, 'cantidad'] = 15
+    editado.loc[2, 'cantidad'] = 50
+    motor.registrar_cambios('Inventario_Deposito', original, editado, 'v1', 'v2')
+    resultado = motor.aplicar(alertas, {'Inventario_Deposito': editado}.get, AHORA)
+
+    assert resultado.loc[0, 'mensaje'] == 'Stock bajo: quedan 15 (mínimo 20)'
+    assert resultado.loc[0, 'prioridad'] == 'Alta'
+    assert resultado.loc[0, 'estado'] == ACTIVA
+    assert resultado.loc[1, 'estado'] == RESUELTA
+    assert len(resultado) == 2
+    # Solo se evaluaron las filas de los productos que cambiaron (dos por regla)
+    assert motor.estado['filas_evaluadas'] - evaluadas == 4
+    assert motor.al_dia({'Inventario_Deposito': 'v2'})
+
+
+def test_guardado_sobre_otra_version_evalua_la_hoja_completa():
+    motor = MotorAlertas()
+    original = _deposito()
+    alertas = _evaluar(motor, {'Inventario_Deposito': original})
+    editado = original.copy()
+    editado.loc[1, 'cantidad'] = 1
+
+    motor.registrar_cambios('Inventario_Deposito', original, editado, 'otra', 'v3')
+    evaluadas = motor.estado['filas_evaluadas']
+    resultado = motor.aplicar(alertas, {'Inventario_Deposito': editado}.get, AHORA)
+
+    assert motor.estado['filas_evaluadas'] - evaluadas == 2 * len(editado)
+    assert list(resultado['producto_id']) == [1, 3, 2]
+
+
+def test_control_de_calidad_usa_el_ultimo_control():
+    controles = pd.DataFrame({
+        'producto_id': [1, 1, 2],
+        'fecha_control': pd.to_datetime(['2024-01-01', '2024-02-01', '2024-01-15']),
+        'resultado': ['Aprobado', 'Rechazado', 'Pendiente'],
+        'observaciones': [None, 'Contaminación', None],
+    })
+    alertas = _evaluar(MotorAlertas(), {'Control_Calidad': controles})
+
+    por_producto = alertas.set_index('producto_id')
+    assert sorted(por_producto.index) == [1, 2]
+    assert por_producto.loc[1, 'mensaje'] == 'Control de calidad rechazado: Contaminación'
+    assert por_producto.loc[1, 'prioridad'] == 'Critica'
+    assert por_producto.loc[2, 'mensaje'] == 'Producto pendiente de aprobación de calidad'
+    assert por_producto.loc[2, 'prioridad'] == 'Media'
+
+
+def test_alertas_por_dispensario_llevan_su_dispensario():
+    dispensario = pd.DataFrame({
+        'producto_id': [1, 1],
+        'dispensario_id': [1, 2],
+        'cantidad': [1, 30],
+        'stock_minimo': [10, 10],
+    })
+    alertas = _evaluar(MotorAlertas(), {'Inventario_Dispensario': dispensario})
+    assert len(alertas) == 1
+    assert alertas.loc[0, 'dispensario_id'] == 1
+    assert alertas.loc[0, 'tipo_alerta'] == 'Stock_Bajo'
+
+
+def test_si_falla_el_guardado_las_filas_siguen_marcadas():
+    motor = MotorAlertas()
+    hojas = {'Inventario_Deposito': _deposito()}
+    motor.sincronizar({'Inventario_Deposito': 'v1'})
+
+    def fallar(nuevas):
+        raise OSError('disco lleno')
+    with pytest.raises(OSError):
+        motor.aplicar(None, hojas.get, AHORA, guardar=fallar)
+    assert motor.pendiente()
+
+    guardadas = []
+    alertas = motor.aplicar(None, hojas.get, AHORA, guardar=guardadas.append)
+    assert guardadas and guardadas[0] is alertas
+    assert list(alertas['producto_id']) == [1, 3]
+    assert not motor.pendiente()
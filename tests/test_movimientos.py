@@ -0,0 +1,112 @@
+import pandas as pd
+import pytest
+
+from movimientos import (AJUSTE, DEPOSITO, INGRESO, TRASLADO, VENTA, LibroInventario, MovimientoInvalido,
+                         movimientos_de_ventas, movimientos_iniciales, validar)
+
+
+def _stock(libro, fecha=None):
+    stock = libro.stock(fecha)
+    return {(int(p), None if pd.isna(d) else int(d)): c
+            for p, d, c in zip(stock['producto_id'], stock['dispensario_id'], stock['cantidad'])}
+
+
+def _registrar_dia(libro):
+    return libro.registrar([
+        {'fecha': '2024-01-01', 'tipo': INGRESO, 'producto_id': 1, 'hacia': DEPOSITO, 'cantidad': 100},
+        {'fecha': '2024-01-02', 'tipo': TRASLADO, 'producto_id': 1, 'desde': DEPOSITO, 'hacia': 1, 'cantidad': 30},
+        {'fecha': '2024-01-03', 'tipo': VENTA, 'producto_id': 1, 'desde': 1, 'cantidad': 5, 'referencia': 'v1'},
+        {'fecha': '2024-01-04', 'tipo': AJUSTE, 'producto_id': 2, 'hacia': 1, 'cantidad': -2},
+    ])
+
+
+def test_stock_actual_y_a_una_fecha(tmp_path):
+    libro = LibroInventario(str(tmp_path), por_snapshot=1000)
+    assert _registrar_dia(libro) == [1, 2, 3, 4]
+
+    assert _stock(libro) == {(1, None): 70.0, (1, 1): 25.0, (2, 1): -2.0}
+    assert _stock(libro, '2024-01-02') == {(1, None): 70.0, (1, 1): 30.0}
+    assert _stock(libro, '2023-12-31') == {}
+
+
+def test_snapshots_y_stock_desde_un_libro_nuevo(tmp_path):
+    libro = LibroInventario(str(tmp_path), por_snapshot=2)
+    _registrar_dia(libro)
+
+    snapshots = libro.snapshots()
+    assert [s['secuencia'] for s in snapshots] == [4]
+    libro.registrar([{'fecha': '2024-01-05', 'tipo': INGRESO, 'producto_id': 2, 'hacia': 1, 'cantidad': 10}])
+
+    # Otro proceso parte del último snapshot y lee solo los movimientos posteriores
+    otro = LibroInventario(str(tmp_path), por_snapshot=2)
+    assert _stock(otro) == {(1, None): 70.0, (1, 1): 25.0, (2, 1): 8.0}
+    # A una fecha anterior al snapshot se recalcula desde el principio
+    assert _stock(otro, '2024-01-03') == {(1, None): 70.0, (1, 1): 25.0}
+
+
+def test_registro_interrumpido_se_descarta(tmp_path):
+    libro = LibroInventario(str(tmp_path))
+    _registrar_dia(libro)
+    with open(libro.ruta, 'a', encoding='utf-8') as f:
+        f.write('{"secuencia": 5, "tipo": "ingre')
+    assert _stock(libro)[(1, None)] == 70.0
+
+    assert libro.registrar([{'fecha': '2024-01-05', 'tipo': INGRESO, 'producto_id': 1, 'hacia': DEPOSITO,
+                             'cantidad': 1}]) == [5]
+    assert len(libro.historial()) == 5
+    assert _stock(libro)[(1, None)] == 71.0
+
+
+def test_historial_filtra_por_producto_y_fechas(tmp_path):
+    libro = LibroInventario(str(tmp_path))
+    _registrar_dia(libro)
+    historial = libro.historial(producto_id=1, desde_fecha='2024-01-02')
+    assert list(historial['tipo']) == [TRASLADO, VENTA]
+    assert libro.referencias() == {'v1'}
+
+
+@pytest.mark.parametrize('movimiento', [
+    {'tipo': 'regalo', 'producto_id': 1, 'hacia': DEPOSITO, 'cantidad': 1},
+    {'tipo': INGRESO, 'producto_id': 1, 'desde': DEPOSITO, 'hacia': 1, 'cantidad': 1},
+    {'tipo': VENTA, 'producto_id': 1, 'desde': 1, 'cantidad': 0},
+    {'tipo': TRASLADO, 'producto_id': 1, 'desde': 1, 'hacia': 1, 'cantidad': 1},
+    {'tipo': AJUSTE, 'producto_id': 1, 'hacia': 1, 'cantidad': 0},
+    {'tipo': INGRESO, 'producto_id': 1, 'hacia': 'bodega', 'cantidad': 1},
+    {'tipo': INGRESO, 'hacia': DEPOSITO, 'cantidad': 1},
+])
+def test_movimientos_invalidos(movimiento, tmp_path):
+    with pytest.raises(MovimientoInvalido):
+        validar(movimiento)
+    libro = LibroInventario(str(tmp_path))
+    with pytest.raises(MovimientoInvalido):
+        libro.registrar([movimiento])
+    assert not libro.existe()
+
+
+def test_movimientos_iniciales_desde_el_inventario():
+    deposito = pd.DataFrame({'producto_id': [1, 2], 'cantidad': [10, 0]})
+    dispensario = pd.DataFrame({'producto_id': [1], 'dispensario_id': [3], 'cantidad': [4]})
+    movimientos = movimientos_iniciales(deposito, dispensario, fecha='2024-01-01')
+    assert [(m['producto_id'], m['hacia'], m['cantidad']) for m in movimientos] == [(1, DEPOSITO, 10), (1, 3, 4)]
+    assert all(m['tipo'] == AJUSTE for m in movimientos)
+
+
+def test_movimientos_de_ventas_nuevas():
+    ventas = pd.DataFrame({
+        'id': [1, 2, 3, 4],
+        'dispensario_id': [1, 1, 2, 2],
+        'fecha_venta': pd.to_datetime(['2023-12-31', '2024-01-02', '2024-01-02', '2024-01-03']),
+        'estado': ['Completada', 'Completada', 'Cancelada', 'Completada'],
+    })
+    detalle = pd.DataFrame({
+        'id': [10, 11, 12, 13, 14],
+        'venta_id': [1, 2, 3, 4, 4],
+        'producto_id': [1, 1, 2, 2, 3],
+        'cantidad': [1, 2, 3, 4, 5],
+    })
+    movimientos = movimientos_de_ventas(ventas, detalle, registradas={'Detalle_Venta:14'},
+                                        desde=pd.Timestamp('2024-01-01'))
+
+    # Sin la venta anterior al libro, la cancelada ni la línea ya registrada
+    assert [m['referencia'] for m in movimientos] == ['Detalle_Venta:11', 'Detalle_Venta:13']
+    assert [(m['producto_id'], m['desde'], m['cantidad']) for m in movimientos] == [(1, 1, 2), (2, 2, 4)]
@@ -0,0 +1,213 @@
+# Vigilante de data/db.xlsx.
+# Otros procesos pueden reemplazar el libro mientras la app está en uso. Un hilo
+# en segundo plano revisa cada pocos segundos la fecha de modificación y el
+# tamaño del archivo; cuando cambian, compara la huella de cada hoja (el CRC que
+# el .xlsx, que es un zip, ya guarda de cada uno de sus archivos) con la de la
+# versión anterior, sin parsear nada. Solo se vuelven a parsear las hojas que
+# cambiaron y que la app ya tenía cargadas; las que no cambiaron se reutilizan.
+# La versión nueva se publica de una vez en la caché de libros: hasta entonces
+# las lecturas siguen viendo la anterior, así que ninguna ejecución de la app
+# espera un parseo. El backend Parquet no se vigila: sus lecturas son por
+# columnas y no necesitan parsear un libro.
+import hashlib
+import logging
+import os
+import posixpath
+import threading
+import time
+import zipfile
+from xml.etree import ElementTree
+
+from cache_libros import clave_archivo, identificar_origen
+from carga_paralela import parsear_hojas
+
+logger = logging.getLogger('cannabis.vigilante')
+
+# Segundos entre revisiones (configurable con CANNABIS_VIGILANTE_SEGUNDOS; 0 lo desactiva)
+SEGUNDOS_POR_DEFECTO = 2.0
+
+_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_NS_RELACION = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_NS_PAQUETE = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+
+def intervalo_segundos():
+    try:
+        return float(os.environ.get('CANNABIS_VIGILANTE_SEGUNDOS', SEGUNDOS_POR_DEFECTO))
+    except ValueError:
+        return SEGUNDOS_POR_DEFECTO
+
+
+# Ruta dentro del zip de un destino de xl/_rels/workbook.xml.rels
+def _miembro(destino):
+    if destino.startswith('/'):
+        return destino.lstrip('/')
+    return posixpath.normpath(posixpath.join('xl', destino))
+
+
+# Huella de la tabla de textos compartidos: (CRC, cantidad de textos, resumen de
+# todos los textos, resumen de los primeros `prefijo` textos)
+def _huella_textos(libro, miembro, info, prefijo):
+    if info is None:
+        return None
+    resumen = hashlib.sha1()
+    resumen_prefijo = resumen.copy() if prefijo == 0 else None
+    cantidad = 0
+    with libro.open(miembro) as f:
+        for _, elemento in ElementTree.iterparse(f):
+            if elemento.tag != f'{_NS}si':
+                continue
+            resumen.update(''.join(elemento.itertext()).encode('utf-8') + b'\0')
+            elemento.clear()
+            cantidad += 1
+            if cantidad == prefijo:
+                resumen_prefijo = resumen.copy()
+    return {
+        'crc': info.CRC,
+        'cantidad': cantidad,
+        'resumen': resumen.hexdigest(),
+        'resumen_prefijo': resumen_prefijo.hexdigest() if resumen_prefijo is not None else None,
+    }
+
+
+# Huella de cada hoja de un libro, leída del índice del zip (sin parsear las hojas).
+# `anterior` es la huella de la versión anterior, para comparar los textos compartidos.
+def huella_libro(ruta, anterior=None):
+    with zipfile.ZipFile(ruta) as libro:
+        infos = {info.filename: info for info in libro.infolist()}
+        relaciones = ElementTree.fromstring(libro.read('xl/_rels/workbook.xml.rels'))
+        destinos = {}
+        por_tipo = {}
+        for relacion in relaciones.iter(f'{_NS_PAQUETE}Relationship'):
+            miembro = _miembro(relacion.get('Target'))
+            destinos[relacion.get('Id')] = miembro
+            por_tipo[relacion.get('Type', '').rsplit('/', 1)[-1]] = miembro
+
+        definicion = ElementTree.fromstring(libro.read('xl/workbook.xml'))
+        hojas = {}
+        for hoja in definicion.iter(f'{_NS}sheet'):
+            info = infos.get(destinos.get(hoja.get(f'{_NS_RELACION}id')))
+            hojas[hoja.get('name')] = (info.CRC, info.file_size) if info is not None else None
+
+        # Los estilos definen qué celdas son fechas: si cambian, cambian todas las hojas
+        estilos = infos.get(por_tipo.get('styles'))
+        propiedades = definicion.find(f'{_NS}workbookPr')
+        comun = (
+            estilos.CRC if estilos is not None else None,
+            propiedades.get('date1904') if propiedades is not None else None,
+        )
+
+        miembro_textos = por_tipo.get('sharedStrings')
+        info_textos = infos.get(miembro_textos)
+        textos = anterior['textos'] if anterior is not None else None
+        if info_textos is None:
+            textos = None
+        elif textos is None or textos['crc'] != info_textos.CRC:
+            prefijo = textos['cantidad'] if textos is not None else None
+            textos = _huella_textos(libro, miembro_textos, info_textos, prefijo)
+    return {'hojas': hojas, 'comun': comun, 'textos': textos}
+
+
+# Hojas de `nueva` cuyo contenido puede ser distinto del de `anterior`
+def hojas_cambiadas(anterior, nueva):
+    if anterior is None or anterior['comun'] != nueva['comun']:
+        return list(nueva['hojas'])
+    textos_antes, textos_ahora = anterior['textos'], nueva['textos']
+    if textos_antes != textos_ahora:
+        # Las hojas guardan el número de cada texto compartido: si la tabla solo
+        # creció al final, los números que ya existían siguen siendo los mismos textos
+        crecio = (
+            textos_antes is not None and textos_ahora is not None
+            and textos_ahora['resumen_prefijo'] == textos_antes['resumen']
+        )
+        if not crecio:
+            return list(nueva['hojas'])
+    return [
+        hoja for hoja, huella in nueva['hojas'].items()
+        if huella is None or anterior['hojas'].get(hoja) != huella
+    ]
+
+
+class Vigilante:
+    # `almacen` es un AlmacenExcel; `ejecutor`, el pool de procesos para parsear
+    # (ver carga_paralela.py), así el parseo no compite con la app por el GIL
+    def __init__(self, almacen, intervalo=None, ejecutor=None):
+        self.almacen = almacen
+        self.intervalo = intervalo if intervalo is not None else intervalo_segundos()
+        self.ejecutor = ejecutor
+        self._firma = None
+        self._huella = None
+        self._publicada = None
+        self._detener = threading.Event()
+        self._hilo = None
+        self.estado = {'revisiones': 0, 'versiones': 0, 'hojas_parseadas': 0, 'ultima_version': None, 'error': None}
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._ejecutar, name='vigilante-datos', daemon=True)
+        self._hilo.start()
+        return self
+
+    def detener(self):
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join()
+
+    def _ejecutar(self):
+        while not self._detener.is_set():
+            try:
+                self.revisar()
+                self.estado['error'] = None
+            except Exception as e:
+                # Un archivo a medio copiar no es un zip válido: se reintenta en la próxima revisión
+                self.estado['error'] = f"{type(e).__name__}: {e}"
+                logger.warning("No se pudo revisar %s: %s", self.almacen.ruta, e)
+            self._detener.wait(self.intervalo)
+
+    # Publica la versión actual del libro si cambió desde la última revisión.
+    # Devuelve las hojas que se parsearon.
+    def revisar(self):
+        ruta = self.almacen.ruta
+        self.estado['revisiones'] += 1
+        if not os.path.exists(ruta):
+            return []
+        firma = clave_archivo(ruta)
+        if firma == self._firma:
+            return []
+
+        cache, preparar = self.almacen.cache, self.almacen.preparar
+        clave, _ = identificar_origen(ruta, preparar)
+        huella = huella_libro(ruta, self._huella)
+        # Solo se parsean las hojas que cambiaron y que ya estaban en uso; las
+        # demás se cargarán cuando alguien las pida, como siempre
+        cambiadas = hojas_cambiadas(self._huella, huella)
+        en_uso = [
+            hoja for hoja in cambiadas
+            if self._publicada is not None and cache.contiene(self._publicada + (hoja,))
+            and not cache.contiene(clave + (hoja,))
+        ]
+        parseadas = parsear_hojas(ruta, en_uso, preparar, self.ejecutor) if en_uso else {}
+        if clave_archivo(ruta) != firma:
+            # El archivo se volvió a reemplazar mientras se leía: se publica en la próxima revisión
+            return []
+
+        conservar = [hoja for hoja in huella['hojas'] if hoja not in cambiadas]
+        cache.nueva_version(ruta, preparar, self._publicada, clave, list(huella['hojas']), parseadas, conservar,
+                            publicar=True)
+        if self._publicada is not None:
+            logger.info("Nueva versión de %s: %d hojas cambiadas, %d parseadas", ruta, len(cambiadas), len(parseadas))
+            self.estado['versiones'] += 1
+            self.estado['hojas_parseadas'] += len(parseadas)
+            self.estado['ultima_version'] = time.time()
+        self._firma, self._huella, self._publicada = firma, huella, clave
+        return list(parseadas)
+
+
+# Inicia el vigilante del almacén por defecto. Devuelve None si está desactivado
+# o si el almacén no es un libro Excel.
+def iniciar_vigilante(almacen, ejecutor=None):
+    # El diario se aplica al leer: se vigila el almacén de base
+    almacen = getattr(almacen, 'base', almacen)
+    intervalo = intervalo_segundos()
+    if intervalo <= 0 or getattr(almacen, 'tipo', None) != 'xlsx':
+        return None
+    return Vigilante(almacen, intervalo, ejecutor).iniciar()